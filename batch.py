@@ -0,0 +1,269 @@
+# Batched population simulation
+# Steps along the compiled route once and advances the speed, SoC and time of every individual of a population as
+# vectors, so the array and solver math runs on population sized arrays instead of one individual at a time.
+# Individuals diverge at control stops and end of day (different global times) and when the speed solver fails; these
+# cases are handled with masks so that every individual follows exactly the per-individual logic of step.advanceStep.
+
+import time
+from datetime import datetime
+from datetime import timedelta
+
+import numpy as np
+
+import config
+import genome
+import instrument
+import solver
+import sun
+import sun_cache
+import world
+
+
+# Global times of the individuals from their offsets (s) to the race start time
+def _times(offset):
+    return [world.startTime + timedelta(seconds=float(seconds)) for seconds in offset]
+
+
+# Global times of the individuals as a datetime64 array
+def _times64(offset):
+    return np.datetime64(world.startTime, 'us') + np.round(np.asarray(offset) * 1e6).astype('timedelta64[us]')
+
+
+# Sun elevation, azimuth and irradiance for every individual at its own global time
+def _sunInfo(offset, timezone, location):
+    return sun_cache.positionArray(_times64(offset), timezone, location)
+
+
+# Array power collected by each individual at its global time (see car.arrayIn)
+def _arrayIn(solarCar, offset, timezone, location, heading, inclination, mode=0):
+    elevation, azimuth, insolation = _sunInfo(offset, timezone, location)
+    return solarCar.arrayPower(elevation, azimuth, insolation, heading, inclination, mode)
+
+
+# Battery charging with power (W) over one minute (see car.battIn)
+def _battIn(solarCar, battSoC, power):
+    return battSoC + 100 * (power * 1 / 60) / solarCar.BATT_CAPACITY * solarCar.BAT_CHARGE_EFF
+
+
+# Charge every individual for its own number of minutes
+# incrementFirst selects whether the clock is advanced before (end of day) or after (control stop) each minute
+def _charge(solarCar, offset, battSoC, minutes, timezone, location, heading, inclination, mode, incrementFirst):
+    minutes = np.broadcast_to(minutes, offset.shape)
+    if config.INSTRUMENT:
+        instrument.count('charge.minutes', int(np.maximum(minutes, 0).sum()))
+    if config.CHARGE_INTEGRATED:
+        # All windows of all individuals in one call (see car.chargeEnergy)
+        energy = solarCar.chargeEnergy(_times64(offset + 60. if incrementFirst else offset), minutes, timezone,
+                                       location, heading, inclination, mode)
+        battSoC += 100 * energy / solarCar.BATT_CAPACITY * solarCar.BAT_CHARGE_EFF
+        offset += 60. * np.maximum(minutes, 0)
+        return
+
+    heading = np.broadcast_to(heading, offset.shape)
+    inclination = np.broadcast_to(inclination, offset.shape)
+    for minute in range(int(np.max(minutes, initial=0))):
+        active = minute < minutes
+        if incrementFirst:
+            offset[active] += 60.
+        power = _arrayIn(solarCar, offset[active], timezone, location, heading[active], inclination[active], mode)
+        battSoC[active] = _battIn(solarCar, battSoC[active], solarCar.arrayOut(power))
+        if not incrementFirst:
+            offset[active] += 60.
+
+
+# Control stop charging (see step.advanceStep)
+def _controlStop(solarCar, offset, battSoC, timezone, location, heading, inclination):
+    # Time segment A
+    _charge(solarCar, offset, battSoC, config.CS_ENTER_TIME, timezone, location, heading, inclination, 0, False)
+
+    # Time segment B; position the array towards the sun's location halfway into the control stop
+    sunInclination, sunHeading, _ = _sunInfo(offset + 60. * config.CS_WAIT_TIME / 2, timezone, location)
+    _charge(solarCar, offset, battSoC, config.CS_WAIT_TIME, timezone, location, sunHeading, sunInclination, 0, False)
+
+    # Time segment C
+    _charge(solarCar, offset, battSoC, config.CS_EXIT_TIME, timezone, location, heading, inclination, 0, False)
+
+
+# Individuals taking the end of day stop after this step (see step.advanceStep)
+def _endOfDay(offset, timezone, location):
+    year, month, day, hour, minute, second = sun.timeFields(_times64(offset))
+    stop = (hour >= 17) & (minute >= 9)
+    # NOTE: cutting short at 9 minutes to ensure that we don't stop after 17:10!!!
+    decide = (hour >= 17) & (minute < 9)
+    if np.any(decide):
+        # The decision compares two close insolations and is always made on the exact sun position
+        eveningInsolation = sun.irradianceArray(sun.infoArray(_times64(offset[decide]), timezone, location))
+        morningInsolation = sun.irradianceArray(sun.infoArray(_times64(offset[decide] + 15 * 3600.), timezone,
+                                                              location))
+        stop[decide] = eveningInsolation >= morningInsolation
+    return stop
+
+
+# End of day / beginning of day charging for a subset of individuals (see step.processEOD)
+def _processEOD(solarCar, offset, battSoC, timezone, location, heading, inclination):
+    count = len(offset)
+    stopOffsetMins = np.empty(count, dtype=int)
+    sunrises = []
+    eveningMinutes = np.empty(count, dtype=int)
+    for i, gTime in enumerate(_times(offset)):
+        stopOffsetMins[i] = gTime.minute
+        sunrise, sunset = sun_cache.getSunRiseSetTime(gTime, timezone, location)
+        sunrises.append(sunrise)
+        eveningMinutes[i] = int((sunset - gTime).seconds / 60) - config.SE_END_SETUP_TIME
+
+    # 1. Evening charge
+    _charge(solarCar, offset, battSoC, config.SE_END_SETUP_TIME, timezone, location, heading, inclination, 0, True)
+    _charge(solarCar, offset, battSoC, eveningMinutes, timezone, location, heading, inclination, 2, True)
+
+    # 2. Morning charge from sunrise until the beginning of drive
+    morningMinutes = np.empty(count, dtype=int)
+    for i, gTime in enumerate(_times(offset)):
+        startTime = datetime(gTime.year, gTime.month, gTime.day + 1, 8, stopOffsetMins[i])
+        offset[i] = (sunrises[i] - world.startTime).total_seconds()
+        morningMinutes[i] = int((startTime - sunrises[i]).seconds / 60) - config.SE_START_SETUP_TIME
+    _charge(solarCar, offset, battSoC, morningMinutes, timezone, location, heading, inclination, 2, True)
+    _charge(solarCar, offset, battSoC, config.SE_START_SETUP_TIME, timezone, location, heading, inclination, 0, True)
+
+
+# Advance the individuals through step index of the route (see step.advanceStep)
+# The states (speed, battSoC, eTime, offset, valid) are updated in place
+def _advance(solarCar, rt, index, pbatt, speed, battSoC, eTime, offset, valid):
+    location = [float(rt.lat[index]), float(rt.lon[index])]
+    timezone = float(rt.timezone[index])
+    heading = float(rt.heading[index])
+    inclination = float(rt.inclination[index])
+
+    # Evaluate the car's step performance (see car.calcStepTime)
+    pin = _arrayIn(solarCar, offset, timezone, location, heading, inclination)
+    pout = solarCar.arrayOut(pin) + np.where(battSoC > 0, pbatt * solarCar.BAT_DISCHARGE_EFF, 0.)
+    pshaft = (pout - solarCar.ELEC_LP_POWER) * solarCar.MOT_EFF
+    omega, airspeed, converged = solver.stepSpeed(pshaft - solarCar.proll(speed, None), speed,
+                                                  float(rt.dist[index]), float(rt.rho[index]), inclination,
+                                                  solarCar.MASS, solarCar.CDA, world.g)
+    if config.INSTRUMENT:
+        instrument.count('solver.failures', int(np.count_nonzero(valid & ~converged)))
+    valid &= converged
+    airspeed = np.where(valid, airspeed, speed)     # Keep invalidated individuals finite
+    newSpeed = airspeed + rt.windSpd[index] * np.sin(np.deg2rad(90 - np.abs(rt.windDir[index] - heading)))
+    stepTime = rt.dist[index] / ((speed + newSpeed) / 2)
+    speed[:] = newSpeed
+    battSoC -= 100 * (pbatt * (stepTime / 3600) / solarCar.BATT_CAPACITY)
+
+    # Advance elapsed and global time (global time has the microsecond resolution of datetime)
+    eTime += stepTime
+    offset += np.round(stepTime, 6)
+
+    if rt.stepType[index] == 1:
+        if config.INSTRUMENT:
+            instrument.count('events.controlStop', len(offset))
+        _controlStop(solarCar, offset, battSoC, timezone, location, heading, inclination)
+
+    stop = _endOfDay(offset, timezone, location)
+    if np.any(stop):
+        if config.INSTRUMENT:
+            instrument.count('events.endOfDay', int(np.count_nonzero(stop)))
+        eodOffset = offset[stop]
+        eodSoC = battSoC[stop]
+        _processEOD(solarCar, eodOffset, eodSoC, timezone, location, heading, inclination)
+        offset[stop] = eodOffset
+        battSoC[stop] = eodSoC
+
+
+# Vectorized step.checkConstraints for the individuals rows after step index
+# Stops the individuals that fail (running) and sets their penalized elapsed time; individuals the car cannot traverse
+# the route with are stopped as well since their result is inf anyway, and counted as invalid (see world.countStopped)
+def _checkConstraints(rows, index, current, abortSoC, bound, running, penalized):
+    remaining = world.remainingTime[index]
+    valid = current['valid'][rows]
+    eTime = current['eTime'][rows]
+    infeasible = valid & (current['battSoC'][rows] < config.SIM_SOC_MIN) if abortSoC else np.zeros(len(rows), bool)
+    hopeless = valid & ~infeasible & (eTime + remaining > bound) if bound is not None else np.zeros(len(rows), bool)
+
+    penalized[rows[infeasible]] = config.SIM_INFEASIBLE_TIME + remaining
+    penalized[rows[hopeless]] = eTime[hopeless] + remaining
+    stop = infeasible | hopeless | ~valid
+    running[rows[stop]] = False
+
+    saved = world.compiledRoute.length - index - 1
+    if saved > 0:   # A failure at the last step stops nothing
+        world.pruneStats['aborted'] += int(np.count_nonzero(infeasible))
+        world.pruneStats['pruned'] += int(np.count_nonzero(hopeless))
+        world.pruneStats['invalid'] += int(np.count_nonzero(~valid))
+        world.pruneStats['savedSteps'] += saved * int(np.count_nonzero(stop))
+
+
+# Simulate the whole population of battery power profiles (individuals x genes, see genome.py) along the route
+# Returns the elapsed race time of every individual (inf where the car could not traverse the route)
+# With a checkpoint store (see checkpoints.py) every individual resumes after the steps it shares with a previously
+# simulated genome, and the states of its own steps are saved for later ones
+# With trajectory the SoC at the end of every step (individuals x steps) is returned along with the elapsed race times
+# Individuals that violate the constraints or, given a bound, can no longer finish within it stop early with the
+# penalized elapsed time of step.checkConstraints; individuals the car cannot traverse the route with stop right away
+# (the constraints are not checked with trajectory, which needs the SoC of every step)
+# With stopped a mask of the individuals whose elapsed time is such a penalty rather than a simulated time is returned
+# along with the elapsed race times
+def simulate(population, checkpoints=None, trajectory=False, bound=None, stopped=False):
+    started = time.perf_counter() if config.INSTRUMENT else 0.
+    population = np.asarray(population, dtype=np.float64)
+    count = population.shape[0]
+    rt = world.compiledRoute
+    solarCar = world.solarCar
+    stepGenes = genome.expand(population)
+
+    current = {'speed': np.full(count, float(world.startSpeed)),
+               'battSoC': np.full(count, float(world.startSoC)),
+               'eTime': np.zeros(count),
+               'offset': np.zeros(count),   # Global time as seconds since the race start time
+               'valid': np.ones(count, dtype=bool)}
+
+    start = np.zeros(count, dtype=int)      # First step simulated by each individual
+    if checkpoints is not None or trajectory:
+        record = dict((field, np.empty((count, rt.length))) for field in current)
+    if checkpoints is not None:
+        start = checkpoints.resume(stepGenes, record, current)
+        current['valid'] = current['valid'].astype(bool)
+
+    abortSoC = config.SIM_ABORT_SOC and not trajectory
+    bound = None if trajectory else bound
+    running = np.ones(count, dtype=bool)
+    penalized = np.full(count, np.nan)      # Elapsed time of the individuals stopped early
+
+    fields = ('speed', 'battSoC', 'eTime', 'offset', 'valid')
+    for index in range(int(start.min(initial=rt.length)), rt.length):
+        pbatt = config.PBATT_EXPECTED + stepGenes[:, index]
+        rows = np.flatnonzero((start <= index) & running)
+        if len(rows) == 0:
+            continue    # Individuals resuming at later steps are still to be simulated
+        if config.INSTRUMENT:
+            instrument.count('batch.individualSteps', len(rows))
+        if len(rows) == count:
+            _advance(solarCar, rt, index, pbatt, *[current[field] for field in fields])
+        else:
+            states = [current[field][rows] for field in fields]
+            _advance(solarCar, rt, index, pbatt[rows], *states)
+            for field, state in zip(fields, states):
+                current[field][rows] = state
+
+        if checkpoints is not None or trajectory:
+            for field in fields:
+                record[field][rows, index] = current[field][rows]
+
+        if not trajectory:
+            _checkConstraints(rows, index, current, abortSoC, bound, running, penalized)
+            failed = rows[~running[rows]]
+            if checkpoints is not None and len(failed):
+                stepGenes[failed, index:] = np.nan     # Resume before the failed step so that it is checked again
+
+    if checkpoints is not None:
+        checkpoints.save(stepGenes, record)
+    eTime = np.where(current['valid'], current['eTime'], float('inf'))
+    eTime = np.where(np.isnan(penalized), eTime, penalized)
+    if config.INSTRUMENT:
+        instrument.timed('batch.simulate', started)
+        instrument.count('batch.individuals', count)
+    if trajectory:
+        return eTime, record['battSoC']
+    if stopped:
+        # Individuals failing the bound at the last step keep their simulated elapsed time
+        return eTime, ~np.isnan(penalized) & (penalized != current['eTime'])
+    return eTime
@@ -0,0 +1,180 @@
+# Benchmark suite for the simulation and optimization hot paths
+# Times every layer of the simulation separately on the bundled Data files (sun position and irradiance, array input
+# in each array model, step speed solution, end of day charging, one race simulation and one GA generation at several
+# population sizes), stores the results as JSON and compares them to a saved baseline.
+# Usage: python benchmark.py [--output results.json] [--baseline baseline.json] [--tolerance 0.1] [--repeat 7]
+# Exits with status 1 when a case is slower than its baseline by more than the tolerance and the timing noise (see
+# compare).
+
+import argparse
+import copy
+import json
+import platform
+import sys
+import timeit
+from datetime import datetime
+
+import numpy as np
+
+import config
+import optimizer
+import sun
+import world
+
+MESH_FILE = './Data/array.msh'
+ROUTE_FILE = './Data/WSC.debug'
+REPEAT = 7      # Timing repetitions per case
+NOISE = 3.      # Relative timing spreads of a case added to the tolerance of the regression check (see compare)
+
+
+# Time a function; returns the best, median and mean time per call (s), the relative spread of the repetitions (median
+# absolute deviation over the median) and the number of calls per repetition
+# The calibration run of timeit.autorange only warms up the case and is not counted
+def measure(func, repeat=REPEAT):
+    timer = timeit.Timer(func)
+    number, elapsed = timer.autorange()
+    times = np.array(timer.repeat(repeat, number)) / number
+    median = float(np.median(times))
+    return {'best': float(times.min()), 'median': median, 'mean': float(times.mean()),
+            'spread': float(np.median(np.abs(times - median))) / median, 'calls': number}
+
+
+# Run func with config flags temporarily set
+def withConfig(flags, func):
+    saved = dict((name, getattr(config, name)) for name in flags)
+    for name, value in flags.items():
+        setattr(config, name, value)
+    try:
+        return func()
+    finally:
+        for name, value in saved.items():
+            setattr(config, name, value)
+
+
+# Step of the route at a global time with a car state to run the step level cases from
+def _step(index, gTime):
+    stp = copy.deepcopy(world.steps[index])
+    stp.gTime = gTime
+    stp.speed = 20.
+    stp.battSoC = 80.
+    stp.pbattExp = config.PBATT_EXPECTED
+    stp.pbatt = config.PBATT_EXPECTED
+    return stp
+
+
+# One generation of the batch evaluated GA (see optimizer.eaSimpleBatch) from an evaluated population
+def _generation(pop):
+    offspring = optimizer.toolbox.select(pop, len(pop))
+    offspring = optimizer.algorithms.varAnd(offspring, optimizer.toolbox, 0.5, 0.5)
+    invalid = [ind for ind in offspring if not ind.fitness.valid]
+    for ind, fit in zip(invalid, optimizer.toolbox.evaluatePopulation(invalid)):
+        ind.fitness.values = fit
+
+
+# Run every case; returns {case name: timing}
+def run(populations=(10, 50, 100), verbose=True, repeat=REPEAT):
+    world.loadDebugData(ROUTE_FILE)
+    world.importWorld(MESH_FILE, '')
+    world.setInitialConditions()
+    np.random.seed(0)
+    optimizer.random.seed(0)
+
+    noon = datetime(world.startTime.year, world.startTime.month, world.startTime.day, 12, 30)
+    stp = _step(10, noon)
+    solarCar = world.solarCar
+    sunInfo = sun.info(noon, stp.timezone, stp.location)
+
+    cases = [
+        ('sun.info', {}, lambda: sun.info(noon, stp.timezone, stp.location)),
+        ('sun.irradiance', {}, lambda: sun.irradiance(sunInfo)),
+        ('car.arrayIn.mesh', {'ARRAY_MESH_CALCULATION': True, 'ARRAY_LUT': False, 'SUN_CACHE': False},
+         lambda: solarCar.arrayIn(stp)),
+        ('car.arrayIn.meshLut', {'ARRAY_MESH_CALCULATION': True, 'ARRAY_LUT': True}, lambda: solarCar.arrayIn(stp)),
+        ('car.arrayIn.flat', {'ARRAY_MESH_CALCULATION': False, 'SUN_CACHE': False}, lambda: solarCar.arrayIn(stp)),
+        ('car.arrayIn.eod', {}, lambda: solarCar.arrayIn(stp, 2)),
+    ]
+
+    def stepTime():
+        stp.speed = 20.
+        stp.battSoC = 80.
+        solarCar.calcStepTime(stp)
+    cases.append(('car.calcStepTime', {'FAST_SPEED_SOLVER': True}, stepTime))
+    cases.append(('car.calcStepTime.fsolve', {'FAST_SPEED_SOLVER': False}, stepTime))
+
+    evening = noon.replace(hour=17, minute=20)
+    eodStep = _step(10, evening)
+
+    def processEOD():
+        eodStep.gTime = evening
+        eodStep.battSoC = 50.
+        eodStep.processEOD(solarCar)
+    cases.append(('step.processEOD', {}, processEOD))
+    cases.append(('step.processEOD.minutes', {'CHARGE_INTEGRATED': False}, processEOD))
+
+    genes = np.random.randint(-100, 100, config.GA_GENES)
+    cases.append(('world.simulate', {}, lambda: world.simulate(genes)))
+    cases.append(('world.simulate.deepcopy', {'SIM_COPY_FREE': False}, lambda: world.simulate(genes)))
+
+    for count in populations:
+        pop = optimizer.toolbox.population(n=count)
+        for ind, fit in zip(pop, optimizer.toolbox.evaluatePopulation(pop)):
+            ind.fitness.values = fit
+        cases.append(('ga.generation.%d' % count, {}, lambda pop=pop: _generation(pop)))
+
+    results = {}
+    for name, flags, func in cases:
+        results[name] = withConfig(flags, lambda: measure(func, repeat))
+        if verbose:
+            print('%-28s %12.3f us  +-%5.1f%%  (%d calls)' % (name, results[name]['best'] * 1e6,
+                                                             results[name]['spread'] * 100, results[name]['calls']))
+    return results
+
+
+# Cases slower than the baseline, as {name: (baseline s, current s)} of their best times
+# A case regresses when both its best and its median time are slower than the baseline ones by more than the tolerance
+# (relative) plus NOISE times the relative spreads of the two runs, so that a single slow repetition or the jitter of
+# a noisy case is not reported. Baselines without a median or spread are compared by their mean time without noise.
+def compare(results, baseline, tolerance, verbose=True):
+    regressions = {}
+    if verbose:
+        print('%-28s %12s %12s %8s %8s' % ('case', 'baseline us', 'current us', 'ratio', 'limit'))
+    for name in sorted(set(results) & set(baseline)):
+        before, after = baseline[name], results[name]
+        limit = 1 + tolerance + NOISE * (before.get('spread', 0.) + after.get('spread', 0.))
+        ratio = after['best'] / before['best']
+        medianRatio = after.get('median', after['mean']) / before.get('median', before['mean'])
+        if min(ratio, medianRatio) > limit:
+            regressions[name] = (before['best'], after['best'])
+        if verbose:
+            print('%-28s %12.3f %12.3f %8.2f %8.2f%s' % (name, before['best'] * 1e6, after['best'] * 1e6, ratio, limit,
+                                                        '  REGRESSION' if name in regressions else ''))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the simulation and optimization hot paths')
+    parser.add_argument('--output', default='benchmark.json', help='JSON file the results are written to')
+    parser.add_argument('--baseline', help='JSON results of an earlier run to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='Relative slowdown reported as a regression')
+    parser.add_argument('--populations', default='10,50,100', help='Population sizes of the GA generation cases')
+    parser.add_argument('--repeat', type=int, default=REPEAT, help='Timing repetitions per case')
+    args = parser.parse_args()
+
+    results = run(tuple(int(count) for count in args.populations.split(',')), repeat=args.repeat)
+    report = {'date': datetime.now().isoformat(),
+              'python': platform.python_version(),
+              'numpy': np.__version__,
+              'machine': platform.machine(),
+              'results': results}
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        if compare(results, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
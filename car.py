@@ -2,12 +2,17 @@
 # Simulates the dynamic systems of the car and yields state outputs
 # Author: Frank Gu
 # Date: July 2nd, 2017
+import os
+import time
+
 import numpy as np
 
 from scipy.optimize import fsolve
 
 import config
-import sun
+import instrument
+import solver
+import sun_cache
 import world
 import world_helpers
 
@@ -37,65 +42,268 @@ class car:
     # -------------------- ARRAY START --------------------------------------------------
     # ELEMENT: ARRAY_GEOMETRY
     # Load array geometry file
+    # Gmsh (2.2 ASCII) mesh of the array in mm; every triangle element contributes its normal vector, whose length is
+    # twice the triangle's area (m2). With config.ARRAY_MESH_CACHE the normals and the array power lookup table are kept
+    # in a binary sidecar file (<fname>.npz) that is reused as long as the mesh file's modification time and size are
+    # unchanged; the table is rebuilt when it was built with another resolution.
     def loadArray(self, fname):
-        mode = 0  # File parsing mode (0-Pass, 1-Node, 2-Elements)
-        nodes = []  # Temporary container to hold nodes
+        entries = self.loadArrayCache(fname) if config.ARRAY_MESH_CACHE else None
+        changed = entries is None
+        if entries is None:
+            entries = {'geometry': self.parseArrayMesh(fname)}
+
+        self.arrayGeometry = entries['geometry']
+        self.arrayArea = 0.5 * float(np.linalg.norm(self.arrayGeometry, axis=1).sum())
+
+        # The table is built from the full mesh before it is (optionally) reduced
+        if config.ARRAY_LUT and not self.loadArrayLut(entries):
+            self.buildArrayLut()
+            entries.update(self.arrayLutEntries())
+            changed = True
+        if config.ARRAY_MESH_CACHE and changed:
+            self.saveArrayCache(fname, entries)
+        if config.ARRAY_CLUSTER:
+            self.clusterArray(config.ARRAY_CLUSTER_COUNT, config.ARRAY_CLUSTER_TOL)
+        return self.arrayGeometry
+
+    # Parse the $Nodes and $Elements blocks of a Gmsh file in bulk and return the normal vectors of the triangles
+    @staticmethod
+    def parseArrayMesh(fname):
         # Rotational matrix to reposition the aerobody to point
         tRot = np.array([[0, -1, 0],
                          [1, 0, 0],
                          [0, 0, 1]])
 
-        # Read the mesh file lines
-        with open(fname) as f:
-            lines = f.read().splitlines()
-
-        for line in lines:
-            # Parsing nodes
-            if mode == 1:
-                if line == '$EndNodes':
-                    mode = 0  # Completion of nodes block
-
-                else:
-                    items = line.split(' ')
-                    if len(items) > 1:
-                        node = np.array([float(items[1]), float(items[2]), float(items[3])])
-                        nodes.append(node)
-            # Parsing elements
-            elif mode == 2:
-                if line == '$EndElements':
-                    mode = 0  # Completion of elements block
-
-                else:
-                    items = line.split(' ')
-                    # We only care about the triangle features
-                    if len(items) > 1 and items[1] == '2':
-                        a = int(items[5])
-                        b = int(items[6])
-                        c = int(items[7])
-                        v1 = np.subtract(nodes[b - 1] / 1000, nodes[a - 1] / 1000)
-                        v2 = np.subtract(nodes[c - 1] / 1000, nodes[a - 1] / 1000)
-                        arrNorm = np.cross(v1, v2)  # Normal vector
-                        meshNorm = np.matmul(tRot, arrNorm)
-                        self.arrayArea += 0.5 * np.linalg.norm(arrNorm)  # Rolling addition to array area
-                        self.arrayGeometry.append(meshNorm)  # Store the normal vector
-            else:
-                if line == '$Nodes':
-                    mode = 1
-
-                elif line == '$Elements':
-                    mode = 2
-        self.arrayGeometry = np.asarray(self.arrayGeometry)
-        return lines
+        with open(fname, 'rb') as f:
+            text = f.read()
+        nodeBlock = text[text.index(b'$Nodes'):text.index(b'$EndNodes')].split(b'\n', 2)[2]
+        elementBlock = text[text.index(b'$Elements'):text.index(b'$EndElements')].split(b'\n', 2)[2]
+
+        # Nodes: "id x y z"
+        nodes = np.array(nodeBlock.split(), dtype=np.float64).reshape(-1, 4)
+        nodeIndex = np.zeros(int(nodes[:, 0].max()) + 1, dtype=np.int64)
+        nodeIndex[nodes[:, 0].astype(np.int64)] = np.arange(len(nodes))
+        coordinates = nodes[:, 1:] / 1000
+
+        # Elements: "id type ntags tag... node..."; lines have different lengths, so the first token of every line is
+        # located from the whitespace layout of the block
+        tokens = np.array(elementBlock.split(), dtype=np.int64)
+        chars = np.frombuffer(elementBlock, dtype=np.uint8)
+        space = (chars == ord(' ')) | (chars == ord('\t')) | (chars == ord('\r')) | (chars == ord('\n'))
+        tokenStart = ~space & np.concatenate(([True], space[:-1]))
+        lineStart = tokenStart & np.concatenate(([True], chars[:-1] == ord('\n')))
+        first = np.flatnonzero(lineStart[tokenStart])
+
+        # We only care about the triangle features
+        triangles = first[tokens[first + 1] == 2]
+        corners = triangles + 3 + tokens[triangles + 2]
+        a = coordinates[nodeIndex[tokens[corners]]]
+        b = coordinates[nodeIndex[tokens[corners + 1]]]
+        c = coordinates[nodeIndex[tokens[corners + 2]]]
+        arrNorm = np.cross(b - a, c - a)    # Normal vectors
+        return np.matmul(arrNorm, tRot.T)
+
+    # Entries (the parsed mesh geometry and the lookup table, see arrayLutEntries) of the sidecar cache of a mesh file;
+    # returns None when missing or stale
+    @staticmethod
+    def loadArrayCache(fname):
+        info = os.stat(fname)
+        try:
+            with np.load(fname + '.npz') as cache:
+                if int(cache['mtime']) == info.st_mtime_ns and int(cache['size']) == info.st_size:
+                    entries = dict((name, cache[name]) for name in cache.files if name not in ('mtime', 'size'))
+                    if 'geometry' in entries:
+                        return entries
+        except (OSError, KeyError, ValueError):
+            pass
+        return None
+
+    @staticmethod
+    def saveArrayCache(fname, entries):
+        info = os.stat(fname)
+        temp = '%s.%d.tmp.npz' % (fname, os.getpid())
+        try:
+            np.savez(temp, mtime=info.st_mtime_ns, size=info.st_size, **entries)
+            os.replace(temp, fname + '.npz')    # Atomic so that concurrent loaders never see a partial file
+        except OSError:
+            pass    # Read-only location; parse again next time
+
+    # Mesh power (W at 1000 W m-2) of an array geometry for a fixed sample of sun positions relative to the car
+    # The last sample is the end of day directional charging (mode 2)
+    def sampleMeshPower(self, geometry):
+        rng = np.random.RandomState(0)
+        relAzimuth = np.deg2rad(rng.uniform(-180., 180., 4096))
+        relElevation = np.deg2rad(rng.uniform(-90., 90., 4096))
+        modSunVec = -np.array([np.sin(relAzimuth) * np.cos(relElevation),
+                               np.cos(relAzimuth) * np.sin(relElevation),
+                               np.sin(relElevation)])
+        meshPowerMat = np.matmul(geometry, modSunVec) * 0.5 * 1000. * self.ARRAY_EFF
+        power = np.maximum(meshPowerMat, 0.).sum(axis=0) - self.DIFFUSE_EFF * np.minimum(meshPowerMat, 0.).sum(axis=0)
+        meshPowerMat = np.matmul(geometry, np.array([0, 0, -1])) * 0.5 * 1000. * self.ARRAY_EFF
+        pointed = np.maximum(meshPowerMat, 0.).sum() - np.minimum(meshPowerMat, 0.).sum()
+        return np.append(power, pointed), np.rad2deg(relAzimuth), np.rad2deg(relElevation)
+
+    # ELEMENT: ARRAY_GEOMETRY (compact)
+    # Reduce the mesh normals to a small set of representative normals
+    # Facets pointing in almost the same direction are grouped and replaced by the sum of their normals, which is the
+    # area-weighted normal of the group; its power is exact as long as the whole group faces towards (or away from) the
+    # sun. Groups are formed either with a fixed count (spherical k-means) or an angular tolerance (deg).
+    # The worst power error against the full mesh over the sample sun positions is kept in arrayClusterError (W at
+    # 1000 W m-2).
+    def clusterArray(self, count=0, tolerance=5.):
+        full = self.arrayGeometry
+        weight = np.linalg.norm(full, axis=1)
+        full = full[weight > 0]     # Degenerate facets collect no power
+        weight = weight[weight > 0]
+        unit = full / weight[:, np.newaxis]
+
+        if count > 0:
+            # Spherical k-means, seeded with the largest facet and then repeatedly the facet furthest from all seeds
+            centers = [unit[np.argmax(weight)]]
+            closest = np.matmul(unit, centers[0])
+            for seed in range(1, min(count, len(full))):
+                centers.append(unit[np.argmin(closest)])
+                closest = np.maximum(closest, np.matmul(unit, centers[-1]))
+            centers = np.array(centers)
+            labels = np.full(len(full), -1)
+            for iteration in range(50):
+                newLabels = np.argmax(np.matmul(unit, centers.T), axis=1)
+                if np.array_equal(newLabels, labels):
+                    break
+                labels = newLabels
+                sums = np.zeros(centers.shape)
+                np.add.at(sums, labels, full)
+                norms = np.linalg.norm(sums, axis=1)
+                centers = np.where(norms[:, np.newaxis] > 0, sums / np.maximum(norms, 1e-300)[:, np.newaxis], centers)
+        else:
+            # Leader clustering: the largest unassigned facet seeds a group with all unassigned facets within tolerance
+            labels = np.full(len(full), -1)
+            cosTolerance = np.cos(np.deg2rad(tolerance))
+            groups = 0
+            for seed in np.argsort(-weight):
+                if labels[seed] >= 0:
+                    continue
+                labels[(labels < 0) & (np.matmul(unit, unit[seed]) >= cosTolerance)] = groups
+                groups += 1
+
+        reduced = np.zeros((labels.max() + 1, 3))
+        np.add.at(reduced, labels, full)
+        reduced = reduced[np.bincount(labels) > 0]
+
+        self.arrayClusterError = float(np.max(np.abs(self.sampleMeshPower(reduced)[0] -
+                                                     self.sampleMeshPower(self.arrayGeometry)[0])))
+        self.arrayGeometry = reduced
+        return reduced
+
+    # ELEMENT: ARRAY_LUT
+    # Build the lookup table of the normalized array power over the sun's position relative to the car
+    # The mesh power only depends on the sun's elevation relative to the inclination and azimuth relative to the heading
+    # (see arrayIn), so the mesh is evaluated once here and bilinearly interpolated in the simulation hot path.
+    # Two sums per sun position are stored per unit insolation: the elements facing the sun (direct) and those facing
+    # away (shade); the diffuse efficiency is applied when the table is read.
+    def buildArrayLut(self):
+        self._lutGrid(config.ARRAY_LUT_RESOLUTION)
+        relAzimuth = np.deg2rad(self.lutAngles)
+        self.lutDirect = np.empty((len(self.lutAngles), len(self.lutAngles)))  # [relative elevation, relative azimuth]
+        self.lutShade = np.empty((len(self.lutAngles), len(self.lutAngles)))
+        for row, relElevation in enumerate(np.deg2rad(self.lutAngles)):
+            modSunVec = -np.array([np.sin(relAzimuth) * np.cos(relElevation),
+                                   np.cos(relAzimuth) * np.sin(relElevation),
+                                   np.full(len(relAzimuth), np.sin(relElevation))])
+            meshUnit = np.matmul(self.arrayGeometry, modSunVec) * 0.5 * self.ARRAY_EFF
+            self.lutDirect[row] = np.maximum(meshUnit, 0.).sum(axis=0)
+            self.lutShade[row] = np.minimum(meshUnit, 0.).sum(axis=0)
+
+        # End of day directional charging (mode 2) does not depend on the sun's position
+        meshUnit = np.matmul(self.arrayGeometry, np.array([0, 0, -1])) * 0.5 * self.ARRAY_EFF
+        self.lutPointed = (np.maximum(meshUnit, 0.).sum(), np.minimum(meshUnit, 0.).sum())
+
+        # Worst interpolation error (W at 1000 W m-2) against the exact mesh calculation
+        exact, relAzimuth, relElevation = self.sampleMeshPower(self.arrayGeometry)
+        self.arrayLutError = float(np.max(np.abs(self.arrayLutPower(relAzimuth, relElevation, 1000.) - exact[:-1])))
+
+    # Relative sun angles (deg) of the lookup table rows and columns for a resolution (deg)
+    def _lutGrid(self, resolution):
+        self.lutAngles = np.linspace(-180., 180., int(round(360. / resolution)) + 1)
+        self.lutResolution = 360. / (len(self.lutAngles) - 1)
+
+    # Lookup table as entries of the mesh sidecar cache, with the settings it was built with
+    def arrayLutEntries(self):
+        return {'lutSettings': np.array([config.ARRAY_LUT_RESOLUTION, self.ARRAY_EFF]),
+                'lutDirect': self.lutDirect, 'lutShade': self.lutShade, 'lutPointed': np.array(self.lutPointed),
+                'lutError': np.array(self.arrayLutError)}
+
+    # Restore the lookup table from sidecar cache entries; False when they are missing or were built with other settings
+    def loadArrayLut(self, entries):
+        settings = entries.get('lutSettings')
+        if settings is None or not np.array_equal(settings, [config.ARRAY_LUT_RESOLUTION, self.ARRAY_EFF]):
+            return False
+        self._lutGrid(config.ARRAY_LUT_RESOLUTION)
+        self.lutDirect = entries['lutDirect']
+        self.lutShade = entries['lutShade']
+        self.lutPointed = tuple(entries['lutPointed'])
+        self.arrayLutError = float(entries['lutError'])
+        return True
+
+    # Array power from the lookup table for sun positions relative to the car (deg) and insolations (arrays)
+    def arrayLutPower(self, relAzimuth, relElevation, insolation, mode=0):
+        insolation = np.asarray(insolation, dtype=np.float64)
+        if mode == 2:
+            direct, shade = self.lutPointed
+            diffuseEff = 1.0
+        else:
+            x = ((np.asarray(relAzimuth, dtype=np.float64) + 180.) % 360.) / self.lutResolution
+            y = ((np.asarray(relElevation, dtype=np.float64) + 180.) % 360.) / self.lutResolution
+            i = np.minimum(x.astype(np.int64), len(self.lutAngles) - 2)
+            j = np.minimum(y.astype(np.int64), len(self.lutAngles) - 2)
+            fx = x - i
+            fy = y - j
+            direct = (self.lutDirect[j, i] * (1 - fx) + self.lutDirect[j, i + 1] * fx) * (1 - fy) + \
+                     (self.lutDirect[j + 1, i] * (1 - fx) + self.lutDirect[j + 1, i + 1] * fx) * fy
+            shade = (self.lutShade[j, i] * (1 - fx) + self.lutShade[j, i + 1] * fx) * (1 - fy) + \
+                    (self.lutShade[j + 1, i] * (1 - fx) + self.lutShade[j + 1, i + 1] * fx) * fy
+            diffuseEff = self.DIFFUSE_EFF
+        # With a negative insolation (sun below the horizon) the elements facing away from the sun are the direct ones
+        return np.where(insolation >= 0, insolation * (direct - diffuseEff * shade),
+                        insolation * (shade - diffuseEff * direct))
+
+    # Scalar version of arrayLutPower (NumPy call overhead dominates for a single sun position)
+    def _arrayLutPowerScalar(self, relAzimuth, relElevation, insolation, mode=0):
+        if mode == 2:
+            direct, shade = self.lutPointed
+            diffuseEff = 1.0
+        else:
+            x = ((relAzimuth + 180.) % 360.) / self.lutResolution
+            y = ((relElevation + 180.) % 360.) / self.lutResolution
+            i = min(int(x), len(self.lutAngles) - 2)
+            j = min(int(y), len(self.lutAngles) - 2)
+            fx = x - i
+            fy = y - j
+            direct = (self.lutDirect[j, i] * (1 - fx) + self.lutDirect[j, i + 1] * fx) * (1 - fy) + \
+                     (self.lutDirect[j + 1, i] * (1 - fx) + self.lutDirect[j + 1, i + 1] * fx) * fy
+            shade = (self.lutShade[j, i] * (1 - fx) + self.lutShade[j, i + 1] * fx) * (1 - fy) + \
+                    (self.lutShade[j + 1, i] * (1 - fx) + self.lutShade[j + 1, i + 1] * fx) * fy
+            diffuseEff = self.DIFFUSE_EFF
+        if insolation >= 0:
+            return insolation * (direct - diffuseEff * shade)
+        return insolation * (shade - diffuseEff * direct)
 
     # ELEMENT: ARRAY
     # Raw expected array input
     # Includes array geometry and temperature effects
     # Assumes array temperature = ambient (due to high speed free stream air)
     def arrayIn(self, stepInfo, mode=0):
+        start = time.perf_counter() if config.INSTRUMENT else 0.
         if mode == 2:
             # End of day directional charging
-            sunInfo = sun.info(stepInfo.gTime, stepInfo.timezone, stepInfo.location)
-            insolation = sun.irradiance(sunInfo)  # The amount of power hitting the surface of the Earth
+            # The amount of power hitting the surface of the Earth
+            elevation, azimuth, insolation = sun_cache.position(stepInfo.gTime, stepInfo.timezone, stepInfo.location)
+
+            if config.ARRAY_LUT:
+                stepInfo.pin = self._arrayLutPowerScalar(0., 0., insolation, 2)
+                if config.INSTRUMENT:
+                    instrument.timed('car.arrayIn', start)
+                return stepInfo.pin
 
             normalSunVec = np.array(
                 [0, 0, -1])  # Assumes that the sun panel's geometric normal is pointing directly at the sun
@@ -109,14 +317,19 @@ class car:
             meshDiffuse = np.extract(np.ma.masked_greater(meshPowerMat, 0.), meshPowerMat) * (-1.0)
             power = np.sum(meshDirect) + np.sum(meshDiffuse)
         else:
-            sunInfo = sun.info(stepInfo.gTime, stepInfo.timezone, stepInfo.location)
-            insolation = sun.irradiance(sunInfo)  # The amount of power hitting the surface of the Earth
+            # The amount of power hitting the surface of the Earth
+            elevation, azimuth, insolation = sun_cache.position(stepInfo.gTime, stepInfo.timezone, stepInfo.location)
+
+            if config.ARRAY_MESH_CALCULATION and config.ARRAY_LUT:
+                # Interpolated mesh power (see buildArrayLut)
+                power = self._arrayLutPowerScalar(azimuth - stepInfo.heading, elevation - stepInfo.inclination,
+                                                  insolation)
 
-            if config.ARRAY_MESH_CALCULATION:
+            elif config.ARRAY_MESH_CALCULATION:
                 # Create the sun's unit vector with relative to the car's heading and azimuth
-                modSunVec = -np.array([np.sin(np.deg2rad(sunInfo[1] - stepInfo.heading)) * np.cos(np.deg2rad(sunInfo[0] - stepInfo.inclination)),
-                                   np.cos(np.deg2rad(sunInfo[1] - stepInfo.heading)) * np.sin(np.deg2rad(sunInfo[0] - stepInfo.inclination)),
-                                   np.sin(np.deg2rad(sunInfo[0] - stepInfo.inclination))])
+                modSunVec = -np.array([np.sin(np.deg2rad(azimuth - stepInfo.heading)) * np.cos(np.deg2rad(elevation - stepInfo.inclination)),
+                                   np.cos(np.deg2rad(azimuth - stepInfo.heading)) * np.sin(np.deg2rad(elevation - stepInfo.inclination)),
+                                   np.sin(np.deg2rad(elevation - stepInfo.inclination))])
 
                 meshPowerMat = np.matmul(self.arrayGeometry, modSunVec) * 0.5 * insolation * self.ARRAY_EFF
                 # Mesh elements receiving direct sunlight
@@ -159,14 +372,83 @@ class car:
 
             else:
                 # Flat panel model; No consideration to array geometry
-                power = insolation * self.arrayArea * self.ARRAY_EFF * np.sin(90-np.deg2rad(np.abs(sunInfo[0]-stepInfo.inclination)))
+                power = insolation * self.arrayArea * self.ARRAY_EFF * np.sin(90-np.deg2rad(np.abs(elevation-stepInfo.inclination)))
 
         # TODO: Implement temperature effects on panel efficiency
         # TODO: Implement cloud coverage effects
 
         stepInfo.pin = power
+        if config.INSTRUMENT:
+            instrument.timed('car.arrayIn', start)
         return power
 
+    # ELEMENT: ARRAY (vectorized)
+    # Raw expected array input for N sun positions at once (same model as arrayIn)
+    # Input - elevation, azimuth, insolation: sun elevation (deg), azimuth (deg) and irradiance (W m-2) arrays
+    #       - heading, inclination: car heading and inclination (deg), scalars or arrays
+    #       - mode    : 0 -> Regular driving step; 2 -> end of day, array pointing towards the sun
+    def arrayPower(self, elevation, azimuth, insolation, heading, inclination, mode=0):
+        elevation, azimuth, insolation, heading, inclination = np.broadcast_arrays(
+            *[np.asarray(x, dtype=np.float64) for x in (elevation, azimuth, insolation, heading, inclination)])
+        if config.INSTRUMENT:
+            instrument.count('car.arrayPower')
+            instrument.count('car.arrayPower.samples', elevation.size)
+
+        if config.ARRAY_LUT and (mode == 2 or config.ARRAY_MESH_CALCULATION):
+            return self.arrayLutPower(azimuth - heading, elevation - inclination, insolation, mode)
+
+        if mode == 2:
+            # End of day directional charging; all diffuse elements collect at full efficiency
+            meshUnit = np.matmul(self.arrayGeometry, np.array([0, 0, -1]))
+            meshPowerMat = np.multiply.outer(meshUnit, 0.5 * insolation * self.ARRAY_EFF)
+            diffuseEff = 1.0
+        elif config.ARRAY_MESH_CALCULATION:
+            relAzimuth = np.deg2rad(azimuth - heading)
+            relElevation = np.deg2rad(elevation - inclination)
+            modSunVec = -np.array([np.sin(relAzimuth) * np.cos(relElevation),
+                                   np.cos(relAzimuth) * np.sin(relElevation),
+                                   np.sin(relElevation)]).reshape(3, -1)
+            meshPowerMat = np.matmul(self.arrayGeometry, modSunVec) * (0.5 * insolation * self.ARRAY_EFF).reshape(-1)
+            diffuseEff = self.DIFFUSE_EFF
+        else:
+            # Flat panel model; No consideration to array geometry
+            return insolation * self.arrayArea * self.ARRAY_EFF * \
+                np.sin(90 - np.deg2rad(np.abs(elevation - inclination)))
+
+        # Elements facing the sun collect direct power, the others collect diffuse power
+        power = np.maximum(meshPowerMat, 0.).sum(axis=0) - diffuseEff * np.minimum(meshPowerMat, 0.).sum(axis=0)
+        return power.reshape(insolation.shape)
+
+    # ELEMENT: ARRAY (charging window)
+    # Energy (Wh) delivered by the MPPT over a charging window of one-minute samples, in one vectorized call
+    # Input - gTime   : global time of the first sample; a datetime or a datetime64 array (one window per entry)
+    #       - minutes : number of one-minute samples of the window(s)
+    #       - heading, inclination: car heading and inclination (deg) during the window(s)
+    #       - mode    : 0 -> Regular driving step; 2 -> end of day, array pointing towards the sun
+    # Equivalent to summing arrayOut(arrayIn()) over the minutes of the window up to floating point rounding
+    def chargeEnergy(self, gTime, minutes, timezone, location, heading, inclination, mode=0):
+        start = np.asarray(gTime, dtype='datetime64[us]')
+        scalar = start.ndim == 0
+        start = start.reshape(-1)
+        minutes = np.broadcast_to(np.asarray(minutes, dtype=np.int64), start.shape)
+        heading = np.broadcast_to(np.asarray(heading, dtype=np.float64), start.shape)
+        inclination = np.broadcast_to(np.asarray(inclination, dtype=np.float64), start.shape)
+
+        # Samples (window, minute) of all windows; evaluated in chunks to bound the size of the mesh matrix
+        window, minute = np.nonzero(np.arange(np.max(minutes, initial=0)) < minutes[:, np.newaxis])
+        times = start[window] + minute.astype('timedelta64[m]')
+        energy = np.zeros(start.shape)
+        for chunk in range(0, len(times), config.CHARGE_CHUNK):
+            samples = slice(chunk, chunk + config.CHARGE_CHUNK)
+            elevation, azimuth, insolation = sun_cache.positionArray(times[samples], timezone, location)
+            power = self.arrayOut(self.arrayPower(elevation, azimuth, insolation, heading[window[samples]],
+                                                  inclination[window[samples]], mode))
+            energy += np.bincount(window[samples], power, minlength=len(start)) / 60.
+
+        if scalar:
+            return float(energy[0])
+        return energy
+
     # ELEMENT: MPPT
     # Maximum Power Point Tracker consolidating tracking and conversion efficiency
     # Input - stepInfo: The step object that the car is operating in
@@ -197,6 +479,10 @@ class car:
     def battIn(self, stepInfo, power, duration):
         stepInfo.battSoC += 100 * (power * duration / 60) / self.BATT_CAPACITY * self.BAT_CHARGE_EFF
 
+    # Battery charging with an amount of energy (Wh) and its effects on battery SoC
+    def battInEnergy(self, stepInfo, energy):
+        stepInfo.battSoC += 100 * energy / self.BATT_CAPACITY * self.BAT_CHARGE_EFF
+
     # -------------------- BATTERY END --------------------------------------------------
 
     # -------------------- TELEMETRY START ----------------------------------------------
@@ -214,7 +500,12 @@ class car:
         return pshaft
 
     # Calculate how fast the car will drive
+    # With config.FAST_SPEED_SOLVER, raises solver.SolverError when the step has no speed solution: the shaft power does
+    # not cover the rolling resistance on a flat or uphill step (eg. low sun with a -100 W gene, or an empty battery).
+    # world.simulate and batch.simulate give such profiles an infinite elapsed time, where the fsolve path returned
+    # the finite time of its initial guess.
     def calcStepTime(self, stepInfo):
+        start = time.perf_counter() if config.INSTRUMENT else 0.
         pshaft = self.motorShaftPower(stepInfo)     # Shaft power delivered by motor
 
         # TODO: Fix below algorithm to be more stable and less computational heavy!
@@ -223,15 +514,28 @@ class car:
         #
         # vStepMax = fsolve(f, 22.)   # Maximum speed attainable with the power given in m s-1
         vPrev = stepInfo.speed
-        def f(y):
-            return -0.5 * self.CDA * stepInfo.rho * np.power(y, 3)- self.MASS * y * world.g*np.sin(np.deg2rad(stepInfo.inclination))+(pshaft - self.proll(y,stepInfo))
-        # NOTE: fsolve becomes unstable with too high/low guess values. The highest speed limit is selected as a good assumption since the solution can only lie close or below it.
-        omega = fsolve(f, config.SL_HIGHWAY)
-
-        def f(z):
-            return stepInfo.stepDistance-(self.MASS * np.power(omega,2)*np.log((-omega+z)/(-omega+vPrev)) / (3 * (-0.5)*self.CDA*stepInfo.rho * np.power(omega,2)-self.MASS*world.g*np.sin(np.deg2rad(stepInfo.inclination))))
-        # NOTE: fsolve initial guess = vPrev considering that the next step speed shouldn't deviate too much from the first step
-        airspeed = fsolve(f, vPrev)[0]  # The final resulting air speed of this step
+        if config.FAST_SPEED_SOLVER:
+            # Closed-form terminal speed and exit speed (see solver.py); proll is speed independent
+            omega, airspeed, converged = solver.stepSpeed(pshaft - self.proll(vPrev, stepInfo), vPrev,
+                                                          stepInfo.stepDistance, stepInfo.rho,
+                                                          stepInfo.inclination, self.MASS, self.CDA, world.g)
+            if not converged:
+                if config.INSTRUMENT:
+                    instrument.count('solver.failures')
+                raise solver.SolverError('No step speed solution at step %d (vPrev=%g, omega=%g)'
+                                         % (stepInfo.stepNum, vPrev, omega))
+        else:
+            def f(y):
+                return -0.5 * self.CDA * stepInfo.rho * np.power(y, 3)- self.MASS * y * world.g*np.sin(np.deg2rad(stepInfo.inclination))+(pshaft - self.proll(y,stepInfo))
+            # NOTE: fsolve becomes unstable with too high/low guess values. The highest speed limit is selected as a good assumption since the solution can only lie close or below it.
+            omega = fsolve(f, config.SL_HIGHWAY)
+            if config.INSTRUMENT:
+                instrument.count('solver.fsolve', 2)
+
+            def f(z):
+                return stepInfo.stepDistance-(self.MASS * np.power(omega,2)*np.log((-omega+z)/(-omega+vPrev)) / (3 * (-0.5)*self.CDA*stepInfo.rho * np.power(omega,2)-self.MASS*world.g*np.sin(np.deg2rad(stepInfo.inclination))))
+            # NOTE: fsolve initial guess = vPrev considering that the next step speed shouldn't deviate too much from the first step
+            airspeed = fsolve(f, vPrev)[0]  # The final resulting air speed of this step
         # ASSUMPTION: Only component of wind in direction of car travel affects the car; cross wind does not introduce any drag
         stepInfo.speed = airspeed + stepInfo.wind[0] * np.sin(np.deg2rad(90 - np.abs(stepInfo.wind[1] - stepInfo.heading)))  # Calculate ground speed
 
@@ -253,6 +557,8 @@ class car:
         # Decrease remaining battery charge
         stepInfo.battSoC -= 100 * (stepInfo.pbatt * (stepInfo.stepTime / 3600) / self.BATT_CAPACITY)
 
+        if config.INSTRUMENT:
+            instrument.timed('car.calcStepTime', start)
         return stepInfo.stepTime
 
     # -------------------- ELECTROMECHANICAL END ----------------------------------------
@@ -0,0 +1,92 @@
+# Per-step checkpoints of simulated genomes for incremental re-simulation
+# Crossover and mutation usually change only a slice of a battery power profile, so a child shares the first steps of
+# the route with one of the recently simulated genomes. The store keeps the state at the end of every step (speed, SoC,
+# elapsed time, global time offset and validity, see batch.simulate) of recently simulated genomes within a memory
+# budget; a new genome resumes from the end of the longest identical run of steps instead of from the start.
+# Entries are evicted least recently used (saved or resumed from) first.
+
+import numpy as np
+
+import config
+
+active = None   # Store of the current optimization run (per process, see optimizer.optimize and workers.py)
+
+
+class store:
+    FIELDS = ('speed', 'battSoC', 'eTime', 'offset', 'valid')
+
+    # length: number of route steps; budget: memory budget of the store (bytes)
+    def __init__(self, length, budget):
+        self.length = length
+        entryBytes = length * (8 * len(self.FIELDS) + 8)   # States and the genes driving each step
+        self.capacity = int(budget // entryBytes)
+        self.stepGenes = np.empty((self.capacity, length))
+        self.states = dict((field, np.empty((self.capacity, length))) for field in self.FIELDS)
+        self.used = 0
+        self.lastUsed = np.zeros(self.capacity, dtype=np.int64)
+        self.clock = 0
+
+        # Counters
+        self.resumed = 0        # Genomes resumed from a checkpoint
+        self.stepsSkipped = 0   # Steps not simulated thanks to the checkpoints
+        self.stepsTotal = 0     # Steps requested
+
+    # Number of identical leading steps and best entry for every genome (stepGenes: genomes x steps)
+    def match(self, stepGenes):
+        shared = np.zeros(len(stepGenes), dtype=int)
+        slot = np.zeros(len(stepGenes), dtype=int)
+        if self.used == 0:
+            return slot, shared
+        stored = self.stepGenes[:self.used]
+        for row in range(len(stepGenes)):
+            diff = stored != stepGenes[row]
+            common = np.where(diff.any(axis=1), diff.argmax(axis=1), self.length)
+            slot[row] = np.argmax(common)
+            shared[row] = common[slot[row]]
+        return slot, shared
+
+    # Initialize the states of a population from its checkpoints
+    # Fills the per-step records (field -> genomes x steps) with the shared steps and the current states with the
+    # state at the end of the last shared step. Returns the first step each genome has to simulate.
+    def resume(self, stepGenes, record, current):
+        slot, start = self.match(stepGenes)
+        rows = np.flatnonzero(start > 0)
+        if len(rows):
+            self.clock += 1
+            self.lastUsed[slot[rows]] = self.clock
+            for field in self.FIELDS:
+                record[field][rows] = self.states[field][slot[rows]]
+                current[field][rows] = self.states[field][slot[rows], start[rows] - 1]
+        self.resumed += len(rows)
+        self.stepsSkipped += int(start.sum())
+        self.stepsTotal += len(stepGenes) * self.length
+        return start
+
+    # Save the per-step records of a simulated population, evicting the least recently used entries
+    def save(self, stepGenes, record):
+        count = min(len(stepGenes), self.capacity)
+        if count == 0:
+            return
+        free = self.capacity - self.used
+        slots = np.arange(self.used, self.used + min(free, count))
+        if len(slots) < count:
+            slots = np.concatenate((slots, np.argsort(self.lastUsed[:self.used], kind='stable')[:count - len(slots)]))
+        self.used = max(self.used, self.used + min(free, count))
+
+        self.clock += 1
+        self.lastUsed[slots] = self.clock
+        self.stepGenes[slots] = stepGenes[-count:]
+        for field in self.FIELDS:
+            self.states[field][slots] = record[field][-count:]
+
+    def stats(self):
+        return {'entries': self.used, 'capacity': self.capacity, 'resumed': self.resumed,
+                'stepsSkipped': self.stepsSkipped, 'stepsTotal': self.stepsTotal,
+                'skipFraction': self.stepsSkipped / float(self.stepsTotal) if self.stepsTotal else 0.}
+
+
+# Create the store of a run for a route of the given length (None when disabled)
+def create(length):
+    global active
+    active = store(length, config.SIM_CHECKPOINT_BUDGET) if config.SIM_CHECKPOINTS else None
+    return active
@@ -1,12 +1,111 @@
 
 # Simulation configurations
 ARRAY_MESH_CALCULATION = True
+ARRAY_MESH_CACHE = True     # Keep the parsed array mesh in a binary file next to the mesh file (<mesh>.npz)
+ARRAY_LUT = True            # Interpolate the mesh power from a table built at load time (False: exact mesh calculation)
+ARRAY_LUT_RESOLUTION = 1.   # Angular resolution of the array power table (deg)
+ARRAY_CLUSTER = False       # Reduce the array mesh to a small set of representative normals at load time
+ARRAY_CLUSTER_COUNT = 0     # Number of representative normals (0: as many as ARRAY_CLUSTER_TOL requires)
+ARRAY_CLUSTER_TOL = 5.      # Maximum angle between a facet and the seed of its group (deg)
 EN_WIND = False
+FAST_SPEED_SOLVER = True  # Closed-form step speed solver (solver.py) instead of scipy fsolve
+PBATT_EXPECTED = 360.   # Expected battery power the genes are offsets from (W); keep it above the rolling resistance
+                        # power or the speed solution may fail
+SIM_COPY_FREE = True    # Simulate on the shared compiled route instead of deep copying the car and world per evaluation
+SIM_CHECKPOINTS = True  # Resume the simulation of a profile after the steps it shares with a recently simulated one
+SIM_CHECKPOINT_BUDGET = 4 * 1024 * 1024     # Memory budget of the per-step checkpoint store (bytes)
+SIM_ABORT_SOC = False   # Stop simulating a profile once the battery SoC drops below SIM_SOC_MIN (step.checkConstraints)
+SIM_SOC_MIN = 0.        # Minimum battery SoC (%)
+SIM_INFEASIBLE_TIME = 1e6   # Penalty elapsed time of aborted profiles, plus the lower bound of their remaining time (s)
+SIM_PRUNE_BOUND = False # Stop simulating a GA individual once it can no longer beat the best elapsed time so far
+SIM_PRUNE_SPEED_FACTOR = 1. # Speed of the remaining time lower bound relative to the step speed limits; the
+                            # simulation does not cap speeds at the limits, raise this if the car can exceed them
+CHARGE_INTEGRATED = True    # Compute the energy of a whole charging window in one call instead of minute by minute
+CHARGE_CHUNK = 2048         # Maximum number of charging samples evaluated at once against the array mesh
+PREPROCESS_CHUNK = 4096     # Number of gpx waypoints processed at once by world.preprocessWorld
+
+# Dynamic programming / beam search planner (planner.py)
+DP_ACTIONS = 21         # Number of battery power levels tried at every step
+DP_POWER_MIN = -100.    # Battery power levels relative to PBATT_EXPECTED (W)
+DP_POWER_MAX = 100.
+DP_SOC_BINS = 50        # SoC cells of the state grid
+DP_SOC_MIN = 0.         # SoC range of the state grid (%); states below DP_SOC_MIN are infeasible and dropped,
+                        # states above DP_SOC_MAX fall in the top cells
+DP_SOC_MAX = 100.
+DP_SPEED_BINS = 20      # Speed cells of the state grid
+DP_SPEED_MAX = 40.      # Speed range of the state grid (ms-1) from 0
+DP_BEAM = 1000          # Maximum number of states kept per step (beam width)
+
+# Gradient based optimizer (gradient.py)
+GRAD_METHOD = 'SLSQP'       # 'SLSQP' (SoC constraints) or 'L-BFGS-B' (SoC penalty)
+GRAD_STEP = 1.              # Finite difference step of the battery power (W)
+GRAD_MAX_ITER = 100         # Maximum number of iterations
+GRAD_TOL = 1e-2             # Change of the elapsed race time (s) at which SLSQP stops
+GRAD_POWER_MIN = -100.      # Bounds of the battery power relative to PBATT_EXPECTED (W)
+GRAD_POWER_MAX = 100.
+GRAD_SOC_MIN = 0.           # Minimum SoC at the end of every step (%)
+GRAD_SOC_PENALTY = 100.     # Penalty weight of SoC violations with L-BFGS-B (s %-2)
+GRAD_INVALID_TIME = 1e6     # Elapsed race time given to profiles the car cannot traverse the route with (s)
+GRAD_WARM_START = False     # Start from the best individual of a full genetic algorithm run (False: a zero profile)
+
+# CMA-ES optimizer (optimizer.runCMA)
+CMA_SIGMA = 30.         # Initial standard deviation of the battery power offsets (W)
+CMA_LAMBDA = 0          # Offspring per generation (0: 4 + 3 ln(number of genes))
+CMA_GEN_NUM = 100       # Number of generations
+CMA_POWER_MIN = -100.   # Bounds of the battery power offsets; samples outside are clipped (W)
+CMA_POWER_MAX = 100.
+
+# Hot path instrumentation (instrument.py)
+INSTRUMENT = False                      # Count and time the simulation hot paths, including in worker processes
+INSTRUMENT_REPORT = './instrument.json' # JSON report written at the end of optimizer.optimize
+
+# Solar ephemeris cache (sun_cache.py)
+SUN_CACHE = False               # Look up the sun's position in a precomputed table instead of recomputing it;
+                                # approximate, shifts eTime of runs with overnight stops by up to ~0.6%
+SUN_CACHE_DAYS = 6              # Number of days covered by the table from the start of the race
+SUN_CACHE_RESOLUTION = 120.     # Initial time resolution of the table (s); refined until the tolerances are met
+SUN_CACHE_BUCKET = 0.05         # Size of the location buckets (deg)
+SUN_CACHE_TOL_ANGLE = 0.1       # Maximum error of the sun direction (deg)
+SUN_CACHE_TOL_IRRADIANCE = 2.   # Maximum error of the irradiance (W m-2)
+SUN_CACHE_MAX_ENTRIES = 4000000 # Maximum number of (time, location bucket) entries of the table
+SUN_CACHE_RISESET_SIZE = 1024   # Maximum number of memoized sunrise/sunset days and locations
+SUN_CACHE_TOL_RISESET = 60.     # Maximum error of the memoized sunrise/sunset times over their day (s); days with a
+                                # larger one are not memoized
 
 # Genetic Algorithm configurations
+OPTIMIZER_ENGINE = 'ga'  # Optimizer used by optimizer.optimize: 'ga' (genetic algorithm), 'cma' (CMA-ES),
+                         # 'dp' (planner.py) or 'gradient' (gradient.py)
 GA_POP_NUM = 10         # Population per generation
+GA_GENES = 100          # Genes of a genome (battery power offsets, see genome.py)
+GENOME_MAPPING = 'legacy'   # Steps driven by each gene: 'legacy' (gene index - 1), 'steps' or 'distance' (genome.py)
+GENOME_LEVELS = ()      # Gene counts of a progressive refinement from coarse to fine, eg. (10, 50, 100); the
+                        # generations are split evenly across the levels (empty: a single genome of GA_GENES genes);
+                        # coarse levels need the 'steps' or 'distance' mapping
 GA_GEN_NUM = 100        # Number of generations
 GA_MULTITHREAD = False  # Enable multithreading
+GA_POOL_PROCESSES = 0   # Number of evaluation worker processes with multithreading (0: one per CPU)
+GA_POOL_CHUNKS = 1      # Number of chunks each worker receives per evaluated population
+GA_ASYNC = False        # Asynchronous steady-state evolution on a process pool instead of generations
+GA_ASYNC_INFLIGHT = 2   # Evaluations kept pending per worker process in asynchronous mode
+GA_ISLANDS = 0          # Number of island sub-populations evolved in their own processes (0 or 1: single population)
+GA_ISLAND_INTERVAL = 10     # Generations between two migrations
+GA_ISLAND_MIGRANTS = 2      # Number of best individuals sent by an island at each migration
+GA_ISLAND_TOPOLOGY = 'ring' # Islands receiving the migrants: 'ring' (next island), 'full' (all others), 'random' (one)
+GA_ISLAND_POLL = 1.         # Interval of the checks that the islands are alive while waiting for their results (s)
+GA_CHECKPOINT = False   # Save the state of batch evaluated GA runs after generations (run_state.py)
+GA_CHECKPOINT_FILE = './ga.checkpoint'  # Checkpoint file (refinement levels and islands add .level<n> and .island<n>
+                                        # suffixes)
+GA_CHECKPOINT_INTERVAL = 1  # Generations between checkpoints
+GA_RESUME = False       # Resume a checkpointed run from its checkpoint file when there is one
+GA_LOGBOOK_FILE = ''    # Stream the logbook records as JSON lines to this file ('' - off)
+SURROGATE = False       # Pre-screen the offspring of batch evaluated GA runs with a surrogate model (surrogate.py)
+SURROGATE_POOL = 4      # Candidates bred per generation, in multiples of the population
+SURROGATE_SEGMENTS = 10 # Gene segments averaged into the features of the model
+SURROGATE_ALPHA = 1e-3  # Ridge regularization weight
+SURROGATE_MIN_SAMPLES = 50  # Simulated genomes needed before the model screens candidates
+GA_BATCH_EVAL = True    # Evaluate each generation as one population batch (batch.py) instead of per individual
+GA_FITNESS_CACHE = True         # Reuse the fitness of genomes already simulated in the run (batch evaluation only)
+GA_FITNESS_CACHE_SIZE = 100000  # Maximum number of cached fitnesses
 
 # Route parameters
 SL_CONTROL_STOP = 16.67  # Control stop speed limit (ms-1)
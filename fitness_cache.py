@@ -0,0 +1,91 @@
+# Fitness memoization for the optimizer
+# The simulation is deterministic for a given genome (the route, car and starting conditions are fixed for a run), so
+# the elapsed race time of an individual (and whether it is the penalty of an early stop, see batch.simulate) is cached
+# under a hash of its gene bytes. Identical individuals within a population are simulated once, and individuals seen
+# in earlier generations are not simulated again.
+# The cache is a bounded LRU and must be discarded whenever the world changes (see optimizer.optimize).
+
+import collections
+import hashlib
+
+import numpy as np
+
+
+class cache:
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.table = collections.OrderedDict()  # Gene hash -> (elapsed race time, stopped), least recently used first
+
+        # Counters since the last collect()
+        self.lookups = 0        # Individuals evaluated through the cache
+        self.hits = 0           # Found in the cache
+        self.duplicates = 0     # Identical to another individual of the same population
+        self.simulations = 0    # Actually simulated
+
+    # Key of an individual's genes
+    @staticmethod
+    def key(genes):
+        return hashlib.blake2b(np.ascontiguousarray(genes, dtype=np.float64).tobytes(), digest_size=16).digest()
+
+    def get(self, key):
+        entry = self.table.get(key)
+        if entry is not None:
+            self.table.move_to_end(key)
+        return entry
+
+    def put(self, key, eTime, stopped=False):
+        self.table[key] = (eTime, stopped)
+        self.table.move_to_end(key)
+        if len(self.table) > self.capacity:
+            self.table.popitem(last=False)
+
+    # Elapsed race times of a population (individuals x genes) and the mask of those stopped early
+    # Only the distinct individuals missing from the cache are handed to simulate (population -> elapsed race times and
+    # stopped mask)
+    def evaluate(self, genes, simulate):
+        genes = np.asarray(genes, dtype=np.float64)
+        eTimes = np.empty(len(genes))
+        stopped = np.zeros(len(genes), dtype=bool)
+        pending = collections.OrderedDict()     # Gene hash -> rows of the population with these genes
+        for row in range(len(genes)):
+            key = self.key(genes[row])
+            entry = self.get(key)
+            if entry is not None:
+                self.hits += 1
+                eTimes[row], stopped[row] = entry
+            elif key in pending:
+                self.duplicates += 1
+                pending[key].append(row)
+            else:
+                pending[key] = [row]
+        self.lookups += len(genes)
+
+        if pending:
+            results, early = simulate(genes[[rows[0] for rows in pending.values()]])
+            for (key, rows), eTime, stop in zip(pending.items(), results, early):
+                self.put(key, float(eTime), bool(stop))
+                eTimes[rows] = eTime
+                stopped[rows] = stop
+            self.simulations += len(pending)
+        return eTimes, stopped
+
+    # Single individual counterparts of evaluate: cached elapsed race time (None if unknown) and storing a result
+    def lookup(self, genes):
+        self.lookups += 1
+        entry = self.get(self.key(genes))
+        if entry is None:
+            return None
+        self.hits += 1
+        return entry[0]
+
+    def store(self, genes, eTime):
+        self.simulations += 1
+        self.put(self.key(genes), float(eTime))
+
+    # Counters since the last call, with the fraction of lookups that did not need a simulation
+    def collect(self):
+        counts = {'lookups': self.lookups, 'hits': self.hits, 'duplicates': self.duplicates,
+                  'simulations': self.simulations,
+                  'hitrate': (self.hits + self.duplicates) / float(self.lookups) if self.lookups else 0.}
+        self.lookups = self.hits = self.duplicates = self.simulations = 0
+        return counts
@@ -0,0 +1,49 @@
+# Genome to route mapping
+# A genome is a vector of battery power offsets (W); every route step takes the offset of one gene. The mapping is a
+# pure function of config.GENOME_MAPPING, the number of genes and the compiled route, so genomes of different lengths
+# (the levels of a progressive refinement) can be simulated side by side and worker processes need no extra state:
+#   - 'legacy'  : step index uses gene index - 1 (the first step uses the last gene); needs one gene per step
+#   - 'steps'   : every gene covers an equal range of consecutive steps
+#   - 'distance': every gene covers an equal length of the route
+
+import numpy as np
+
+import config
+import world
+
+
+# Gene index of every step of the compiled route for a genome of count genes
+def stepIndex(count, kind=None):
+    kind = config.GENOME_MAPPING if kind is None else kind
+    rt = world.compiledRoute
+    if kind == 'legacy':
+        if rt.length > count + 1:
+            raise ValueError('Legacy genome mapping needs a gene per step: %d genes for %d steps' % (count, rt.length))
+        return np.arange(rt.length) - 1
+    if kind == 'steps':
+        return np.arange(rt.length) * count // rt.length
+    if kind == 'distance':
+        start = np.asarray(rt.trip, dtype=np.float64) - np.asarray(rt.dist, dtype=np.float64)
+        return np.minimum((start / rt.trip[-1] * count).astype(int), count - 1)
+    raise ValueError('Unknown genome mapping: %s' % kind)
+
+
+# Battery power offset of every step (genomes x steps) from genomes (genomes x genes, or a single genome)
+def expand(genes):
+    genes = np.asarray(genes, dtype=np.float64)
+    return genes[..., stepIndex(genes.shape[-1])]
+
+
+# Genome of count genes closest to a profile of step offsets: every gene takes the mean offset of its steps
+# Genes without any step are left at zero
+def project(stepPower, count):
+    index = stepIndex(count) % count
+    total = np.bincount(index, weights=stepPower, minlength=count)
+    steps = np.bincount(index, minlength=count)
+    return np.where(steps > 0, total / np.maximum(steps, 1), 0.)
+
+
+# Refine a genome to count genes; the refined genome drives the steps like the original wherever its segments are
+# nested in the original ones
+def refine(genes, count):
+    return project(expand(genes), count)
@@ -0,0 +1,122 @@
+# Gradient based optimizer for the battery power profile
+# The profile is treated as a continuous vector and the elapsed race time is minimized with a quasi-Newton method
+# (SLSQP, or L-BFGS-B with a penalty) subject to SoC >= config.GRAD_SOC_MIN at the end of every step. Gradients are
+# finite differences (forward, backward for genes within a step of the upper power bound): the profile and its
+# perturbation in every gene are simulated as one population with batch.simulate, or across the evaluation pool when
+# there is one, which yields the gradient of the elapsed race time and the Jacobian of the SoC trajectory at once.
+# Can be warm started from any profile, eg. the best individual of the genetic algorithm.
+
+import time
+
+import numpy as np
+
+from scipy.optimize import minimize
+
+import batch
+import config
+import world
+
+
+class profileModel:
+    # Objective and constraint functions of a profile of count genes for scipy.optimize.minimize
+    # Profiles are simulated on the evaluation pool when one is given (see workers.pool), else in this process
+    def __init__(self, count, step, upper, pool=None):
+        self.count = count
+        self.step = step
+        self.upper = upper      # Upper bound of the genes; the finite differences never step past it
+        self.pool = pool
+        self.simulations = 0
+        self.initial = None     # Elapsed race time of the first profile simulated
+        self.point = None       # Profile of the cached value
+        self.gradPoint = None   # Profile of the cached gradient
+
+    # Elapsed race time (invalid profiles get config.GRAD_INVALID_TIME) and SoC trajectory of a set of profiles
+    def _simulate(self, population):
+        if self.pool is not None:
+            eTime, soc = self.pool.evaluate(population, trajectory=True)
+        else:
+            eTime, soc = batch.simulate(population, trajectory=True)
+        self.simulations += len(population)
+        return np.where(np.isfinite(eTime), eTime, config.GRAD_INVALID_TIME), soc
+
+    def _value(self, x):
+        if self.point is None or not np.array_equal(x, self.point):
+            eTime, soc = self._simulate(x[np.newaxis])
+            self.point, self.eTime, self.soc = x.copy(), eTime[0], soc[0]
+            if self.initial is None:
+                self.initial = self.eTime
+
+    def _gradient(self, x):
+        if self.gradPoint is None or not np.array_equal(x, self.gradPoint):
+            step = np.where(x + self.step > self.upper, -self.step, self.step)
+            eTime, soc = self._simulate(np.vstack((x, x + np.diag(step))))
+            self.point, self.eTime, self.soc = x.copy(), eTime[0], soc[0]
+            if self.initial is None:
+                self.initial = self.eTime
+            self.gradPoint = x.copy()
+            self.eTimeGrad = (eTime[1:] - eTime[0]) / step
+            self.socJac = ((soc[1:] - soc[0]) / step[:, np.newaxis]).T     # steps x genes
+
+    def eTimeFun(self, x):
+        self._value(x)
+        return self.eTime
+
+    def eTimeJac(self, x):
+        self._gradient(x)
+        return self.eTimeGrad
+
+    def socFun(self, x):
+        self._value(x)
+        return self.soc - config.GRAD_SOC_MIN
+
+    def socJacobian(self, x):
+        self._gradient(x)
+        return self.socJac
+
+    # Penalized objective for methods without constraints
+    def penaltyFun(self, x):
+        self._value(x)
+        return self.eTime + config.GRAD_SOC_PENALTY * np.sum(np.minimum(self.socFun(x), 0.) ** 2)
+
+    def penaltyJac(self, x):
+        self._gradient(x)
+        violation = np.minimum(self.socFun(x), 0.)
+        return self.eTimeGrad + 2 * config.GRAD_SOC_PENALTY * np.matmul(violation, self.socJac)
+
+
+# Minimize the elapsed race time from the initial profile x0 (genes, see genome.py), simulating on the evaluation pool
+# when one is given
+# Returns the optimized profile, its elapsed race time validated with world.simulate and the scipy result
+def optimize(x0, verbose=__debug__, pool=None):
+    start = time.time()
+    x0 = np.clip(np.asarray(x0, dtype=np.float64), config.GRAD_POWER_MIN, config.GRAD_POWER_MAX)
+    model = profileModel(len(x0), config.GRAD_STEP, config.GRAD_POWER_MAX, pool)
+
+    # The optimizer works on the profile scaled to [0, 1] between the power bounds; a gradient of a fraction of a
+    # second per W would otherwise make the first quasi-Newton steps a fraction of a W long
+    low = config.GRAD_POWER_MIN
+    scale = config.GRAD_POWER_MAX - config.GRAD_POWER_MIN
+    bounds = [(0., 1.)] * len(x0)
+    z0 = (x0 - low) / scale
+
+    if config.GRAD_METHOD == 'SLSQP':
+        result = minimize(lambda z: model.eTimeFun(low + scale * z), z0,
+                          jac=lambda z: model.eTimeJac(low + scale * z) * scale, method='SLSQP', bounds=bounds,
+                          options={'maxiter': config.GRAD_MAX_ITER, 'ftol': config.GRAD_TOL},
+                          constraints=[{'type': 'ineq', 'fun': lambda z: model.socFun(low + scale * z),
+                                        'jac': lambda z: model.socJacobian(low + scale * z) * scale}])
+    elif config.GRAD_METHOD == 'L-BFGS-B':
+        result = minimize(lambda z: model.penaltyFun(low + scale * z), z0,
+                          jac=lambda z: model.penaltyJac(low + scale * z) * scale, method='L-BFGS-B', bounds=bounds,
+                          options={'maxiter': config.GRAD_MAX_ITER})
+    else:
+        raise ValueError('Unknown gradient method: %s' % config.GRAD_METHOD)
+    result.x = low + scale * result.x
+
+    eTime = world.simulate(result.x)
+    if verbose:
+        print('Gradient %s: %s; %d iterations, %d simulations, eTime %.3f s -> %.3f s, %.2f s compute'
+              % (config.GRAD_METHOD, result.message, result.nit, model.simulations, model.initial, eTime,
+                 time.time() - start))
+    result.simulations = model.simulations
+    return result.x, eTime, result
@@ -0,0 +1,55 @@
+# Hot path instrumentation
+# Optional counters and timers of the simulation (array input calls, speed solver iterations and failures, charging
+# minutes, control stop and end of day events, time spent per layer), enabled with config.INSTRUMENT. The hot paths
+# check the flag before touching this module, so the disabled cost is one attribute lookup. Worker processes return
+# their counters with their results (see collect) and the parent merges them, so the report written at the end of
+# optimizer.optimize covers the whole run.
+
+import collections
+import json
+import time
+
+counts = collections.Counter()      # Event and call counts
+seconds = collections.Counter()     # Time spent per timed name (s)
+
+
+def count(name, number=1):
+    counts[name] += number
+
+
+# Count a call of name and add the time since start (a time.perf_counter value)
+def timed(name, start):
+    counts[name] += 1
+    seconds[name] += time.perf_counter() - start
+
+
+# Counters since the last collect, which are cleared; sent by worker processes with their results
+def collect():
+    snapshot = {'counts': dict(counts), 'seconds': dict(seconds)}
+    counts.clear()
+    seconds.clear()
+    return snapshot
+
+
+# Add the counters collected in another process
+def merge(snapshot):
+    if snapshot is not None:
+        counts.update(snapshot['counts'])
+        seconds.update(snapshot['seconds'])
+
+
+def reset():
+    counts.clear()
+    seconds.clear()
+
+
+# Write the counters as JSON; timed names also get their mean time per call
+def report(path, extra=None):
+    data = {'counts': dict(sorted(counts.items())),
+            'seconds': dict(sorted(seconds.items())),
+            'meanSeconds': dict((name, seconds[name] / counts[name]) for name in sorted(seconds) if counts[name])}
+    if extra:
+        data.update(extra)
+    with open(path, 'w') as f:
+        json.dump(data, f, indent=2)
+    return data
@@ -0,0 +1,164 @@
+# Island model of the genetic algorithm
+# config.GA_ISLANDS sub-populations of config.GA_POP_NUM individuals each evolve in their own process with the batch
+# evaluation GA (optimizer.eaSimpleBatch). Every config.GA_ISLAND_INTERVAL generations an island sends copies of its
+# config.GA_ISLAND_MIGRANTS best individuals to its neighbours (config.GA_ISLAND_TOPOLOGY) and replaces its worst
+# individuals with whatever migrants have arrived in its queue. Islands never wait for each other; the only
+# synchronization is the final collection of the populations, halls of fame and logbooks.
+# Checkpoints, logbook files and surrogate models (see optimizer.evolveBatch) are per island, with an .island<n> suffix
+# on the file names. A resumed island restores its own state; migrants that were in flight are not saved.
+
+import multiprocessing
+import queue
+import random
+import traceback
+
+import numpy as np
+
+from deap import creator
+from deap import tools
+
+import config
+import fitness_cache
+import instrument
+import workers
+
+
+# Islands receiving the migrants of island index at a migration
+def targets(index, count, rng):
+    others = [island for island in range(count) if island != index]
+    if config.GA_ISLAND_TOPOLOGY == 'full':
+        return others
+    if config.GA_ISLAND_TOPOLOGY == 'random':
+        return [rng.choice(others)]
+    if config.GA_ISLAND_TOPOLOGY == 'ring':
+        return [(index + 1) % count]
+    raise ValueError('Unknown island topology: %s' % config.GA_ISLAND_TOPOLOGY)
+
+
+# Individuals are sent between processes as (genes, fitness) since the fitness does not survive NumPy pickling
+def _pack(individuals):
+    return [(np.asarray(ind).copy(), ind.fitness.values) for ind in individuals]
+
+
+def _unpack(packed):
+    individuals = []
+    for genes, fitness in packed:
+        ind = creator.Individual(genes)
+        ind.fitness.values = fitness
+        individuals.append(ind)
+    return individuals
+
+
+# Process of one island
+def _island(index, count, shared, seed, inboxes, results):
+    import optimizer    # Imported here since the optimizer dispatches to this module
+
+    try:
+        workers.attachWorld(*shared)
+        np.random.seed(seed)
+        random.seed(seed)
+        optimizer.fitnessCache = fitness_cache.cache(config.GA_FITNESS_CACHE_SIZE) if config.GA_FITNESS_CACHE else None
+        for inbox in inboxes:
+            inbox.cancel_join_thread()  # Migrants left unread at the end must not keep the island from exiting
+        counters = {'sent': 0, 'received': 0}
+
+        def migrate(gen, population):
+            if gen % config.GA_ISLAND_INTERVAL != 0:
+                return
+            emigrants = _pack(tools.selBest(population, config.GA_ISLAND_MIGRANTS))
+            for target in targets(index, count, random):
+                inboxes[target].put(emigrants)
+                counters['sent'] += len(emigrants)
+
+            immigrants = []
+            while True:
+                try:
+                    immigrants.extend(_unpack(inboxes[index].get_nowait()))
+                except queue.Empty:
+                    break
+            immigrants = immigrants[:len(population)]
+            if immigrants:
+                worst = sorted(range(len(population)), key=lambda i: population[i].fitness)[:len(immigrants)]
+                for i, ind in zip(worst, immigrants):
+                    population[i] = ind
+                counters['received'] += len(immigrants)
+
+        pop = optimizer.toolbox.population(n=config.GA_POP_NUM)
+        hof = optimizer.createHallOfFame()
+        pop, logbook = optimizer.evolveBatch(pop, config.GA_GEN_NUM, hof, optimizer.createStats(), '.island%d' % index,
+                                             verbose=False, migrate=migrate)
+        counters['instrument'] = instrument.collect() if config.INSTRUMENT else None
+        results.put((index, None, _pack(pop), _pack(hof), list(logbook), counters))
+    except Exception:
+        results.put((index, traceback.format_exc(), None, None, None, None))
+
+
+# Run the island model on the current world; returns the merged population, the statistics and the hall of fame
+def run(verbose=__debug__):
+    import optimizer
+
+    count = config.GA_ISLANDS
+    shared = workers.shareWorld()
+    seeds = np.random.randint(0, 2 ** 31 - 1, count)     # Islands are reproducible from the parent's NumPy seed
+    inboxes = [multiprocessing.Queue() for island in range(count)]
+    results = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=_island, args=(island, count, shared, int(seeds[island]), inboxes,
+                                                               results))
+                 for island in range(count)]
+    for process in processes:
+        process.daemon = True
+        process.start()
+
+    collected = {}
+    suspects = set()
+    try:
+        while len(collected) < count:
+            try:
+                index, error, pop, hof, logbook, counters = results.get(timeout=config.GA_ISLAND_POLL)
+            except queue.Empty:
+                # The result of an island is in the queue's pipe before its process exits, so an island still missing
+                # after being found dead at two polls in a row has died without one (eg. killed or out of memory)
+                dead = set(island for island in range(count)
+                           if island not in collected and not processes[island].is_alive())
+                if dead & suspects:
+                    island = min(dead & suspects)
+                    raise RuntimeError('Island %d died without a result (exit code %s)'
+                                       % (island, processes[island].exitcode))
+                suspects = dead
+                continue
+            if error is not None:
+                raise RuntimeError('Island %d failed:\n%s' % (index, error))
+            collected[index] = (pop, hof, logbook, counters)
+            instrument.merge(counters['instrument'])
+    finally:
+        for process in processes:
+            if len(collected) < count:
+                process.terminate()
+            process.join()
+        for inbox in inboxes:
+            while True:
+                try:
+                    inbox.get_nowait()
+                except queue.Empty:
+                    break
+
+    # Merge the islands
+    pop = []
+    hof = optimizer.createHallOfFame()
+    stats = optimizer.createStats()
+    logbook = tools.Logbook()
+    records = []
+    for island in range(count):
+        islandPop, islandHof, islandLogbook, counters = collected[island]
+        pop.extend(_unpack(islandPop))
+        hof.update(_unpack(islandHof))
+        records.extend(dict(record, island=island) for record in islandLogbook)
+    for record in sorted(records, key=lambda record: (record['gen'], record['island'])):
+        logbook.record(**record)
+    logbook.header = ['gen', 'island'] + [key for key in logbook[0] if key not in ('gen', 'island')]
+    if verbose:
+        print(logbook.stream)
+        for island in range(count):
+            counters = collected[island][3]
+            print('Island %d: sent %d, received %d migrants' % (island, counters['sent'], counters['received']))
+    return pop, stats, hof
@@ -1,31 +1,96 @@
+import concurrent.futures
+import functools
 import multiprocessing
+import random
+import time
+
 import numpy as np
 
 from deap import algorithms
 from deap import base
+from deap import cma
 from deap import creator
 from deap import tools
 
+import batch
+import checkpoints
 import config
+import fitness_cache
+import genome
+import gradient
+import instrument
+import islands
+import planner
+import run_state
+import sun_cache
+import surrogate
+import workers
 import world
 
 creator.create("FitnessMin", base.Fitness, weights=(-1.0,))     # Minimize the fitness function
 creator.create("Individual", np.ndarray, fitness=creator.FitnessMin)
 
 toolbox = base.Toolbox()
+evalPool = None     # Persistent evaluation worker pool of the current run (see workers.py)
+fitnessCache = None     # Fitness memoization of the current run (see fitness_cache.py)
+bestTime = float('inf')     # Best elapsed time simulated in the current run (bound of config.SIM_PRUNE_BOUND)
 
 toolbox.register("attr_bool", np.random.randint, -100, 100)
-toolbox.register("individual", tools.initRepeat, creator.Individual, toolbox.attr_bool, n=100)
+toolbox.register("individual", tools.initRepeat, creator.Individual, toolbox.attr_bool, n=config.GA_GENES)
 toolbox.register("population", tools.initRepeat, list, toolbox.individual)
 
 
-def evalOneMax(individual):
+# In a worker of the evaluation pool bound is the prune bound of the parent process (see mapPool); in this process it
+# defaults to pruneBound()
+def evalOneMax(individual, bound=None):
+    global bestTime
 
-    # TODO: Implement cost function with all the mathematical constraints
-    fitness = world.simulate(individual)
+    # Constraints and bound pruning are checked along the route (see step.checkConstraints)
+    fitness = world.simulate(individual, checkpoints.active, pruneBound() if bound is None else bound)
+    bestTime = min(bestTime, fitness)
     return fitness,
 
 
+# Population-level evaluation; the whole list of individuals is simulated as one batch (see batch.py)
+# With multithreading the population is split into chunks across the workers of the evaluation pool
+# With stopped the mask of the individuals whose fitness is the penalty of an early stop (pruned or aborted, see
+# batch.simulate) is returned along with the fitnesses
+def evalPopulation(individuals, stopped=False):
+    global bestTime
+    if len(individuals) == 0:
+        return ([], np.zeros(0, dtype=bool)) if stopped else []
+
+    genes = np.asarray(individuals, dtype=np.float64)
+    bound = pruneBound()
+    if evalPool is not None:
+        simulate = lambda population: evalPool.evaluate(population, bound, stopped=True)
+    else:
+        simulate = lambda population: batch.simulate(population, checkpoints.active, bound=bound, stopped=True)
+    if fitnessCache is not None:
+        eTimes, early = fitnessCache.evaluate(genes, simulate)
+    else:
+        eTimes, early = simulate(genes)
+    bestTime = min(bestTime, float(np.min(eTimes)))
+    fitnesses = [(eTime,) for eTime in eTimes]
+    return (fitnesses, early) if stopped else fitnesses
+
+
+# Elapsed time individuals must beat to be simulated to the end (None - no pruning)
+# Pruned individuals get a lower bound of their elapsed time, which is worse than the best one
+def pruneBound():
+    return bestTime if config.SIM_PRUNE_BOUND and bestTime < float('inf') else None
+
+
+# toolbox.map of per individual evaluation on the evaluation pool (config.GA_MULTITHREAD without batch evaluation)
+# The best elapsed time of a worker only covers its own evaluations, so every individual is evaluated with the bound
+# of this process and the best elapsed time here is updated from the results
+def mapPool(func, individuals):
+    global bestTime
+    fitnesses = evalPool.map(functools.partial(func, bound=pruneBound()), individuals)
+    bestTime = min([bestTime] + [fitness[0] for fitness in fitnesses])
+    return fitnesses
+
+
 def cxTwoPointCopy(ind1, ind2):
     """Execute a two points crossover with copy on the input individuals. The
     copy is required because the slicing in numpy returns a view of the data,
@@ -56,31 +121,440 @@ def cxTwoPointCopy(ind1, ind2):
 
 
 toolbox.register("evaluate", evalOneMax)
+toolbox.register("evaluatePopulation", evalPopulation)
 toolbox.register("mate", cxTwoPointCopy)
 toolbox.register("mutate", tools.mutFlipBit, indpb=0.05)
 toolbox.register("select", tools.selTournament, tournsize=3)
 
 
+# Run the configured optimizer; with config.INSTRUMENT the counters of the run, including those of the worker
+# processes, are written to config.INSTRUMENT_REPORT (see instrument.py)
 def optimize():
+    instrument.reset()
+    start = time.perf_counter()
+    try:
+        return runEngine()
+    finally:
+        if config.INSTRUMENT:
+            extra = {'engine': config.OPTIMIZER_ENGINE, 'wallTime': time.perf_counter() - start}
+            if config.SUN_CACHE:
+                extra['sunCache'] = sun_cache.stats()
+            instrument.report(config.INSTRUMENT_REPORT, extra)
+
+
+def runEngine():
+    global evalPool, fitnessCache, bestTime
+    bestTime = float('inf')
+    world.collectPruneStats()
+    if config.OPTIMIZER_ENGINE == 'dp':
+        return runPlanner()
+    if config.GA_ISLANDS > 1:
+        return islands.run()
+    if config.GA_ASYNC:
+        return runAsync()
+
     if config.GA_MULTITHREAD:
-        pool = multiprocessing.Pool()
-        toolbox.register("map", pool.map)
+        evalPool = workers.pool(config.GA_POOL_PROCESSES)
+        toolbox.register("map", mapPool)
+    fitnessCache = fitness_cache.cache(config.GA_FITNESS_CACHE_SIZE) if config.GA_FITNESS_CACHE else None
+    checkpoints.create(world.compiledRoute.length)
+    try:
+        if config.OPTIMIZER_ENGINE == 'cma':
+            return runCMA()
+        if config.OPTIMIZER_ENGINE == 'gradient':
+            return runGradient()
+        if config.GENOME_LEVELS:
+            return runProgressive()
+        return runGA()
+    finally:
+        fitnessCache = None
+        checkpoints.active = None
+        if evalPool is not None:
+            print(evalPool.report())
+            evalPool.close()
+            evalPool = None
+            toolbox.register("map", map)
 
-    pop = toolbox.population(n=config.GA_POP_NUM)
 
+def createHallOfFame():
     # Numpy equality function (operators.eq) between two arrays returns the
     # equality element wise, which raises an exception in the if similar()
     # check of the hall of fame. Using a different equality function like
     # numpy.array_equal or numpy.allclose solve this issue.
-    hof = tools.HallOfFame(1, similar=np.allclose)
+    return tools.HallOfFame(1, similar=np.allclose)
+
 
+def createStats():
     stats = tools.Statistics(lambda ind: ind.fitness.values)
     stats.register("avg", np.mean)
     stats.register("std", np.std)
     stats.register("min", np.min)
     stats.register("max", np.max)
+    return stats
+
+
+# Genetic algorithm from a random population, or from pop for ngen generations (by default config.GA_GEN_NUM)
+# Batch evaluated runs are checkpointed, resumed and logged as set up by evolveBatch, with fields in every record
+def runGA(pop=None, ngen=None, tag='', fields=None):
+    if pop is None:
+        pop = toolbox.population(n=config.GA_POP_NUM)
+    ngen = config.GA_GEN_NUM if ngen is None else ngen
+    hof = createHallOfFame()
+    stats = createStats()
+
+    if config.GA_BATCH_EVAL:
+        evolveBatch(pop, ngen, hof, stats, tag, fields=fields)
+    else:
+        algorithms.eaSimple(pop, toolbox, cxpb=0.5, mutpb=0.5, ngen=ngen, stats=stats, halloffame=hof)
+
+    return pop, stats, hof
+
+
+# Batch evaluated GA (eaSimpleBatch) on pop for ngen generations; returns the final population and the logbook
+# With config.GA_CHECKPOINT the run is checkpointed to config.GA_CHECKPOINT_FILE (suffixed with tag) and, with
+# config.GA_RESUME, resumed from it; with config.GA_LOGBOOK_FILE (suffixed with tag) the logbook is streamed to it;
+# with config.SURROGATE the offspring are pre-screened by a surrogate model; fields are added to every logbook record
+def evolveBatch(pop, ngen, hof, stats, tag='', verbose=__debug__, migrate=None, fields=None):
+    checkpoint = config.GA_CHECKPOINT_FILE + tag if config.GA_CHECKPOINT else None
+    resume = run_state.load(checkpoint) if checkpoint is not None and config.GA_RESUME else None
+    records = resume['logbook'][0] if resume is not None else ()
+    logstream = run_state.logStream(config.GA_LOGBOOK_FILE + tag, records) if config.GA_LOGBOOK_FILE else None
+    model = surrogate.ridgeModel(config.SURROGATE_SEGMENTS, config.SURROGATE_ALPHA) if config.SURROGATE else None
+    try:
+        return eaSimpleBatch(pop, toolbox, cxpb=0.5, mutpb=0.5, ngen=ngen, stats=stats, halloffame=hof,
+                             verbose=verbose, cache=fitnessCache, migrate=migrate, checkpoint=checkpoint,
+                             resume=resume, logstream=logstream, surrogate=model, fields=fields)
+    finally:
+        if logstream is not None:
+            logstream.close()
 
-    algorithms.eaSimple(pop, toolbox, cxpb=0.5, mutpb=0.5, ngen=config.GA_GEN_NUM, stats=stats,
-                        halloffame=hof)
 
+# Progressive refinement of the genome (see genome.py): the GA optimizes a coarse profile of config.GENOME_LEVELS[0]
+# genes first; every following level refines the best individual and the rest of the final population of the
+# previous level to its gene count and evolves them further. The level and its gene count are fields of the logbook
+# records of batch evaluated runs.
+def runProgressive():
+    ngen = max(config.GA_GEN_NUM // len(config.GENOME_LEVELS), 1)
+    pop = None
+    for level, count in enumerate(config.GENOME_LEVELS):
+        if pop is None:
+            pop = [tools.initRepeat(creator.Individual, toolbox.attr_bool, n=count) for i in range(config.GA_POP_NUM)]
+        else:
+            pop = [creator.Individual(np.rint(genome.refine(ind, count))) for ind in [hof[0]] + pop[:-1]]
+        pop, stats, hof = runGA(pop, ngen, '.level%d' % level, {'level': level, 'genes': count})
     return pop, stats, hof
+
+
+# CMA-ES on real valued battery power offsets, starting from a zero profile
+# Every sampled generation is evaluated as one population (see eaGenerateUpdateBatch)
+def runCMA():
+    genes = len(toolbox.individual())
+    hof = createHallOfFame()
+    stats = createStats()
+
+    kargs = {'lambda_': config.CMA_LAMBDA} if config.CMA_LAMBDA > 0 else {}
+    strategy = cma.Strategy(centroid=np.zeros(genes), sigma=config.CMA_SIGMA, **kargs)
+    cmaToolbox = base.Toolbox()
+    cmaToolbox.register("generate", strategy.generate,
+                        lambda values: creator.Individual(np.clip(values, config.CMA_POWER_MIN, config.CMA_POWER_MAX)))
+    cmaToolbox.register("update", strategy.update)
+    cmaToolbox.register("evaluatePopulation", evalPopulation)
+
+    pop, logbook = eaGenerateUpdateBatch(cmaToolbox, ngen=config.CMA_GEN_NUM, stats=stats, halloffame=hof,
+                                         cache=fitnessCache)
+    return pop, stats, hof
+
+
+# Dynamic programming / beam search planner (see planner.py); the planned profile is the only individual
+def runPlanner():
+    profile, plannedTime, simulatedTime = planner.plan()
+    ind = creator.Individual(profile)
+    ind.fitness.values = simulatedTime,
+    hof = createHallOfFame()
+    hof.update([ind])
+    return [ind], createStats(), hof
+
+
+# Gradient based optimizer (see gradient.py), warm started from the best individual of a genetic algorithm run
+# The optimized profile is added to the population and the hall of fame
+def runGradient():
+    if config.GRAD_WARM_START:
+        pop, stats, hof = runGA()
+        x0 = hof[0]
+    else:
+        pop, stats, hof = [], createStats(), createHallOfFame()
+        x0 = np.zeros(len(toolbox.individual()))
+    profile, eTime, result = gradient.optimize(x0, pool=evalPool)
+    ind = creator.Individual(profile)
+    ind.fitness.values = eTime,
+    hof.update([ind])
+    return pop + [ind], stats, hof
+
+
+# Asynchronous steady-state evolution on a process pool (see eaSteadyStateAsync)
+def runAsync():
+    global fitnessCache
+    processes = config.GA_POOL_PROCESSES if config.GA_POOL_PROCESSES > 0 else multiprocessing.cpu_count()
+    fitnessCache = fitness_cache.cache(config.GA_FITNESS_CACHE_SIZE) if config.GA_FITNESS_CACHE else None
+    pop = toolbox.population(n=config.GA_POP_NUM)
+    hof = createHallOfFame()
+    stats = createStats()
+    try:
+        with concurrent.futures.ProcessPoolExecutor(processes, initializer=workers.attachWorld,
+                                                    initargs=workers.shareWorld()) as executor:
+            eaSteadyStateAsync(pop, toolbox, cxpb=0.5, mutpb=0.5, nevals=config.GA_POP_NUM * config.GA_GEN_NUM,
+                               executor=executor, inflight=processes * config.GA_ASYNC_INFLIGHT, stats=stats,
+                               halloffame=hof, cache=fitnessCache)
+    finally:
+        fitnessCache = None
+    return pop, stats, hof
+
+
+# Asynchronous steady-state evolution without a generation barrier
+# Individuals are simulated one by one on the executor (workers.evaluateOne) with up to inflight evaluations pending.
+# As soon as an evaluation completes its individual enters the population (replacing the worst individual if it is
+# better once the population is full) and a new offspring is bred from the current population and submitted, so the
+# workers never wait for the slowest evaluation of a generation. The initial population is evaluated first, then
+# nevals offspring in total. Every len(population) completed evaluations are logged as one generation.
+def eaSteadyStateAsync(population, toolbox, cxpb, mutpb, nevals, executor, inflight, stats=None, halloffame=None,
+                       verbose=__debug__, cache=None):
+    logbook = tools.Logbook()
+    logbook.header = _logHeader(stats, cache)
+    size = len(population)
+    initial = list(population)
+    population[:] = []
+    pending = {}
+    submitted = 0
+    completed = 0
+    logged = 0      # Evaluations completed at the last logbook record
+
+    # Offspring of two parents selected from the evaluated population (see algorithms.varAnd)
+    def breed():
+        offspring = [toolbox.clone(ind) for ind in toolbox.select(population, 2)]
+        if random.random() < cxpb:
+            offspring[0], offspring[1] = toolbox.mate(offspring[0], offspring[1])
+        if random.random() < mutpb:
+            offspring[0], = toolbox.mutate(offspring[0])
+        del offspring[0].fitness.values
+        return offspring[0]
+
+    # Enter an evaluated individual into the population
+    def insert(ind):
+        global bestTime
+        bestTime = min(bestTime, ind.fitness.values[0])
+        if halloffame is not None:
+            halloffame.update([ind])
+        if len(population) < size:
+            population.append(ind)
+        else:
+            worst = min(range(size), key=lambda i: population[i].fitness)
+            if ind.fitness > population[worst].fitness:
+                population[worst] = ind
+
+    while completed < size + nevals:
+        # Keep the workers busy: submit the initial individuals, then offspring
+        while len(pending) < inflight and submitted < size + nevals:
+            if submitted >= size and len(population) == 0:
+                break   # Nothing evaluated to breed from yet
+            ind = initial[submitted] if submitted < size else breed()
+            submitted += 1
+            eTime = cache.lookup(ind) if cache is not None else None
+            if eTime is not None:
+                ind.fitness.values = eTime,
+                insert(ind)
+                completed += 1
+            else:
+                pending[executor.submit(workers.evaluateOne, np.asarray(ind, dtype=np.float64), pruneBound())] = ind
+
+        if pending:
+            done, notDone = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                ind = pending.pop(future)
+                eTime, counters, pruned = future.result()
+                instrument.merge(counters)
+                world.mergePruneStats(pruned)
+                ind.fitness.values = eTime,
+                if cache is not None:
+                    cache.store(ind, ind.fitness.values[0])
+                insert(ind)
+                completed += 1
+
+        # Append the statistics of the population to the logbook at every generation's worth of evaluations
+        if completed - logged >= size or completed == size + nevals:
+            record = stats.compile(population) if stats else {}
+            record.update(_cacheRecord(cache))
+            record.update(_pruneRecord())
+            logbook.record(gen=len(logbook), nevals=completed - logged, **record)
+            logged = completed
+            if verbose:
+                print(logbook.stream)
+
+    return population, logbook
+
+
+# Same algorithm as deap.algorithms.eaSimple, but the individuals with an invalid fitness of a generation are handed
+# to toolbox.evaluatePopulation at once instead of being mapped one by one over toolbox.evaluate
+# With a fitness cache the number of simulations actually run and the cache hit rate are added to the logbook
+# migrate(gen, population) is called after every generation and may replace individuals of the population in place
+# With a checkpoint path the state of the run is saved every config.GA_CHECKPOINT_INTERVAL generations and after the
+# last one, and a run given the state of a checkpoint (resume, see run_state.load) continues after its generation
+# with the best elapsed time and the surrogate model of the checkpoint
+# With a logstream (see run_state.logStream) every new logbook record is also written to it; the stream of a resumed
+# run is opened with the records of its checkpoint (see runGA)
+# With a surrogate model (see surrogate.py) config.SURROGATE_POOL times the population is bred every generation and
+# only the candidates the model ranks best are simulated
+# fields are constant fields added to every logbook record after the generation (eg. the level of a refinement)
+def eaSimpleBatch(population, toolbox, cxpb, mutpb, ngen, stats=None, halloffame=None, verbose=__debug__,
+                  cache=None, migrate=None, checkpoint=None, resume=None, logstream=None, surrogate=None, fields=None):
+    fields = fields if fields is not None else {}
+    global bestTime
+    if resume is not None:
+        start, logbook, extra = run_state.restore(resume, population, halloffame)
+        bestTime = min(bestTime, extra['bestTime'])
+        if surrogate is not None and extra.get('surrogate') is not None:
+            surrogate.restore(extra['surrogate'])
+        if verbose:
+            print('Resumed after generation %d' % start)
+            print(logbook.stream)
+    else:
+        start = 0
+        logbook = tools.Logbook()
+        logbook.header = _logHeader(stats, cache, surrogate, fields)
+
+        # Evaluate the individuals with an invalid fitness
+        invalid_ind = [ind for ind in population if not ind.fitness.valid]
+        if surrogate is not None:
+            fitnesses, stopped = toolbox.evaluatePopulation(invalid_ind, stopped=True)
+        else:
+            fitnesses = toolbox.evaluatePopulation(invalid_ind)
+        for ind, fit in zip(invalid_ind, fitnesses):
+            ind.fitness.values = fit
+        if surrogate is not None:
+            surrogate.update(invalid_ind, stopped)
+
+        if halloffame is not None:
+            halloffame.update(population)
+
+        record = stats.compile(population) if stats else {}
+        record.update(_cacheRecord(cache))
+        record.update(_pruneRecord())
+        record.update(_surrogateRecord(surrogate))
+        record.update(fields)
+        logbook.record(gen=0, nevals=len(invalid_ind), **record)
+        if verbose:
+            print(logbook.stream)
+        if logstream is not None:
+            logstream.write(logbook[-1])
+
+    # Begin the generational process
+    for gen in range(start + 1, ngen + 1):
+        # Select the next generation individuals and vary the pool of individuals
+        if surrogate is not None:
+            candidates = []
+            for pool in range(config.SURROGATE_POOL):
+                candidates.extend(algorithms.varAnd(toolbox.select(population, len(population)), toolbox, cxpb, mutpb))
+            offspring = surrogate.screen(candidates, len(population))
+        else:
+            offspring = toolbox.select(population, len(population))
+            offspring = algorithms.varAnd(offspring, toolbox, cxpb, mutpb)
+
+        # Evaluate the individuals with an invalid fitness
+        invalid_ind = [ind for ind in offspring if not ind.fitness.valid]
+        if surrogate is not None:
+            fitnesses, stopped = toolbox.evaluatePopulation(invalid_ind, stopped=True)
+        else:
+            fitnesses = toolbox.evaluatePopulation(invalid_ind)
+        for ind, fit in zip(invalid_ind, fitnesses):
+            ind.fitness.values = fit
+        if surrogate is not None:
+            surrogate.update(invalid_ind, stopped)
+
+        # Update the hall of fame with the generated individuals
+        if halloffame is not None:
+            halloffame.update(offspring)
+
+        # Replace the current population by the offspring
+        population[:] = offspring
+        if migrate is not None:
+            migrate(gen, population)
+
+        # Append the current generation statistics to the logbook
+        record = stats.compile(population) if stats else {}
+        record.update(_cacheRecord(cache))
+        record.update(_pruneRecord())
+        record.update(_surrogateRecord(surrogate))
+        record.update(fields)
+        logbook.record(gen=gen, nevals=len(invalid_ind), **record)
+        if verbose:
+            print(logbook.stream)
+        if logstream is not None:
+            logstream.write(logbook[-1])
+
+        if checkpoint is not None and (gen % config.GA_CHECKPOINT_INTERVAL == 0 or gen == ngen):
+            run_state.save(checkpoint, gen, population, halloffame, logbook,
+                           {'bestTime': bestTime, 'surrogate': surrogate.state() if surrogate is not None else None})
+
+    return population, logbook
+
+
+# Same algorithm as deap.algorithms.eaGenerateUpdate (ask-tell strategies such as CMA-ES), but every generated
+# population is handed to toolbox.evaluatePopulation at once
+def eaGenerateUpdateBatch(toolbox, ngen, stats=None, halloffame=None, verbose=__debug__, cache=None):
+    logbook = tools.Logbook()
+    logbook.header = _logHeader(stats, cache)
+
+    population = []
+    for gen in range(ngen):
+        # Generate a new population and evaluate it
+        population = toolbox.generate()
+        fitnesses = toolbox.evaluatePopulation(population)
+        for ind, fit in zip(population, fitnesses):
+            ind.fitness.values = fit
+
+        if halloffame is not None:
+            halloffame.update(population)
+
+        # Update the strategy with the evaluated individuals
+        toolbox.update(population)
+
+        record = stats.compile(population) if stats else {}
+        record.update(_cacheRecord(cache))
+        record.update(_pruneRecord())
+        logbook.record(gen=gen, nevals=len(population), **record)
+        if verbose:
+            print(logbook.stream)
+
+    return population, logbook
+
+
+# Logbook header of the algorithms with the constant fields of a run and the fields of the fitness cache, of early
+# stopped simulations and of the surrogate model
+def _logHeader(stats, cache, surrogate=None, fields=()):
+    return ['gen'] + list(fields) + ['nevals'] + (['nsims', 'hitrate'] if cache else []) + \
+        (['aborted', 'pruned', 'invalid', 'saved'] if config.SIM_ABORT_SOC or config.SIM_PRUNE_BOUND else []) + \
+        (['serr', 'skipped'] if surrogate else []) + (stats.fields if stats else [])
+
+
+# Logbook fields of a surrogate model: mean absolute prediction error (s) and fraction of candidates not simulated
+def _surrogateRecord(surrogate):
+    if surrogate is None:
+        return {}
+    counts = surrogate.collect()
+    return {'serr': counts['error'], 'skipped': counts['skipped']}
+
+
+# Logbook fields of the simulations stopped early since the last record; saved counts the steps not simulated
+def _pruneRecord():
+    if not (config.SIM_ABORT_SOC or config.SIM_PRUNE_BOUND):
+        return {}
+    counts = world.collectPruneStats()
+    return {'aborted': counts['aborted'], 'pruned': counts['pruned'], 'invalid': counts['invalid'],
+            'saved': counts['savedSteps']}
+
+
+# Logbook fields of a fitness cache for the evaluations since the last record
+def _cacheRecord(cache):
+    if cache is None:
+        return {}
+    counts = cache.collect()
+    return {'nsims': counts['simulations'], 'hitrate': counts['hitrate']}
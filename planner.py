@@ -0,0 +1,82 @@
+# Dynamic programming / beam search planner for the battery power profile
+# Alternative to the genetic algorithm that exploits the stage structure of the race: the route steps are the stages
+# and the state of the car at the end of a step is (SoC, speed, elapsed time, global time). At every step each kept
+# state is expanded with config.DP_ACTIONS battery power levels and all transitions of the stage are advanced at once
+# with the vectorized step physics of batch.simulate (the same physics as car.calcStepTime). The resulting states are
+# binned on a SoC x speed grid and only the earliest state of each cell is kept (at most config.DP_BEAM states in
+# total), with back pointers to recover the profile of the best final state.
+
+import time
+
+import numpy as np
+
+import batch
+import config
+import genome
+import world
+
+
+class PlannerError(ArithmeticError):
+    pass
+
+
+# Plan a battery power profile for the current world
+# Returns the genes (projected onto a genome of genes genes, by default config.GA_GENES; see genome.py), the planned
+# elapsed race time and the elapsed race time of the genes validated with world.simulate
+def plan(genes=None, verbose=__debug__):
+    rt = world.compiledRoute
+    solarCar = world.solarCar
+    actions = np.linspace(config.DP_POWER_MIN, config.DP_POWER_MAX, config.DP_ACTIONS)
+    start = time.time()
+
+    fields = ('speed', 'battSoC', 'eTime', 'offset', 'valid')
+    states = {'speed': np.array([float(world.startSpeed)]), 'battSoC': np.array([float(world.startSoC)]),
+              'eTime': np.zeros(1), 'offset': np.zeros(1), 'valid': np.ones(1, dtype=bool)}
+    parents = []    # Index of the previous state of every kept state, per step
+    choices = []    # Action of every kept state, per step
+
+    for index in range(rt.length):
+        # Expand every state with every action
+        count = len(states['eTime'])
+        candidates = dict((field, np.repeat(states[field], len(actions))) for field in fields)
+        action = np.tile(np.arange(len(actions)), count)
+        parent = np.repeat(np.arange(count), len(actions))
+        pbatt = config.PBATT_EXPECTED + actions[action]
+        batch._advance(solarCar, rt, index, pbatt, *[candidates[field] for field in fields])
+
+        # Only states the car can reach with charge left in the battery are feasible
+        keep = np.flatnonzero(candidates['valid'] & (candidates['battSoC'] >= config.DP_SOC_MIN))
+        if len(keep) == 0:
+            raise PlannerError('No battery power level lets the car traverse step %d with a SoC of at least %g%%'
+                               % (index, config.DP_SOC_MIN))
+
+        # Earliest state of each SoC x speed cell, then the earliest cells up to the beam width
+        socBin = np.clip(((candidates['battSoC'][keep] - config.DP_SOC_MIN) /
+                          (config.DP_SOC_MAX - config.DP_SOC_MIN) * config.DP_SOC_BINS).astype(int),
+                         0, config.DP_SOC_BINS - 1)
+        speedBin = np.clip((candidates['speed'][keep] / config.DP_SPEED_MAX * config.DP_SPEED_BINS).astype(int),
+                           0, config.DP_SPEED_BINS - 1)
+        cell = socBin * config.DP_SPEED_BINS + speedBin
+        order = np.lexsort((candidates['eTime'][keep], cell))
+        first = order[np.concatenate(([True], cell[order][1:] != cell[order][:-1]))]
+        kept = keep[first[np.argsort(candidates['eTime'][keep][first], kind='stable')[:config.DP_BEAM]]]
+
+        states = dict((field, candidates[field][kept]) for field in fields)
+        parents.append(parent[kept])
+        choices.append(action[kept])
+
+    # Trace the best final state back to the start (every kept state is feasible)
+    best = int(np.argmin(states['eTime']))
+    plannedTime = float(states['eTime'][best])
+    stepPower = np.empty(rt.length)
+    for index in range(rt.length - 1, -1, -1):
+        stepPower[index] = actions[choices[index][best]]
+        best = parents[index][best]
+
+    profile = genome.project(stepPower, config.GA_GENES if genes is None else genes)
+    simulatedTime = world.simulate(profile)
+    if verbose:
+        print('Planner: %d steps, %d actions, %d x %d cells, planned %.3f s, simulated %.3f s, %.2f s compute'
+              % (rt.length, len(actions), config.DP_SOC_BINS, config.DP_SPEED_BINS, plannedTime, simulatedTime,
+                 time.time() - start))
+    return profile, plannedTime, simulatedTime
@@ -0,0 +1,118 @@
+# Copy-free representation of the race route for the simulation hot path
+# The route is an immutable struct-of-arrays shared by every fitness evaluation, while the per-evaluation mutable
+# state lives in small preallocated arrays that are reused between evaluations.
+
+import os
+import xml.etree.ElementTree as ET
+
+import numpy as np
+
+import world_helpers
+
+
+class route:
+    # Columns of the route (one entry per step, read-only once compiled)
+    COLUMNS = ('lat', 'lon', 'dist', 'trip', 'inclination', 'heading', 'speedLimit', 'windSpd', 'windDir',
+               'stepType', 'timezone', 'ambTemp', 'cloud', 'rho')
+    DTYPES = {'stepType': np.int8}
+    DEFAULTS = {'rho': 1.11}    # Columns that may be missing from the XML route files (others default to 0)
+
+    # Build the route from a dictionary of column arrays (see fromSteps, fromXml and load)
+    def __init__(self, columns):
+        self.length = len(columns['lat'])
+        for column in self.COLUMNS:
+            values = columns[column]
+            if not isinstance(values, np.memmap):
+                values = np.array(values, dtype=self.DTYPES.get(column, np.float64))
+            setattr(self, column, values)
+
+        # Freeze the columns so that a shared route can never be modified by an evaluation
+        for column in self.COLUMNS:
+            getattr(self, column).flags.writeable = False
+
+
+# Build the route columns from a list of step objects
+def fromSteps(steps):
+    return route({'lat': [stp.location[0] for stp in steps],
+                  'lon': [stp.location[1] for stp in steps],
+                  'dist': [stp.stepDistance for stp in steps],
+                  'trip': [stp.trip for stp in steps],
+                  'inclination': [stp.inclination for stp in steps],
+                  'heading': [stp.heading for stp in steps],
+                  'speedLimit': [stp.speedLimit for stp in steps],
+                  'windSpd': [stp.wind[0] for stp in steps],
+                  'windDir': [stp.wind[1] for stp in steps],
+                  'stepType': [stp.stepType for stp in steps],
+                  'timezone': [stp.timezone for stp in steps],
+                  'ambTemp': [stp.ambTemp for stp in steps],
+                  'cloud': [stp.cloud for stp in steps],
+                  'rho': [stp.rho for stp in steps]})
+
+
+# -------------------- COMPILED ROUTE FILES --------------------------------------------------
+# A compiled route is a directory with one .npy file per column. Loading memory maps the files read-only, so a route
+# loads in milliseconds and worker processes share the same pages of the OS file cache instead of their own copies.
+
+# Write a route as a compiled route directory
+def save(rt, path):
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    for column in route.COLUMNS:
+        np.save(os.path.join(path, column + '.npy'), np.asarray(getattr(rt, column)))
+    return path
+
+
+# Load a compiled route directory (memory mapped, read-only)
+def load(path):
+    return route(dict((column, np.load(os.path.join(path, column + '.npy'), mmap_mode='r'))
+                      for column in route.COLUMNS))
+
+
+# Read a route from the XML route files (Data/WSC.route, Data/WSC.debug)
+def fromXml(fname):
+    steps = ET.parse(fname).getroot()
+    columns = {}
+    for column in route.COLUMNS:
+        default = str(route.DEFAULTS.get(column, 0))
+        if column == 'stepType':
+            columns[column] = [int(child.attrib.get(column, default)) for child in steps]
+        else:
+            columns[column] = [float(child.attrib.get(column, default)) for child in steps]
+    return route(columns)
+
+
+# Write a route as an XML route file readable by world.loadDebugData
+def toXml(rt, fname):
+    processedRoot = ET.Element('Route')
+    for index in range(rt.length):
+        b = ET.SubElement(processedRoot, 'step')
+        for column in route.COLUMNS:
+            b.set(column, str(getattr(rt, column)[index].item()))
+    ET.ElementTree(processedRoot).write(fname)
+    return processedRoot
+
+
+# Convert an XML route file into a compiled route directory
+def compileXml(fname, path):
+    return save(fromXml(fname), path)
+
+
+class state:
+    # Per-evaluation mutable state at the END of each step, preallocated once and overwritten by every evaluation
+    def __init__(self, length):
+        self.length = length
+        self.speed = np.zeros(length)       # Speed (ms-1)
+        self.battSoC = np.zeros(length)     # Battery state of charge (%)
+        self.eTime = np.zeros(length)       # Elapsed race time (s)
+        self.gTime = np.zeros(length)       # Global time (seconds since world_helpers.EPOCH)
+        self.stepTime = np.zeros(length)    # Time to traverse the step (s)
+        self.pin = np.zeros(length)         # Array input power (W)
+
+    # Store the state of the step cursor after it has advanced through step index
+    def record(self, index, stp):
+        self.speed[index] = stp.speed
+        self.battSoC[index] = stp.battSoC
+        self.eTime[index] = stp.eTime
+        self.gTime[index] = world_helpers.toSeconds(stp.gTime)
+        self.stepTime[index] = stp.stepTime
+        self.pin[index] = stp.pin
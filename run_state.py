@@ -0,0 +1,103 @@
+# Checkpoint and resume of long GA runs
+# The state of a run after a generation (population and fitnesses, hall of fame, logbook, the states of the Python
+# and NumPy random number generators and any extra state of the optimizer) is written to a checkpoint file through a
+# temporary file and an atomic rename, so a crash while saving never leaves a corrupt checkpoint behind. A run resumed
+# from a checkpoint continues after its generation exactly as the original run would have, since the generator states
+# are restored with it.
+# The logbook records can also be streamed to a file of JSON lines as they are logged (see logStream).
+
+import json
+import os
+import pickle
+import random
+
+import numpy as np
+
+from deap import creator
+from deap import tools
+
+VERSION = 2     # Version of the checkpoint format
+
+
+# Individuals as arrays of genes and fitness values (the fitness of an individual does not survive NumPy pickling)
+def _pack(individuals):
+    genes = np.array([np.asarray(ind) for ind in individuals])
+    fitness = np.array([ind.fitness.values for ind in individuals], dtype=np.float64)
+    return genes, fitness
+
+
+def _unpack(genes, fitness):
+    individuals = []
+    for values, fit in zip(genes, fitness):
+        ind = creator.Individual(values)
+        ind.fitness.values = tuple(fit)
+        individuals.append(ind)
+    return individuals
+
+
+# Write the state of a run after generation gen to path; extra is a dict of other picklable state of the run
+def save(path, gen, population, halloffame, logbook, extra=None):
+    state = {'version': VERSION,
+             'gen': gen,
+             'population': _pack(population),
+             'halloffame': _pack(halloffame) if halloffame is not None else None,
+             'logbook': (list(logbook), logbook.header),
+             'random': random.getstate(),
+             'numpy': np.random.get_state(),
+             'extra': extra if extra is not None else {}}
+    temp = '%s.%d.tmp' % (path, os.getpid())
+    with open(temp, 'wb') as f:
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp, path)
+
+
+# State of a run saved to path; None if there is no checkpoint
+def load(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        state = pickle.load(f)
+    if state.get('version') != VERSION:
+        raise ValueError('Checkpoint %s has format version %s, expected %d' % (path, state.get('version'), VERSION))
+    return state
+
+
+# Restore a saved state into the population and hall of fame and the random number generators
+# Returns the generation of the state, its logbook and its extra state
+def restore(state, population, halloffame):
+    genes, fitness = state['population']
+    if len(genes) != len(population) or genes.shape[1] != len(population[0]):
+        raise ValueError('Checkpoint population of %d x %d genes does not match the run (%d x %d)'
+                         % (genes.shape[0], genes.shape[1], len(population), len(population[0])))
+    population[:] = _unpack(genes, fitness)
+    if halloffame is not None and state['halloffame'] is not None:
+        halloffame.clear()
+        halloffame.update(_unpack(*state['halloffame']))
+
+    records, header = state['logbook']
+    logbook = tools.Logbook()
+    logbook.header = header
+    for record in records:
+        logbook.record(**record)
+
+    random.setstate(state['random'])
+    np.random.set_state(state['numpy'])
+    return state['gen'], logbook, state['extra']
+
+
+class logStream:
+    # Logbook records written to path as JSON lines; the file starts over with the records already logged (eg. those
+    # restored from a checkpoint) so that it never holds records of generations that are recomputed after a resume
+    def __init__(self, path, records=()):
+        self.file = open(path, 'w')
+        for record in records:
+            self.write(record)
+
+    def write(self, record):
+        self.file.write(json.dumps(record, default=float) + '\n')
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
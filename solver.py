@@ -0,0 +1,155 @@
+# Speed solvers for the car's step dynamics
+# Replaces the two scipy fsolve calls of car.calcStepTime with closed-form solutions that work on scalars and on NumPy
+# arrays of steps/individuals at once. Every solver returns (solution, converged) so that failures are reported
+# explicitly instead of silently returning the initial guess.
+
+import math
+
+import numpy as np
+
+import config
+import instrument
+
+NEWTON_MAX_ITER = 8     # Maximum number of safeguarded Newton polishing iterations
+NEWTON_TOL = 1e-12      # Relative step size at which the Newton polish stops
+RESIDUAL_TOL = 1e-9     # Relative residual below which a root is accepted as converged
+BRACKET = 1e-3          # Relative half width of the bracket kept around the closed-form root
+
+
+class SolverError(ArithmeticError):
+    pass
+
+
+# Largest real root of the depressed cubic a*y^3 + b*y = c (a > 0)
+# This is the power balance of the car: aero drag (a = 0.5*CDA*rho) and gravity (b = M*g*sin(inclination)) against the
+# shaft power left after rolling resistance (c). The largest root is the stable terminal speed.
+def cubicRoot(a, b, c):
+    if np.ndim(a) == 0 and np.ndim(b) == 0 and np.ndim(c) == 0:
+        return _cubicRootScalar(float(a), float(b), float(c))
+
+    a, b, c = np.broadcast_arrays(np.asarray(a, dtype=np.float64), np.asarray(b, dtype=np.float64),
+                                  np.asarray(c, dtype=np.float64))
+
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        # Monic form y^3 + p*y + q = 0
+        p = b / a
+        q = -c / a
+        disc = (q / 2.) ** 2 + (p / 3.) ** 3
+
+        # One real root (Cardano); written as u - p/(3u) to avoid cancellation
+        t = -q / 2.
+        u = np.cbrt(t + np.where(t < 0, -1., 1.) * np.sqrt(np.maximum(disc, 0.)))
+        oneRoot = np.where(u == 0., 0., u - p / (3. * np.where(u == 0., 1., u)))
+
+        # Three real roots (trigonometric method); take the largest
+        r = np.sqrt(np.maximum(-p / 3., 0.))
+        cosArg = np.clip(np.where(r > 0, t / np.where(r > 0, r ** 3, 1.), 0.), -1., 1.)
+        threeRoots = 2. * r * np.cos(np.arccos(cosArg) / 3.)
+
+        y = np.where(disc > 0, oneRoot, threeRoots)
+
+        # Safeguarded Newton polish: steps leaving the bracket around the closed-form root fall back to bisection
+        lo = y - BRACKET * np.maximum(np.abs(y), 1.)
+        hi = y + BRACKET * np.maximum(np.abs(y), 1.)
+        for iteration in range(NEWTON_MAX_ITER):
+            f = (a * y * y + b) * y - c
+            df = 3. * a * y * y + b
+            # Shrink the bracket around the root (f increases through the largest root)
+            lo = np.where(f < 0, np.maximum(lo, y), lo)
+            hi = np.where(f > 0, np.minimum(hi, y), hi)
+            yNew = y - f / np.where(df != 0, df, np.inf)
+            yNew = np.where((yNew >= lo) & (yNew <= hi), yNew, 0.5 * (lo + hi))
+            done = np.abs(yNew - y) <= NEWTON_TOL * np.maximum(np.abs(y), 1.)
+            y = np.where(np.isfinite(yNew), yNew, y)
+            if np.all(done):
+                break
+        if config.INSTRUMENT:
+            instrument.count('solver.cubicRoots', y.size)
+            instrument.count('solver.newtonIterations', (iteration + 1) * y.size)
+
+        residual = np.abs((a * y * y + b) * y - c)
+        scale = np.abs(a * y ** 3) + np.abs(b * y) + np.abs(c)
+        converged = np.isfinite(y) & (residual <= RESIDUAL_TOL * np.maximum(scale, 1.))
+
+    return y, converged
+
+
+# Scalar version of cubicRoot using the math module (NumPy call overhead dominates for a single step)
+def _cubicRootScalar(a, b, c):
+    p = b / a
+    q = -c / a
+    disc = (q / 2.) ** 2 + (p / 3.) ** 3
+    t = -q / 2.
+    if disc > 0:
+        w = t + math.copysign(math.sqrt(disc), t)
+        u = math.copysign(abs(w) ** (1. / 3.), w)
+        y = u - p / (3. * u) if u != 0. else 0.
+    else:
+        r = math.sqrt(max(-p / 3., 0.))
+        cosArg = min(max(t / r ** 3, -1.), 1.) if r > 0 else 0.
+        y = 2. * r * math.cos(math.acos(cosArg) / 3.)
+
+    lo = y - BRACKET * max(abs(y), 1.)
+    hi = y + BRACKET * max(abs(y), 1.)
+    for iteration in range(NEWTON_MAX_ITER):
+        f = (a * y * y + b) * y - c
+        df = 3. * a * y * y + b
+        if f < 0:
+            lo = max(lo, y)
+        elif f > 0:
+            hi = min(hi, y)
+        yNew = y - f / df if df != 0 else y
+        if not lo <= yNew <= hi:
+            yNew = 0.5 * (lo + hi)
+        done = abs(yNew - y) <= NEWTON_TOL * max(abs(y), 1.)
+        y = yNew
+        if done:
+            break
+    if config.INSTRUMENT:
+        instrument.count('solver.cubicRoots')
+        instrument.count('solver.newtonIterations', iteration + 1)
+
+    residual = abs((a * y * y + b) * y - c)
+    scale = abs(a * y ** 3) + abs(b * y) + abs(c)
+    return y, (not math.isnan(y)) and residual <= RESIDUAL_TOL * max(scale, 1.)
+
+
+# Exit speed z of a step of length dist solving the log-form distance equation
+#   dist = mass * omega^2 * ln((z - omega) / (vPrev - omega)) / k
+# where omega is the terminal speed and k = -1.5*CDA*rho*omega^2 - M*g*sin(inclination).
+# The equation is inverted analytically; the speed decays exponentially from vPrev towards omega.
+def exitSpeed(omega, vPrev, dist, k, mass):
+    if np.ndim(omega) == 0 and np.ndim(vPrev) == 0 and np.ndim(dist) == 0 and np.ndim(k) == 0:
+        omega, vPrev, dist, k = float(omega), float(vPrev), float(dist), float(k)
+        if omega <= 0:
+            return float('nan'), False
+        try:
+            z = omega + (vPrev - omega) * math.exp(dist * k / (mass * omega * omega))
+        except OverflowError:
+            return float('inf'), False
+        return z, z > 0
+
+    omega, vPrev, dist, k = np.broadcast_arrays(np.asarray(omega, dtype=np.float64),
+                                                np.asarray(vPrev, dtype=np.float64),
+                                                np.asarray(dist, dtype=np.float64),
+                                                np.asarray(k, dtype=np.float64))
+
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        z = omega + (vPrev - omega) * np.exp(dist * k / (mass * omega * omega))
+        # The solution only exists for a positive terminal speed with the car moving forward
+        converged = np.isfinite(z) & (omega > 0) & (z > 0)
+
+    return z, converged
+
+
+# Solve the speed of the car at the end of a step
+# Returns (omega, speed, converged) where omega is the terminal speed of the power balance
+def stepSpeed(pnet, vPrev, dist, rho, inclination, mass, cda, g):
+    if np.ndim(rho) == 0 and np.ndim(inclination) == 0:
+        b = mass * g * math.sin(math.radians(inclination))
+    else:
+        b = mass * g * np.sin(np.deg2rad(inclination))
+    omega, omegaOk = cubicRoot(0.5 * cda * rho, b, pnet)
+    k = 3 * (-0.5) * cda * rho * omega * omega - b
+    speed, speedOk = exitSpeed(omega, vPrev, dist, k, mass)
+    return omega, speed, omegaOk & speedOk
@@ -3,11 +3,14 @@
 # Author: Frank Gu
 # Date: July 2nd, 2017
 
+import time
 from datetime import datetime
 from datetime import timedelta
 
 import config
+import instrument
 import sun
+import sun_cache
 
 
 class step:
@@ -58,6 +61,26 @@ class step:
         self.stepType = _stepType
         self.timezone = _timezone
 
+    # Load the environment states of step index from a compiled route (see route.py)
+    # Used to reuse a single step object as a cursor along the route instead of copying the whole world
+    # Car and optimizer states are left untouched so that they carry over from the previous step
+    def loadRoute(self, rt, index):
+        self.stepNum = index + 1
+        self.ambTemp = float(rt.ambTemp[index])
+        self.location[0] = float(rt.lat[index])
+        self.location[1] = float(rt.lon[index])
+        self.stepDistance = float(rt.dist[index])
+        self.trip = float(rt.trip[index])
+        self.speedLimit = float(rt.speedLimit[index])
+        self.inclination = float(rt.inclination[index])
+        self.heading = float(rt.heading[index])
+        self.cloud = float(rt.cloud[index])
+        self.wind[0] = float(rt.windSpd[index])
+        self.wind[1] = float(rt.windDir[index])
+        self.stepType = int(rt.stepType[index])
+        self.timezone = float(rt.timezone[index])
+        self.rho = float(rt.rho[index])
+
     # Advance one distance step forward
     # Uses function from "car" class to transition the previous step state into new state
     # Assumes previous step result is already copied into current step data containers
@@ -66,6 +89,8 @@ class step:
         # TODO: Implement control stop logic
         # TODO: Implement end-of-day / beginning-of-day logic
 
+        start = time.perf_counter() if config.INSTRUMENT else 0.
+
         # Evaluate car's step performance
         car.calcStepTime(self)
 
@@ -77,37 +102,35 @@ class step:
 
         # Check step type - Control stop
         if self.stepType == 1:
+            if config.INSTRUMENT:
+                instrument.count('events.controlStop')
+
             # Time segment A
-            for minute in range(0, config.CS_ENTER_TIME):
-                car.battIn(self, car.arrayOut(car.arrayIn(self)), 1)
-                self.gTime += timedelta(minutes=1)  # Increment world clock
+            self.chargeWindow(car, config.CS_ENTER_TIME)
 
             # Time segment B
             # 1. Get sun's location 15 minutes into the control stop
-            sunInfo = sun.info(self.gTime + timedelta(minutes=config.CS_WAIT_TIME / 2), self.timezone, self.location)
+            sunInfo = sun_cache.position(self.gTime + timedelta(minutes=config.CS_WAIT_TIME / 2), self.timezone,
+                                         self.location)
             realHeading = self.heading
             realInclination = self.inclination
             # 2. Position car's array towards the sun's expected position
             self.heading = sunInfo[1]
             self.inclination = sunInfo[0]
             # 3. Begin charging
-            for minute in range(0, config.CS_WAIT_TIME):
-                car.battIn(self, car.arrayOut(car.arrayIn(self)), 1)
-                self.gTime += timedelta(minutes=1)  # Increment world clock
+            self.chargeWindow(car, config.CS_WAIT_TIME)
             # 4. Restore array position to head out of control stop
             self.heading = realHeading
             self.inclination = realInclination
 
             # Time segment C
-            for minute in range(0, config.CS_EXIT_TIME):
-                car.battIn(self, car.arrayOut(car.arrayIn(self)), 1)
-                self.gTime += timedelta(minutes=1)  # Increment world clock
+            self.chargeWindow(car, config.CS_EXIT_TIME)
 
         # End of day reached (hour = 17)
         if self.gTime.hour >= 17:
             # NOTE: cutting short at 9 minutes to ensure that we don't stop after 17:10!!!
             if self.gTime.minute < 9:
-                # Optimize end of day decision point
+                # Optimize end of day decision point (on the exact sun position; the two insolations are close)
                 sunInfo = sun.info(self.gTime, self.timezone, self.location)
                 eveningInsolation = sun.irradiance(sunInfo)
 
@@ -122,45 +145,74 @@ class step:
             else:
                 self.stepType = 2       # End of day decision made
                 self.processEOD(car)
+
+        if config.INSTRUMENT:
+            instrument.timed('step.advanceStep', start)
         return
 
     # TODO: Process end of day / beginning of day charging results
     def processEOD(self, car):
+        start = time.perf_counter() if config.INSTRUMENT else 0.
         stopOffsetMins = self.gTime.minute  # Number of minutes past stop time
-        sunrise, sunset = sun.getSunRiseSetTime(self.gTime, self.timezone, self.location)
+        sunrise, sunset = sun_cache.getSunRiseSetTime(self.gTime, self.timezone, self.location)
 
         # 1. Calculate energy obtained before sunset (Evening charge)
         minutes = int((sunset - self.gTime).seconds / 60) - config.SE_END_SETUP_TIME
         # Set up time before charging
-        for minute in range(0, config.SE_END_SETUP_TIME):
-            self.gTime += timedelta(minutes=1)  # Increment global time
-            car.battIn(self, car.arrayOut(car.arrayIn(self)), 1)
+        self.chargeWindow(car, config.SE_END_SETUP_TIME, incrementFirst=True)
 
         # End of day charging
-        for minute in range(0,minutes):
-            self.gTime += timedelta(minutes=1)  # Increment global time
-            car.battIn(self, car.arrayOut(car.arrayIn(self, 2)), 1)
+        self.chargeWindow(car, minutes, 2, incrementFirst=True)
 
         # 2. Calculate energy obtained before beginning of drive
         startTime = datetime(self.gTime.year, self.gTime.month, self.gTime.day + 1, 8, stopOffsetMins)
         self.gTime = sunrise
         minutes = int((startTime - self.gTime).seconds / 60) - config.SE_START_SETUP_TIME
         # Beginning of day charging
-        for minute in range(0, minutes):
-            self.gTime += timedelta(minutes=1)  # Increment global time
-            car.battIn(self, car.arrayOut(car.arrayIn(self, 2)), 1)
+        self.chargeWindow(car, minutes, 2, incrementFirst=True)
+
+        self.chargeWindow(car, config.SE_START_SETUP_TIME, incrementFirst=True)
+        if config.INSTRUMENT:
+            instrument.count('events.endOfDay')
+            instrument.timed('step.processEOD', start)
+
+    # Charge the battery with the array for a number of minutes at the current heading and inclination
+    # incrementFirst advances the global time before (end of day) instead of after (control stop) each minute's sample
+    # With config.CHARGE_INTEGRATED the energy of the whole window is computed in one call (see car.chargeEnergy)
+    def chargeWindow(self, car, minutes, mode=0, incrementFirst=False):
+        if config.INSTRUMENT:
+            instrument.count('charge.minutes', max(minutes, 0))
+        if config.CHARGE_INTEGRATED:
+            start = self.gTime + timedelta(minutes=1) if incrementFirst else self.gTime
+            car.battInEnergy(self, car.chargeEnergy(start, minutes, self.timezone, self.location, self.heading,
+                                                    self.inclination, mode))
+            self.gTime += timedelta(minutes=max(minutes, 0))
+            return
 
-        for minute in range(0, config.SE_START_SETUP_TIME):
-            self.gTime += timedelta(minutes=1)  # Increment global time
-            car.battIn(self, car.arrayOut(car.arrayIn(self)), 1)
+        for minute in range(0, minutes):
+            if incrementFirst:
+                self.gTime += timedelta(minutes=1)  # Increment global time
+            car.battIn(self, car.arrayOut(car.arrayIn(self, mode)), 1)
+            if not incrementFirst:
+                self.gTime += timedelta(minutes=1)  # Increment world clock
 
     # Checks step advancement results against presets
+    # Input - remaining: lower bound of the elapsed time still needed to finish the route after this step (s)
+    #       - bound    : elapsed time (s) the race must beat to be of interest, eg. the best one so far
+    #                    (None - no bound)
     # Returns True iff constraints are met
-    # Will set eTime = INF if constraints are not met
-    def checkConstraints(self):
-
-        self.eTime = float('inf') # Max out the elapsed time counter to invalidate result
-        return False
+    # Will set eTime to a penalized elapsed time if constraints are not met:
+    #   - SoC below config.SIM_SOC_MIN (with config.SIM_ABORT_SOC): config.SIM_INFEASIBLE_TIME plus the remaining time,
+    #     so that profiles failing further along the route rank better
+    #   - elapsed time plus the remaining time beyond the bound: that lower bound of the final elapsed time
+    def checkConstraints(self, remaining, bound=None):
+        if config.SIM_ABORT_SOC and self.battSoC < config.SIM_SOC_MIN:
+            self.eTime = config.SIM_INFEASIBLE_TIME + remaining
+            return False
+        if bound is not None and self.eTime + remaining > bound:
+            self.eTime = self.eTime + remaining
+            return False
+        return True
 
 
     # Print the information for this step of optimization for debug and diagnostic purposes
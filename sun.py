@@ -7,6 +7,8 @@ import math
 from datetime import datetime
 from datetime import timedelta
 
+import numpy as np
+
 
 # location [lat long]
 # Latitude + to N
@@ -167,3 +169,97 @@ def irradiance(sunInfo):
     # solar radiation on a horizontal plane on earth's surface with atmospheric attenuation
     ioh = io * tau * math.cos(math.radians(90 - sunInfo[0]))
     return ioh
+
+
+# -------------------- ARRAY VERSIONS -------------------------------------------------
+# The functions below are the NumPy counterparts of info, irradiance, air_mass and transmittance. They accept arrays of
+# global times (anything convertible to datetime64, eg. a list of datetime objects) and of locations, and broadcast
+# them against each other so that whole-route or whole-day solar tables come out of one call.
+
+# Calendar fields (year, month, day, hour, minute, second) of global times, truncated to whole seconds like info
+def timeFields(gTime):
+    gTime = np.asarray(gTime, dtype='datetime64[s]')
+    year = gTime.astype('datetime64[Y]').astype(np.int64) + 1970
+    month = gTime.astype('datetime64[M]').astype(np.int64) % 12 + 1
+    day = (gTime.astype('datetime64[D]') - gTime.astype('datetime64[M]')).astype(np.int64) + 1
+    seconds = (gTime - gTime.astype('datetime64[D]')).astype(np.int64)
+    return year, month, day, seconds // 3600, (seconds % 3600) // 60, seconds % 60
+
+
+# location [lat long] where lat and long may be arrays
+# Returns a list of Elevation, Azimuth, Equation of time, Declination and Julian date arrays
+def infoArray(gTime, timezone, location):
+    year, month, dayOfMonth, hour, minute, second = timeFields(gTime)
+    timezone = np.asarray(timezone, dtype=np.float64)
+    lat = np.asarray(location[0], dtype=np.float64)
+    lon = np.asarray(location[1], dtype=np.float64)
+
+    # Julian date (see info)
+    A = np.trunc(year / 100.)
+    B = 2 - A + np.trunc(A / 4.)
+    C = np.trunc(365.25 * year)
+    D = np.trunc(30.6001 * (month + 1))
+    day = dayOfMonth + (hour + (minute + second / 60.) / 60. - timezone) / 24.0
+    jd = B + C + D + day + 1720994.5
+    jc = (jd - 2451545) / 36525
+
+    gmls = (280.46646 + jc * (36000.76983 + jc * 0.0003032)) % 360.
+    gmas = 357.52911 + jc * (35999.05029 - 0.0001537 * jc)
+    eec = 0.016708634 - jc * (0.000042037 + 0.0000001267 * jc)
+    sec = np.sin(np.radians(gmas)) * (1.914602 - jc * (0.004817 + 0.000014 * jc)) + \
+          np.sin(np.radians(2 * gmas)) * (0.019993 - 0.000101 * jc) + np.sin(np.radians(3 * gmas)) * 0.000289
+    stl = gmls + sec
+    sal = stl - 0.00569 - 0.00478 * np.sin(np.radians(125.04 - 1934.136 * jc))
+    moe = 23 + (26 + (21.448 - jc * (46.815 + jc * (0.00059 - jc * 0.001813))) / 60) / 60
+    oc = moe + 0.00256 * np.cos(np.radians(125.04 - 1934.136 * jc))
+    sd = np.degrees(np.arcsin(np.sin(np.radians(oc)) * np.sin(np.radians(sal))))
+    vy = np.tan(np.radians(oc / 2)) * np.tan(np.radians(oc / 2))
+    eot = 4 * np.degrees(vy * np.sin(2 * np.radians(gmls)) - 2 * eec * np.sin(np.radians(gmas)) +
+                         4 * eec * vy * np.sin(np.radians(gmas)) * np.cos(2 * np.radians(gmls)) -
+                         0.5 * vy * vy * np.sin(4 * np.radians(gmls)) - 1.25 * eec * eec * np.sin(
+        2 * np.radians(gmas)))
+
+    today = (hour + (minute + second / 60.) / 60.) / 24.0
+    tst = (today * 1440 + eot + 4 * lon - 60 * timezone) % 1440
+    ha = np.where(tst < 0, tst / 4. + 180., tst / 4. - 180.)
+
+    sza = np.degrees(np.arccos(np.sin(np.radians(lat)) * np.sin(np.radians(sd)) +
+                               np.cos(np.radians(lat)) * np.cos(np.radians(sd)) * np.cos(np.radians(ha))))
+    sea = 90 - sza
+
+    # Atmospheric Refraction Correction (piecewise, see info)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        tanSea = np.tan(np.radians(sea))
+        ar = np.select([sea > 85, sea > 5, sea > -0.575],
+                       [0.,
+                        (58.1 / tanSea - 0.07 / np.power(tanSea, 3) + 0.000086 / np.power(tanSea, 5)) / 3600,
+                        (1735 - 518.2 * sea + 103.4 * np.power(sea, 2) - 12.79 * np.power(sea, 3) +
+                         0.711 * np.power(sea, 4)) / 3600.],
+                       -20.774 / (3600 * tanSea))
+    elevation = sea + ar
+
+    acosAz = np.degrees(np.arccos(((np.sin(np.radians(lat)) * np.cos(np.radians(sza))) - np.sin(np.radians(sd))) /
+                                  (np.cos(np.radians(lat)) * np.sin(np.radians(sza)))))
+    azimuth = np.where(ha > 0, (acosAz + 180) % 360, (540 - acosAz) % 360)
+
+    return [elevation, azimuth, eot, sd, jd]
+
+
+def air_mass_array(h):
+    # Input is an array of elevation angles h in degrees
+    temp = 1229 + np.power(614 * np.sin(np.radians(h)), 2)
+    return np.sqrt(temp) - 614 * np.sin(np.radians(h))
+
+
+def transmittance_array(m):
+    # Input is an array of air masses m; the huge air masses below the horizon give no transmittance
+    with np.errstate(over='ignore'):
+        return 0.56 * (1 / np.power(math.e, 0.65 * m) + 1 / np.power(math.e, 0.095 * m))
+
+
+def irradianceArray(sunInfo):
+    # Array version of irradiance; sunInfo is the list returned by infoArray
+    m = air_mass_array(sunInfo[0])
+    tau = transmittance_array(m)
+    io = 1367 * (1 + 0.034 * (np.cos(np.radians(360 * sunInfo[4])) / 365))
+    return io * tau * np.cos(np.radians(90 - sunInfo[0]))
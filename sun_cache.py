@@ -0,0 +1,226 @@
+# Solar ephemeris cache
+# Within one optimization run the same dates, times and near-identical locations along the route are fed to sun.info and
+# sun.getSunRiseSetTime millions of times. This module turns the solar geometry into a lookup:
+#   - ephemeris: a table of the sun's direction and irradiance over (time, location bucket) for the race window, built
+#     once and linearly interpolated in time, with its interpolation error checked against an explicit tolerance
+#   - a bounded, memoized sunrise/sunset table per day and location, every entry checked against the exact times of
+#     its day with an explicit tolerance
+# Both count hits and misses with config.INSTRUMENT (see instrument.py, which merges the counts of worker processes).
+# position, positionArray and getSunRiseSetTime fall back to the exact sun module calculations when the cache is
+# disabled (config.SUN_CACHE) or when a request lies outside of the table.
+
+import collections
+import math
+from datetime import datetime
+
+import numpy as np
+
+import config
+import instrument
+import sun
+
+table = None    # Ephemeris table of the current race (see build)
+riseSetTable = collections.OrderedDict()    # Memoized sunrise/sunset times, least recently used first
+riseSetMaxError = 0.    # Largest difference of a memoized time from the exact ones of its bucket and day (s)
+
+
+# Location bucket of a GPS location
+def bucketKey(timezone, location):
+    return (timezone, int(round(location[0] / config.SUN_CACHE_BUCKET)),
+            int(round(location[1] / config.SUN_CACHE_BUCKET)))
+
+
+# Unit vector (east, north, up) of the sun from its elevation and azimuth (deg)
+def _sunVector(elevation, azimuth):
+    elevation = np.radians(elevation)
+    azimuth = np.radians(azimuth)
+    return np.cos(elevation) * np.sin(azimuth), np.cos(elevation) * np.cos(azimuth), np.sin(elevation)
+
+
+class ephemeris:
+    # Interpolation table of the sun's direction and irradiance
+    # Input - locations : list of [lat, long] the table must cover (eg. route step locations)
+    #       - timezones : timezone of each location
+    #       - startTime : global time of the start of the race; the table starts at midnight of that day
+    #       - days      : number of days covered
+    #       - resolution: initial time resolution (s); halved until the tolerances are met
+    def __init__(self, locations, timezones, startTime, days, resolution):
+        # Location buckets of the table; the sun is evaluated at the bucket center
+        self.columns = {}
+        for location, timezone in zip(locations, timezones):
+            self.columns.setdefault(bucketKey(float(timezone), location), len(self.columns))
+        self.timezone = np.array([key[0] for key in sorted(self.columns, key=self.columns.get)])
+        self.lat = np.array([key[1] for key in sorted(self.columns, key=self.columns.get)]) * config.SUN_CACHE_BUCKET
+        self.lon = np.array([key[2] for key in sorted(self.columns, key=self.columns.get)]) * config.SUN_CACHE_BUCKET
+
+        self.startTime = datetime(startTime.year, startTime.month, startTime.day)
+        self.start64 = np.datetime64(self.startTime, 'us')
+        self.duration = days * 86400.
+
+        while True:
+            if len(self.columns) * (self.duration / resolution + 1) > config.SUN_CACHE_MAX_ENTRIES:
+                raise ValueError('Solar ephemeris table cannot meet its tolerance within %d entries (resolution %gs)'
+                                 % (config.SUN_CACHE_MAX_ENTRIES, resolution))
+            self._fill(resolution)
+            self.maxAngleError, self.maxIrradianceError = self._validate(locations, timezones)
+            if self.maxAngleError <= config.SUN_CACHE_TOL_ANGLE and \
+                    self.maxIrradianceError <= config.SUN_CACHE_TOL_IRRADIANCE:
+                break
+            resolution = resolution / 2.
+
+    # Evaluate the exact sun at every grid time and bucket
+    def _fill(self, resolution):
+        self.resolution = float(resolution)
+        self.count = int(math.ceil(self.duration / self.resolution)) + 1
+        times = self.start64 + (np.arange(self.count) * self.resolution * 1e6).astype('timedelta64[us]')
+        sunInfo = sun.infoArray(times[np.newaxis, :], self.timezone[:, np.newaxis],
+                                [self.lat[:, np.newaxis], self.lon[:, np.newaxis]])
+        self.east, self.north, self.up = _sunVector(sunInfo[0], sunInfo[1])
+        self.irradiance = sun.irradianceArray(sunInfo)
+
+    # Worst interpolation error against the exact sun at the real locations, half way between grid times
+    def _validate(self, locations, timezones):
+        rng = np.random.RandomState(0)
+        samples = min(4096, 16 * len(locations))
+        which = rng.randint(0, len(locations), samples)
+        lat = np.array([locations[i][0] for i in which], dtype=np.float64)
+        lon = np.array([locations[i][1] for i in which], dtype=np.float64)
+        timezone = np.array([timezones[i] for i in which], dtype=np.float64)
+        offset = (rng.randint(0, self.count - 1, samples) + 0.5) * self.resolution
+        times = self.start64 + np.round(offset * 1e6).astype('timedelta64[us]')
+
+        exact = sun.infoArray(times, timezone, [lat, lon])
+        exactVector = _sunVector(exact[0], exact[1])
+        columns = np.array([self.columns[bucketKey(timezone[i], (lat[i], lon[i]))] for i in range(samples)])
+        elevation, azimuth, irradiance = self._interpolate(offset, columns)
+        vector = _sunVector(elevation, azimuth)
+        cosAngle = sum(a * b for a, b in zip(vector, exactVector))
+        angle = np.degrees(np.arccos(np.clip(cosAngle, -1., 1.)))
+        return float(np.max(angle)), float(np.max(np.abs(irradiance - sun.irradianceArray(exact))))
+
+    # Linear interpolation of the table at offsets (s) from the table start time in the given columns
+    def _interpolate(self, offset, column):
+        position = offset / self.resolution
+        index = np.minimum(position.astype(np.int64), self.count - 2)
+        fraction = position - index
+        east = self.east[column, index] * (1 - fraction) + self.east[column, index + 1] * fraction
+        north = self.north[column, index] * (1 - fraction) + self.north[column, index + 1] * fraction
+        up = self.up[column, index] * (1 - fraction) + self.up[column, index + 1] * fraction
+        irradiance = self.irradiance[column, index] * (1 - fraction) + self.irradiance[column, index + 1] * fraction
+        elevation = np.degrees(np.arctan2(up, np.hypot(east, north)))
+        azimuth = np.degrees(np.arctan2(east, north)) % 360
+        return elevation, azimuth, irradiance
+
+    # Scalar lookup; returns None on a miss
+    def lookup(self, gTime, timezone, location):
+        column = self.columns.get(bucketKey(timezone, location))
+        offset = (gTime - self.startTime).total_seconds()
+        if column is None or not 0 <= offset <= self.duration:
+            if config.INSTRUMENT:
+                instrument.count('sun_cache.tableMisses')
+            return None
+        if config.INSTRUMENT:
+            instrument.count('sun_cache.tableHits')
+
+        position = offset / self.resolution
+        index = min(int(position), self.count - 2)
+        fraction = position - index
+        east = self.east[column, index] * (1 - fraction) + self.east[column, index + 1] * fraction
+        north = self.north[column, index] * (1 - fraction) + self.north[column, index + 1] * fraction
+        up = self.up[column, index] * (1 - fraction) + self.up[column, index + 1] * fraction
+        irradiance = self.irradiance[column, index] * (1 - fraction) + self.irradiance[column, index + 1] * fraction
+        elevation = math.degrees(math.atan2(up, math.hypot(east, north)))
+        azimuth = math.degrees(math.atan2(east, north)) % 360
+        return elevation, azimuth, irradiance
+
+    # Array lookup of datetime64 global times at one location; returns None on a miss
+    def lookupArray(self, gTime, timezone, location):
+        column = self.columns.get(bucketKey(timezone, location))
+        offset = (np.asarray(gTime, dtype='datetime64[us]') - self.start64).astype(np.float64) / 1e6
+        if column is None or np.any(offset < 0) or np.any(offset > self.duration):
+            if config.INSTRUMENT:
+                instrument.count('sun_cache.tableMisses', np.size(offset))
+            return None
+        if config.INSTRUMENT:
+            instrument.count('sun_cache.tableHits', np.size(offset))
+        return self._interpolate(offset, column)
+
+
+# Build the ephemeris table of the race for a compiled route
+def build(rt, startTime):
+    global table
+    locations = list(zip(rt.lat, rt.lon))
+    table = ephemeris(locations, rt.timezone, startTime, config.SUN_CACHE_DAYS, config.SUN_CACHE_RESOLUTION)
+    return table
+
+
+# Sun elevation (deg), azimuth (deg) and irradiance (W m-2) at a global time and location
+def position(gTime, timezone, location):
+    if config.SUN_CACHE and table is not None:
+        result = table.lookup(gTime, timezone, location)
+        if result is not None:
+            return result
+    sunInfo = sun.info(gTime, timezone, location)
+    return sunInfo[0], sunInfo[1], sun.irradiance(sunInfo)
+
+
+# Array version of position for datetime64 global times at one location
+def positionArray(gTime, timezone, location):
+    if config.SUN_CACHE and table is not None:
+        result = table.lookupArray(gTime, timezone, location)
+        if result is not None:
+            return result
+    sunInfo = sun.infoArray(gTime, timezone, location)
+    return sunInfo[0], sunInfo[1], sun.irradianceArray(sunInfo)
+
+
+# Memoized sun.getSunRiseSetTime per day and location
+# The times are computed for 17:00 of the day and checked against the exact times at the start and the end of the day.
+# sun.getSunRiseSetTime truncates its result (to the hour and short steps after it), so a day whose exact times move
+# by more than config.SUN_CACHE_TOL_RISESET is not memoized and always gets the exact calculation.
+def getSunRiseSetTime(gTime, timezone, location):
+    global riseSetMaxError
+    if not config.SUN_CACHE:
+        return sun.getSunRiseSetTime(gTime, timezone, location)
+
+    key = (gTime.date(), timezone, float(location[0]), float(location[1]))
+    if key in riseSetTable:
+        if config.INSTRUMENT:
+            instrument.count('sun_cache.riseSetHits')
+        riseSetTable.move_to_end(key)
+        result = riseSetTable[key]
+    else:
+        if config.INSTRUMENT:
+            instrument.count('sun_cache.riseSetMisses')
+        result = sun.getSunRiseSetTime(datetime(gTime.year, gTime.month, gTime.day, 17), timezone, location)
+        error = _riseSetError(result, gTime, timezone, location)
+        if error <= config.SUN_CACHE_TOL_RISESET:
+            riseSetMaxError = max(riseSetMaxError, error)
+        else:
+            result = None   # Not memoized
+        riseSetTable[key] = result
+        if len(riseSetTable) > config.SUN_CACHE_RISESET_SIZE:
+            riseSetTable.popitem(last=False)
+    return result if result is not None else sun.getSunRiseSetTime(gTime, timezone, location)
+
+
+# Largest difference (s) of sunrise/sunset times from the exact ones at the start and the end of the day of gTime
+def _riseSetError(result, gTime, timezone, location):
+    error = 0.
+    for hour, minute in ((0, 0), (23, 59)):
+        exact = sun.getSunRiseSetTime(datetime(gTime.year, gTime.month, gTime.day, hour, minute), timezone, location)
+        error = max([error] + [abs((a - b).total_seconds()) for a, b in zip(result, exact)])
+    return error
+
+
+# Hit rates of the cache from the instrumentation counters (merged from the worker processes) and its errors
+def stats():
+    counts = instrument.counts
+    tableLookups = counts['sun_cache.tableHits'] + counts['sun_cache.tableMisses']
+    riseSetLookups = counts['sun_cache.riseSetHits'] + counts['sun_cache.riseSetMisses']
+    return {'tableHitRate': counts['sun_cache.tableHits'] / float(tableLookups) if tableLookups else 0.,
+            'riseSetHitRate': counts['sun_cache.riseSetHits'] / float(riseSetLookups) if riseSetLookups else 0.,
+            'riseSetSize': len(riseSetTable),
+            'maxAngleError': table.maxAngleError if table is not None else 0.,
+            'maxIrradianceError': table.maxIrradianceError if table is not None else 0.,
+            'riseSetMaxError': riseSetMaxError}
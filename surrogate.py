@@ -0,0 +1,116 @@
+# Surrogate model pre-screening of GA offspring
+# A ridge regression of the elapsed race time on segment-aggregated genes (the mean battery power offset of each of
+# config.SURROGATE_SEGMENTS consecutive gene ranges) stands in for the simulator when breeding: a candidate pool several
+# times larger than the population is bred, ranked on the predicted elapsed times, and only the most promising
+# candidates are simulated. The model is retrained on every simulated (genome, elapsed time) pair of the run by
+# accumulating the normal equations, so retraining costs the same however many pairs have been seen. Its prediction
+# error on the simulated candidates and the fraction of candidates not simulated are reported per generation. The
+# training state is saved with the checkpoints of a run, so a resumed run screens with the same model.
+
+import numpy as np
+
+import config
+
+
+class ridgeModel:
+    def __init__(self, segments, alpha):
+        self.segments = segments
+        self.alpha = alpha
+        self.gram = np.zeros((segments + 1, segments + 1))     # Normal equations of the pairs seen so far
+        self.moment = np.zeros(segments + 1)
+        self.samples = 0
+        self.weights = None
+        self.predictions = {}   # Predicted elapsed time of the screened candidates being simulated, by id
+
+        # Screening results since the last collect
+        self.candidates = 0
+        self.skipped = 0
+        self.errors = []
+
+    # Segment means of the genes (scaled to about +-1) and a constant term
+    def features(self, genes):
+        genes = np.asarray(genes, dtype=np.float64)
+        groups = np.array_split(np.arange(genes.shape[1]), min(self.segments, genes.shape[1]))
+        means = np.zeros((len(genes), self.segments))
+        for column, group in enumerate(groups):
+            means[:, column] = genes[:, group].mean(axis=1) / 100.
+        return np.hstack((means, np.ones((len(genes), 1))))
+
+    # Whether enough pairs have been seen to screen with the model
+    def ready(self):
+        return self.weights is not None and self.samples >= config.SURROGATE_MIN_SAMPLES
+
+    def predict(self, genes):
+        return np.matmul(self.features(genes), self.weights)
+
+    # Add the simulated individuals to the training pairs and refit
+    # Unfinished elapsed times and those stopped early (pruned or aborted, the stopped mask of
+    # optimizer.evalPopulation) are left out of both the fit and the prediction error
+    def update(self, individuals, stopped):
+        if len(individuals) == 0:
+            return
+        eTimes = np.array([ind.fitness.values[0] for ind in individuals])
+        keep = np.isfinite(eTimes) & ~np.asarray(stopped, dtype=bool)
+        for ind, eTime, simulated in zip(individuals, eTimes, keep):
+            predicted = self.predictions.pop(id(ind), None)
+            if predicted is not None and simulated:
+                self.errors.append(abs(predicted - eTime))
+
+        if not np.any(keep):
+            return
+        x = self.features([individuals[i] for i in np.flatnonzero(keep)])
+        self.gram += np.matmul(x.T, x)
+        self.moment += np.matmul(x.T, eTimes[keep])
+        self.samples += int(np.count_nonzero(keep))
+
+        penalty = self.alpha * np.eye(self.segments + 1)
+        penalty[-1, -1] = 0.    # The constant term is not penalized
+        self.weights = np.linalg.lstsq(self.gram + penalty, self.moment, rcond=None)[0]
+
+    # Training state of the model (see run_state.save) and its restore
+    def state(self):
+        return {'gram': self.gram.copy(), 'moment': self.moment.copy(), 'samples': self.samples,
+                'weights': None if self.weights is None else self.weights.copy()}
+
+    def restore(self, state):
+        if state['gram'].shape != self.gram.shape:
+            raise ValueError('Surrogate state of %d segments does not match the model (%d)'
+                             % (state['gram'].shape[0] - 1, self.segments))
+        self.gram = state['gram'].copy()
+        self.moment = state['moment'].copy()
+        self.samples = state['samples']
+        self.weights = None if state['weights'] is None else state['weights'].copy()
+
+    # The count most promising candidates: evaluated candidates rank on their fitness, the others on the prediction
+    # Copies of a genome already chosen only fill the places left once every distinct genome is taken, so that the
+    # unchanged copies of the best parents do not take over the population
+    def screen(self, candidates, count):
+        invalid = [ind for ind in candidates if not ind.fitness.valid]
+        if not self.ready() or len(invalid) == 0:
+            return candidates[:count]
+
+        predicted = dict(zip(map(id, invalid), self.predict(invalid)))
+        score = [ind.fitness.values[0] if ind.fitness.valid else predicted[id(ind)] for ind in candidates]
+        distinct = []
+        copies = []
+        seen = set()
+        for i in np.argsort(score, kind='stable'):
+            key = np.asarray(candidates[i], dtype=np.float64).tobytes()
+            (copies if key in seen else distinct).append(candidates[i])
+            seen.add(key)
+        chosen = (distinct + copies)[:count]
+
+        simulated = [ind for ind in chosen if not ind.fitness.valid]
+        self.predictions = dict((id(ind), predicted[id(ind)]) for ind in simulated)
+        self.candidates += len(invalid)
+        self.skipped += len(invalid) - len(simulated)
+        return chosen
+
+    # Mean absolute prediction error (s) and fraction of candidates not simulated since the last collect
+    def collect(self):
+        result = {'error': float(np.mean(self.errors)) if self.errors else float('nan'),
+                  'skipped': self.skipped / float(self.candidates) if self.candidates else 0.}
+        self.candidates = 0
+        self.skipped = 0
+        self.errors = []
+        return result
@@ -0,0 +1,40 @@
+# Shared fixtures of the tests; the modules under test live at the top of the repository
+# Run with: python -m pytest -q
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA = os.path.join(ROOT, 'Data')
+sys.path.insert(0, ROOT)
+
+import config   # noqa: E402
+import world    # noqa: E402
+
+
+# Load the debug route (Data/WSC.debug, 100 steps) and the array mesh with the race starting conditions
+@pytest.fixture(scope='module')
+def debugRoute():
+    world.loadDebugData(os.path.join(DATA, 'WSC.debug'))
+    world.importWorld(os.path.join(DATA, 'array.msh'), '')
+    world.setInitialConditions()
+
+
+# Random genomes (count x config.GA_GENES) with the range of the GA's genes
+@pytest.fixture
+def genomes():
+    def make(count, seed=0, genes=None):
+        genes = config.GA_GENES if genes is None else genes
+        return np.random.RandomState(seed).randint(-100, 100, (count, genes)).astype(np.float64)
+    return make
+
+
+# Elapsed race times of a population simulated one individual at a time with world.simulate
+@pytest.fixture
+def simulateEach():
+    def simulate(population, store=None, bound=None):
+        return np.array([world.simulate(genes, store, bound) for genes in population])
+    return simulate
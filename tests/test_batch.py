@@ -0,0 +1,14 @@
+# Tests of the batched population simulation (batch.py)
+
+import numpy as np
+import pytest
+
+import batch
+
+pytestmark = pytest.mark.usefixtures('debugRoute')
+
+
+def test_batchMatchesIndividuals(genomes, simulateEach):
+    population = genomes(6)
+    np.testing.assert_allclose(batch.simulate(population), simulateEach(population), rtol=1e-9)
+
@@ -0,0 +1,27 @@
+# Tests of the regression check of the benchmark suite (benchmark.compare)
+
+import benchmark
+
+
+def timing(best, median, spread):
+    return {'best': best, 'median': median, 'mean': median, 'spread': spread, 'calls': 1}
+
+
+def test_compareFlagsSlowdownBeyondNoise():
+    baseline = {'steady': timing(1.0, 1.01, 0.01), 'noisy': timing(1.0, 1.05, 0.08)}
+    results = {'steady': timing(1.3, 1.31, 0.01), 'noisy': timing(1.3, 1.35, 0.08)}
+    assert benchmark.compare(results, baseline, 0.1, verbose=False) == {'steady': (1.0, 1.3)}
+
+
+def test_compareNeedsBestAndMedianSlower():
+    baseline = {'case': timing(1.0, 1.0, 0.)}
+    assert benchmark.compare({'case': timing(1.0, 1.5, 0.)}, baseline, 0.1, verbose=False) == {}
+    assert benchmark.compare({'case': timing(1.5, 1.0, 0.)}, baseline, 0.1, verbose=False) == {}
+    assert benchmark.compare({'case': timing(1.5, 1.5, 0.)}, baseline, 0.1, verbose=False) == {'case': (1.0, 1.5)}
+
+
+# Baselines written before the median and spread were recorded
+def test_compareOldBaseline():
+    baseline = {'case': {'best': 1.0, 'mean': 1.1, 'calls': 1}, 'gone': {'best': 1.0, 'mean': 1.0, 'calls': 1}}
+    assert benchmark.compare({'case': timing(1.05, 1.15, 0.)}, baseline, 0.1, verbose=False) == {}
+    assert benchmark.compare({'case': timing(1.2, 1.3, 0.)}, baseline, 0.1, verbose=False) == {'case': (1.0, 1.2)}
@@ -0,0 +1,173 @@
+# Tests of the array geometry, its sidecar cache and lookup table (car.py)
+
+import os
+import shutil
+
+import numpy as np
+import pytest
+
+import car
+import config
+from conftest import DATA
+
+
+# A copy of the bundled array mesh, so that its sidecar cache is written next to the copy
+@pytest.fixture
+def meshFile(tmp_path):
+    fname = str(tmp_path / 'array.msh')
+    shutil.copyfile(os.path.join(DATA, 'array.msh'), fname)
+    return fname
+
+
+def loadArray(fname):
+    solarCar = car.car()
+    solarCar.loadArray(fname)
+    return solarCar
+
+
+def test_lutReusedFromMeshCache(monkeypatch, meshFile):
+    monkeypatch.setattr(config, 'ARRAY_MESH_CACHE', True)
+    monkeypatch.setattr(config, 'ARRAY_LUT', True)
+    built = loadArray(meshFile)
+    assert os.path.exists(meshFile + '.npz')
+
+    def rebuild(self):
+        raise AssertionError('lookup table rebuilt')
+    monkeypatch.setattr(car.car, 'buildArrayLut', rebuild)
+    cached = loadArray(meshFile)
+    np.testing.assert_array_equal(cached.lutDirect, built.lutDirect)
+    np.testing.assert_array_equal(cached.lutShade, built.lutShade)
+    np.testing.assert_array_equal(cached.lutAngles, built.lutAngles)
+    assert cached.lutPointed == built.lutPointed
+    assert cached.arrayLutError == built.arrayLutError
+    relAzimuth, relElevation = np.linspace(-170., 170., 35), np.linspace(-80., 80., 35)
+    for mode in (0, 2):
+        np.testing.assert_array_equal(cached.arrayLutPower(relAzimuth, relElevation, 800., mode),
+                                      built.arrayLutPower(relAzimuth, relElevation, 800., mode))
+
+
+def test_lutRebuiltForOtherResolution(monkeypatch, meshFile):
+    monkeypatch.setattr(config, 'ARRAY_MESH_CACHE', True)
+    monkeypatch.setattr(config, 'ARRAY_LUT', True)
+    loadArray(meshFile)
+    monkeypatch.setattr(config, 'ARRAY_LUT_RESOLUTION', 2. * config.ARRAY_LUT_RESOLUTION)
+    rebuilt = loadArray(meshFile)
+    assert rebuilt.lutResolution == pytest.approx(config.ARRAY_LUT_RESOLUTION)
+    assert rebuilt.lutDirect.shape == (len(rebuilt.lutAngles), len(rebuilt.lutAngles))
+    with np.load(meshFile + '.npz') as cache:
+        assert cache['lutSettings'][0] == config.ARRAY_LUT_RESOLUTION
+
+
+# Mesh power (W at 1000 W m-2) of the normals for sun positions relative to the car (deg), as in car.arrayIn
+def meshPower(solarCar, geometry, relAzimuth, relElevation):
+    relAzimuth, relElevation = np.deg2rad(relAzimuth), np.deg2rad(relElevation)
+    modSunVec = -np.array([np.sin(relAzimuth) * np.cos(relElevation),
+                           np.cos(relAzimuth) * np.sin(relElevation),
+                           np.sin(relElevation)])
+    power = np.matmul(geometry, modSunVec) * 0.5 * 1000. * solarCar.ARRAY_EFF
+    return np.maximum(power, 0.).sum(axis=0) - solarCar.DIFFUSE_EFF * np.minimum(power, 0.).sum(axis=0)
+
+
+# A group only loses power when the sun is edge-on to it; its facets are then within twice the tolerance of that
+# plane, which bounds the error by (1 + DIFFUSE_EFF) * sin(2 * tolerance) times the array's full power
+@pytest.mark.parametrize('tolerance', [2., 5., 10.])
+def test_clusterErrorWithinToleranceBound(monkeypatch, tolerance):
+    monkeypatch.setattr(config, 'ARRAY_MESH_CACHE', False)
+    monkeypatch.setattr(config, 'ARRAY_LUT', False)
+    solarCar = loadArray(os.path.join(DATA, 'array.msh'))
+    full = solarCar.arrayGeometry
+    reduced = solarCar.clusterArray(0, tolerance)
+    assert len(reduced) < len(full)
+    np.testing.assert_allclose(reduced.sum(axis=0), full.sum(axis=0), atol=1e-9)
+
+    bound = (1. + solarCar.DIFFUSE_EFF) * np.sin(np.deg2rad(2. * tolerance)) * solarCar.arrayArea * 1000. * \
+        solarCar.ARRAY_EFF
+    assert 0. < solarCar.arrayClusterError <= bound
+
+    # The recorded error is the worst one over its sample; other sun positions stay within the bound as well
+    rng = np.random.RandomState(1)
+    relAzimuth, relElevation = rng.uniform(-180., 180., 2000), rng.uniform(-90., 90., 2000)
+    error = np.abs(meshPower(solarCar, reduced, relAzimuth, relElevation) -
+                   meshPower(solarCar, full, relAzimuth, relElevation))
+    assert error.max() <= bound
+    exact, sampleAzimuth, sampleElevation = solarCar.sampleMeshPower(full)
+    np.testing.assert_allclose(meshPower(solarCar, full, sampleAzimuth, sampleElevation), exact[:-1], rtol=1e-12)
+
+
+def test_clusterCountKeepsTotalNormal(monkeypatch):
+    monkeypatch.setattr(config, 'ARRAY_MESH_CACHE', False)
+    monkeypatch.setattr(config, 'ARRAY_LUT', False)
+    solarCar = loadArray(os.path.join(DATA, 'array.msh'))
+    full = solarCar.arrayGeometry
+    reduced = solarCar.clusterArray(24)
+    assert len(reduced) <= 24
+    np.testing.assert_allclose(reduced.sum(axis=0), full.sum(axis=0), atol=1e-9)
+    exact = solarCar.sampleMeshPower(full)[0]
+    assert solarCar.arrayClusterError == pytest.approx(np.max(np.abs(solarCar.sampleMeshPower(reduced)[0] - exact)))
+
+
+# Line by line parser of the original loadArray: sequential node ids and two tags per element
+def referenceMesh(fname):
+    tRot = np.array([[0, -1, 0], [1, 0, 0], [0, 0, 1]])
+    mode, nodes, normals = 0, [], []
+    with open(fname) as f:
+        for line in f.read().splitlines():
+            items = line.split(' ')
+            if mode == 1 and line != '$EndNodes' and len(items) > 1:
+                nodes.append(np.array([float(items[1]), float(items[2]), float(items[3])]))
+            elif mode == 2 and line != '$EndElements' and len(items) > 1 and items[1] == '2':
+                a, b, c = (nodes[int(item) - 1] / 1000 for item in items[5:8])
+                normals.append(np.matmul(tRot, np.cross(b - a, c - a)))
+            elif line in ('$Nodes', '$Elements'):
+                mode = 1 if line == '$Nodes' else 2
+            elif line in ('$EndNodes', '$EndElements'):
+                mode = 0
+    return np.asarray(normals)
+
+
+def test_parseArrayMeshMatchesReference():
+    fname = os.path.join(DATA, 'array.msh')
+    expected = referenceMesh(fname)
+    geometry = car.car.parseArrayMesh(fname)
+    assert geometry.shape == expected.shape
+    np.testing.assert_allclose(geometry, expected, rtol=1e-12, atol=1e-15)
+
+
+# Sparse node ids, points and lines among the triangles and a varying number of tags
+def test_parseArrayMeshGeneralLayout(tmp_path):
+    fname = str(tmp_path / 'mixed.msh')
+    with open(fname, 'w') as f:
+        f.write('$MeshFormat\n2.2 0 8\n$EndMeshFormat\n$Nodes\n4\n'
+                '10 0 0 0\n20 1000 0 0\n7 0 2000 0\n30 0 0 3000\n$EndNodes\n'
+                '$Elements\n4\n1 15 2 0 10 10\n2 1 3 0 1 5 10 20\n3 2 2 0 1 10 20 7\n4 2 4 0 1 2 3 10 7 30\n'
+                '$EndElements\n')
+    geometry = car.car.parseArrayMesh(fname)
+    tRot = np.array([[0, -1, 0], [1, 0, 0], [0, 0, 1]])
+    expected = [np.cross([1., 0., 0.], [0., 2., 0.]), np.cross([0., 2., 0.], [0., 0., 3.])]
+    np.testing.assert_allclose(geometry, np.matmul(expected, tRot.T))
+
+
+def test_meshCacheInvalidatedWhenMeshChanges(monkeypatch, meshFile):
+    monkeypatch.setattr(config, 'ARRAY_MESH_CACHE', True)
+    monkeypatch.setattr(config, 'ARRAY_LUT', False)
+    parsed = loadArray(meshFile).arrayGeometry
+    np.testing.assert_array_equal(car.car.loadArrayCache(meshFile)['geometry'], parsed)
+
+    # Same size, newer modification time: the cache is stale and the mesh is parsed again
+    info = os.stat(meshFile)
+    os.utime(meshFile, ns=(info.st_atime_ns, info.st_mtime_ns + 10 ** 9))
+    assert car.car.loadArrayCache(meshFile) is None
+    np.testing.assert_array_equal(loadArray(meshFile).arrayGeometry, parsed)
+    assert car.car.loadArrayCache(meshFile) is not None
+
+    # Edited mesh: drop the last triangle
+    with open(meshFile) as f:
+        lines = f.read().splitlines()
+    end = lines.index('$EndElements')
+    lines[lines.index('$Elements') + 1] = str(end - lines.index('$Elements') - 3)
+    del lines[end - 1]
+    with open(meshFile, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    edited = loadArray(meshFile).arrayGeometry
+    np.testing.assert_array_equal(edited, parsed[:-1])
+    np.testing.assert_array_equal(car.car.loadArrayCache(meshFile)['geometry'], edited)
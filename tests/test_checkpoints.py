@@ -0,0 +1,46 @@
+# Tests of the incremental re-simulation from per-step checkpoints (checkpoints.py)
+
+import numpy as np
+import pytest
+
+import batch
+import checkpoints
+import config
+import world
+
+pytestmark = pytest.mark.usefixtures('debugRoute')
+
+
+# Children sharing their first genes with the parents, as after a crossover or mutation late in the profile
+def family(genomes):
+    parents = genomes(4)
+    children = parents.copy()
+    children[:, 60:] = genomes(4, seed=1)[:, 60:]
+    return parents, children
+
+
+def test_checkpointResumeMatchesFullSimulation(genomes, simulateEach):
+    parents, children = family(genomes)
+    expected = batch.simulate(children)
+
+    store = checkpoints.store(world.compiledRoute.length, config.SIM_CHECKPOINT_BUDGET)
+    batch.simulate(parents, store)
+    np.testing.assert_allclose(batch.simulate(children, store), expected, rtol=1e-9)
+    np.testing.assert_allclose(simulateEach(children, store), expected, rtol=1e-9)
+    assert store.resumed > 0
+    assert 0 < store.stepsSkipped < store.stepsTotal
+
+
+# A store holding two entries evicts while saving; the results do not depend on what is left
+def test_checkpointEvictionKeepsResults(genomes):
+    parents, children = family(genomes)
+    expected = batch.simulate(children)
+
+    length = world.compiledRoute.length
+    store = checkpoints.store(length, 2 * length * (8 * len(checkpoints.store.FIELDS) + 8))
+    assert store.capacity == 2
+    batch.simulate(parents, store)
+    assert store.used == 2
+    np.testing.assert_allclose(batch.simulate(children, store), expected, rtol=1e-9)
+    np.testing.assert_allclose(batch.simulate(children[::-1], store), expected[::-1], rtol=1e-9)
+    assert store.resumed > 0
@@ -0,0 +1,56 @@
+# Smoke tests of the CMA-ES engine (optimizer.runCMA and optimizer.eaGenerateUpdateBatch)
+
+import random
+
+import numpy as np
+import pytest
+
+from deap import base
+from deap import cma
+from deap import creator
+
+import config
+import fitness_cache
+import optimizer
+import world
+
+pytestmark = pytest.mark.usefixtures('debugRoute')
+
+
+def test_runCMAFillsHallOfFame(monkeypatch):
+    monkeypatch.setattr(config, 'OPTIMIZER_ENGINE', 'cma')
+    monkeypatch.setattr(config, 'CMA_GEN_NUM', 4)
+    monkeypatch.setattr(config, 'CMA_LAMBDA', 8)
+    random.seed(0)
+    np.random.seed(0)
+    pop, stats, hof = optimizer.optimize()
+
+    assert len(pop) == 8
+    assert len(hof) == 1
+    best = hof[0]
+    assert len(best) == config.GA_GENES
+    assert np.all((best >= config.CMA_POWER_MIN) & (best <= config.CMA_POWER_MAX))
+    assert best.fitness.values[0] == pytest.approx(world.simulate(best), rel=1e-9)
+    assert best.fitness.values[0] <= min(ind.fitness.values[0] for ind in pop)
+
+
+def test_eaGenerateUpdateBatchLogbook(monkeypatch):
+    np.random.seed(1)
+    strategy = cma.Strategy(centroid=np.zeros(config.GA_GENES), sigma=config.CMA_SIGMA, lambda_=6)
+    toolbox = base.Toolbox()
+    toolbox.register("generate", strategy.generate,
+                     lambda values: creator.Individual(np.clip(values, config.CMA_POWER_MIN, config.CMA_POWER_MAX)))
+    toolbox.register("update", strategy.update)
+    toolbox.register("evaluatePopulation", optimizer.evalPopulation)
+    hof = optimizer.createHallOfFame()
+    memo = fitness_cache.cache(100)
+    monkeypatch.setattr(optimizer, 'fitnessCache', memo)
+    pop, logbook = optimizer.eaGenerateUpdateBatch(toolbox, ngen=3, stats=optimizer.createStats(), halloffame=hof,
+                                                   verbose=False, cache=memo)
+
+    assert [record['gen'] for record in logbook] == [0, 1, 2]
+    assert [record['nevals'] for record in logbook] == [6, 6, 6]
+    assert 'hitrate' in logbook.header
+    assert all(record['min'] <= record['avg'] <= record['max'] for record in logbook)
+    assert hof[0].fitness.values[0] == min(record['min'] for record in logbook)
+    assert len(pop) == 6
@@ -0,0 +1,73 @@
+# Tests of the fitness memoization (fitness_cache.py)
+
+import numpy as np
+import pytest
+
+import batch
+import fitness_cache
+
+
+# Simulator stub recording the populations it is handed; stops the individuals whose first gene is negative
+class recorder:
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, genes):
+        self.calls.append(np.array(genes))
+        return genes.sum(axis=1), genes[:, 0] < 0
+
+
+def test_duplicatesSimulatedOnce():
+    population = np.array([[1., 2.], [3., 4.], [1., 2.], [-5., 6.], [1., 2.], [3., 4.]])
+    simulate = recorder()
+    memo = fitness_cache.cache(100)
+    eTimes, stopped = memo.evaluate(population, simulate)
+
+    assert len(simulate.calls) == 1
+    np.testing.assert_array_equal(simulate.calls[0], [[1., 2.], [3., 4.], [-5., 6.]])
+    np.testing.assert_array_equal(eTimes, [3., 7., 3., 1., 3., 7.])
+    np.testing.assert_array_equal(stopped, [False, False, False, True, False, False])
+    assert memo.collect() == {'lookups': 6, 'hits': 0, 'duplicates': 3, 'simulations': 3, 'hitrate': 0.5}
+
+
+def test_cachedIndividualsNotSimulatedAgain():
+    simulate = recorder()
+    memo = fitness_cache.cache(100)
+    memo.evaluate(np.array([[1., 2.], [-5., 6.]]), simulate)
+    memo.collect()
+    eTimes, stopped = memo.evaluate(np.array([[-5., 6.], [7., 8.], [7., 8.], [1., 2.]]), simulate)
+
+    assert len(simulate.calls) == 2
+    np.testing.assert_array_equal(simulate.calls[1], [[7., 8.]])
+    np.testing.assert_array_equal(eTimes, [1., 15., 15., 3.])
+    np.testing.assert_array_equal(stopped, [True, False, False, False])
+    assert memo.collect() == {'lookups': 4, 'hits': 2, 'duplicates': 1, 'simulations': 1, 'hitrate': 0.75}
+
+    # Nothing new: no simulation at all
+    memo.evaluate(np.array([[7., 8.], [1., 2.]]), simulate)
+    assert len(simulate.calls) == 2
+    assert memo.collect()['hitrate'] == 1.
+
+
+def test_leastRecentlyUsedEvicted():
+    simulate = recorder()
+    memo = fitness_cache.cache(2)
+    memo.evaluate(np.array([[1.], [2.]]), simulate)
+    memo.evaluate(np.array([[1.], [3.]]), simulate)     # 2 is the least recently used
+    assert memo.lookup(np.array([2.])) is None
+    assert memo.lookup(np.array([1.])) == 1.
+    assert memo.lookup(np.array([3.])) == 3.
+    memo.store(np.array([4.]), 40.)
+    assert memo.lookup(np.array([1.])) is None
+    assert memo.collect() == {'lookups': 8, 'hits': 3, 'duplicates': 0, 'simulations': 4, 'hitrate': 0.375}
+
+
+@pytest.mark.usefixtures('debugRoute')
+def test_cachedEvaluationMatchesSimulation(genomes):
+    population = genomes(4)
+    population = np.vstack((population, population[:2]))
+    memo = fitness_cache.cache(100)
+    simulate = lambda genes: (batch.simulate(genes), np.zeros(len(genes), dtype=bool))
+    eTimes, stopped = memo.evaluate(population, simulate)
+    np.testing.assert_array_equal(eTimes, batch.simulate(population))
+    assert memo.collect()['simulations'] == 4
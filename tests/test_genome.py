@@ -0,0 +1,94 @@
+# Tests of the genome to route mapping (genome.py)
+
+import copy
+import json
+
+import numpy as np
+import pytest
+
+import batch
+import config
+import genome
+import optimizer
+import world
+
+pytestmark = pytest.mark.usefixtures('debugRoute')
+
+
+# The original world.simulate: step index is driven by gene index - 1 on deep copies of the steps
+def simulateOriginal(genes):
+    solarCar = copy.deepcopy(world.solarCar)
+    steps = copy.deepcopy(world.steps)
+    for index, stp in enumerate(steps):
+        stp.pbattExp = config.PBATT_EXPECTED
+        stp.pbatt = stp.pbattExp + genes[index - 1]
+        stp.advanceStep(solarCar)
+        if index < len(steps) - 1:
+            steps[index + 1].eTime = stp.eTime
+            steps[index + 1].gTime = stp.gTime
+            steps[index + 1].speed = stp.speed
+            steps[index + 1].battSoC = stp.battSoC
+    return steps[-1].eTime
+
+
+def test_legacyMappingMatchesOriginalSimulation(monkeypatch, genomes, simulateEach):
+    monkeypatch.setattr(config, 'GENOME_MAPPING', 'legacy')
+    population = genomes(3, seed=2)
+    np.testing.assert_array_equal(genome.stepIndex(len(population[0])), np.arange(world.compiledRoute.length) - 1)
+    expected = np.array([simulateOriginal(genes) for genes in population])
+    np.testing.assert_allclose(simulateEach(population), expected, rtol=1e-9)
+    np.testing.assert_allclose(batch.simulate(population), expected, rtol=1e-9)
+
+
+def test_legacyMappingNeedsGenePerStep(monkeypatch):
+    monkeypatch.setattr(config, 'GENOME_MAPPING', 'legacy')
+    with pytest.raises(ValueError):
+        genome.stepIndex(world.compiledRoute.length - 2)
+
+
+# With one gene per step the 'steps' mapping is the legacy one shifted by a gene
+def test_stepsMappingShiftsLegacy(monkeypatch, genomes, simulateEach):
+    population = genomes(2, seed=4)
+    monkeypatch.setattr(config, 'GENOME_MAPPING', 'legacy')
+    expected = simulateEach(np.roll(population, -1, axis=1))
+    monkeypatch.setattr(config, 'GENOME_MAPPING', 'steps')
+    np.testing.assert_array_equal(simulateEach(population), expected)
+
+
+# Segments of 50 genes are nested in those of 10: the refined genome drives every step like the coarse one
+@pytest.mark.parametrize('kind', ['steps', 'distance'])
+def test_refineKeepsNestedProfile(monkeypatch, genomes, simulateEach, kind):
+    monkeypatch.setattr(config, 'GENOME_MAPPING', kind)
+    coarse = genomes(2, seed=5, genes=10)
+    fine = np.array([genome.refine(genes, 50) for genes in coarse])
+    assert fine.shape == (2, 50)
+    np.testing.assert_array_equal(genome.expand(fine), genome.expand(coarse))
+    np.testing.assert_array_equal(np.array([genome.refine(genes, 10) for genes in fine]), coarse)
+    np.testing.assert_allclose(simulateEach(fine), simulateEach(coarse), rtol=1e-12)
+    np.testing.assert_allclose(batch.simulate(fine), batch.simulate(coarse), rtol=1e-12)
+
+
+# Refining to segments that are not nested keeps the mean power of every new segment
+def test_refineProjectsOntoSegments(monkeypatch, genomes):
+    monkeypatch.setattr(config, 'GENOME_MAPPING', 'steps')
+    coarse = genomes(1, seed=6, genes=10)[0]
+    refined = genome.refine(coarse, 30)
+    stepPower = genome.expand(coarse)
+    index = genome.stepIndex(30)
+    for gene in range(30):
+        assert refined[gene] == pytest.approx(stepPower[index == gene].mean())
+
+
+# Every level of a progressive refinement logs its level and gene count
+def test_progressiveLevelsInLogbook(monkeypatch, tmp_path):
+    monkeypatch.setattr(config, 'GENOME_MAPPING', 'steps')
+    monkeypatch.setattr(config, 'GENOME_LEVELS', (10, 100))
+    monkeypatch.setattr(config, 'GA_GEN_NUM', 4)
+    monkeypatch.setattr(config, 'GA_LOGBOOK_FILE', str(tmp_path / 'ga.log'))
+    pop, stats, hof = optimizer.optimize()
+    assert len(hof[0]) == 100
+    for level, count in enumerate((10, 100)):
+        with open(str(tmp_path / ('ga.log.level%d' % level))) as f:
+            records = [json.loads(line) for line in f]
+        assert [record['gen'] for record in records] == [0, 1, 2]
+        assert all(record['level'] == level and record['genes'] == count for record in records)
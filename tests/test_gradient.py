@@ -0,0 +1,45 @@
+# Tests of the finite difference gradients of the gradient based optimizer (gradient.py)
+
+import numpy as np
+import pytest
+
+import config
+import gradient
+import world
+
+pytestmark = pytest.mark.usefixtures('debugRoute')
+
+
+# Elapsed race time and SoC at the end of every step of one profile, simulated on its own with world.simulate
+def simulateSerial(x):
+    eTime = world.simulate(x)
+    return eTime, world.simState.battSoC.copy()
+
+
+def test_batchedGradientMatchesSerial(monkeypatch, genomes):
+    monkeypatch.setattr(config, 'SIM_COPY_FREE', True)
+    x = genomes(1, seed=3)[0]
+    x[::7] = config.GRAD_POWER_MAX     # Genes at the upper bound are differenced backwards
+    model = gradient.profileModel(len(x), config.GRAD_STEP, config.GRAD_POWER_MAX)
+    eTimeGrad = model.eTimeJac(x)
+    socJac = model.socJacobian(x)
+    assert model.simulations == len(x) + 1
+
+    eTime, soc = simulateSerial(x)
+    assert model.eTimeFun(x) == pytest.approx(eTime, rel=1e-9)
+    np.testing.assert_allclose(model.socFun(x) + config.GRAD_SOC_MIN, soc, rtol=1e-9)
+    expectedGrad = np.empty(len(x))
+    expectedJac = np.empty((len(soc), len(x)))
+    for gene in range(len(x)):
+        step = -config.GRAD_STEP if x[gene] + config.GRAD_STEP > config.GRAD_POWER_MAX else config.GRAD_STEP
+        perturbed = x.copy()
+        perturbed[gene] += step
+        eTimeStep, socStep = simulateSerial(perturbed)
+        expectedGrad[gene] = (eTimeStep - eTime) / step
+        expectedJac[:, gene] = (socStep - soc) / step
+
+    # Differences of nearly equal times: compare against the size of the times rather than of the differences
+    np.testing.assert_allclose(eTimeGrad, expectedGrad, rtol=0., atol=1e-9 * eTime)
+    np.testing.assert_allclose(socJac, expectedJac, rtol=0., atol=1e-9 * 100.)
+    assert np.count_nonzero(eTimeGrad) > len(x) // 2
+    assert model.simulations == len(x) + 1    # The value at the gradient's point is reused
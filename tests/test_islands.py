@@ -0,0 +1,54 @@
+# Tests of the island model (islands.py)
+
+import json
+import os
+
+import pytest
+
+import config
+import islands
+import optimizer
+import run_state
+
+pytestmark = pytest.mark.usefixtures('debugRoute')
+
+
+@pytest.fixture
+def twoIslands(monkeypatch):
+    monkeypatch.setattr(config, 'GA_ISLANDS', 2)
+    monkeypatch.setattr(config, 'GA_ISLAND_INTERVAL', 2)
+    monkeypatch.setattr(config, 'GA_ISLAND_POLL', 0.2)
+    monkeypatch.setattr(config, 'GA_GEN_NUM', 3)
+
+
+# Every island checkpoints, logs and screens its offspring under its own file names
+def test_islandCheckpointsAndLogbooks(monkeypatch, tmp_path, twoIslands):
+    monkeypatch.setattr(config, 'GA_CHECKPOINT', True)
+    monkeypatch.setattr(config, 'GA_CHECKPOINT_FILE', str(tmp_path / 'ga.checkpoint'))
+    monkeypatch.setattr(config, 'GA_LOGBOOK_FILE', str(tmp_path / 'ga.log'))
+    monkeypatch.setattr(config, 'SURROGATE', True)
+    monkeypatch.setattr(config, 'SURROGATE_MIN_SAMPLES', 10)
+    pop, stats, hof = optimizer.optimize()
+    assert len(pop) == 2 * config.GA_POP_NUM
+
+    for island in range(2):
+        state = run_state.load(str(tmp_path / ('ga.checkpoint.island%d' % island)))
+        assert state['gen'] == 3
+        assert state['extra']['surrogate'] is not None
+        with open(str(tmp_path / ('ga.log.island%d' % island))) as f:
+            records = [json.loads(line) for line in f]
+        assert [record['gen'] for record in records] == [0, 1, 2, 3]
+        assert 'serr' in records[-1]
+    assert not os.path.exists(config.GA_CHECKPOINT_FILE)
+
+
+def test_deadIslandFailsRun(monkeypatch, twoIslands):
+    island = islands._island
+
+    def dieSilently(index, *args):
+        if index == 1:
+            os._exit(3)     # No result and no traceback, as when the process is killed
+        island(index, *args)
+    monkeypatch.setattr(islands, '_island', dieSilently)
+    with pytest.raises(RuntimeError, match='Island 1 died without a result \\(exit code 3\\)'):
+        islands.run(verbose=False)
@@ -0,0 +1,40 @@
+# Tests of the dynamic programming / beam search planner (planner.py)
+
+import numpy as np
+import pytest
+
+import batch
+import config
+import planner
+import world
+
+pytestmark = pytest.mark.usefixtures('debugRoute')
+
+
+# Without a binding battery constraint the optimum is the highest battery power everywhere
+def test_plannerFindsUnconstrainedOptimum():
+    profile, plannedTime, simulatedTime = planner.plan(verbose=False)
+    np.testing.assert_array_equal(profile, config.DP_POWER_MAX)
+    assert simulatedTime == pytest.approx(plannedTime, rel=1e-12)
+
+
+# A 300 Wh battery cannot sustain the highest power: the schedule must keep the SoC above DP_SOC_MIN at every step
+def test_plannedScheduleFeasible(monkeypatch):
+    monkeypatch.setattr(world.solarCar, 'BATT_CAPACITY', 300)
+    monkeypatch.setattr(config, 'DP_POWER_MIN', -300.)
+    monkeypatch.setattr(config, 'DP_SOC_MIN', 20.)
+    profile, plannedTime, simulatedTime = planner.plan(verbose=False)
+    assert simulatedTime == pytest.approx(plannedTime, rel=1e-9)
+    assert np.all((profile >= config.DP_POWER_MIN) & (profile <= config.DP_POWER_MAX))
+
+    eTimes, soc = batch.simulate(profile[np.newaxis], trajectory=True)
+    assert eTimes[0] == pytest.approx(plannedTime, rel=1e-9)
+    assert soc.min() >= config.DP_SOC_MIN
+    assert soc.min() < config.DP_SOC_MIN + 1.   # The constraint binds
+    assert world.simulate(np.full(len(profile), config.DP_POWER_MAX)) > plannedTime
+
+
+def test_plannerFailsWithoutFeasibleLevel(monkeypatch):
+    monkeypatch.setattr(config, 'DP_SOC_MIN', 99.)
+    with pytest.raises(planner.PlannerError):
+        planner.plan(verbose=False)
@@ -0,0 +1,46 @@
+# Regression tests of the streaming route preprocessor (world.preprocessWorld, streamRoute and _processWaypoints)
+# The expected routes in tests/data were written by the original, whole-tree preprocessWorld from the bundled gpx
+# files with the control stops below.
+
+import gzip
+import os
+import xml.etree.ElementTree as ET
+
+import numpy as np
+import pytest
+
+import config
+import world
+from conftest import DATA
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+CONTROL_STOPS = {'route_debug_full': [322, 632, 987, 1208, 1493, 1766, 2178, 2432, 2720],
+                 'waypoints': [20, 50],
+                 'waypoints_small': [3]}
+
+
+def expectedSteps(name):
+    with gzip.open(os.path.join(HERE, 'data', name + '.route.gz')) as f:
+        return [child.attrib for child in ET.parse(f).getroot()]
+
+
+# Chunks of a single waypoint put a chunk boundary on every control stop and on the steps around it
+@pytest.mark.parametrize('chunk', [1, 7, 64, 4096])
+@pytest.mark.parametrize('name', sorted(CONTROL_STOPS))
+def test_preprocessMatchesBaseline(monkeypatch, tmp_path, name, chunk):
+    monkeypatch.setattr(config, 'PREPROCESS_CHUNK', chunk)
+    output = str(tmp_path / 'WSC.route')
+    rt = world.preprocessWorld(os.path.join(DATA, name + '.gpx'), CONTROL_STOPS[name], output)
+
+    expected = expectedSteps(name)
+    steps = [child.attrib for child in ET.parse(output).getroot()]
+    assert len(steps) == len(expected) == rt.length
+    for index, (attrib, expectedAttrib) in enumerate(zip(steps, expected)):
+        assert attrib == expectedAttrib, 'step %d' % index
+
+    # The returned route holds the values written to the file
+    for column in world.PREPROCESS_COLUMNS:
+        np.testing.assert_array_equal(getattr(rt, column), [float(attrib[column]) for attrib in expected],
+                                      err_msg=column)
+    assert np.count_nonzero(rt.stepType == 1) == len(CONTROL_STOPS[name])
@@ -0,0 +1,79 @@
+# Tests of the early stops of simulations (constraint aborts, bound pruning and invalid profiles) across the engines
+
+import numpy as np
+import pytest
+
+import batch
+import checkpoints
+import config
+import optimizer
+import workers
+import world
+
+pytestmark = pytest.mark.usefixtures('debugRoute')
+
+
+@pytest.fixture(autouse=True)
+def clearPruneStats():
+    world.collectPruneStats()
+    yield
+    world.collectPruneStats()
+
+
+def test_earlyStopsMatchAcrossEngines(monkeypatch, genomes, simulateEach):
+    population = genomes(8)
+    eTimes, soc = batch.simulate(population, trajectory=True)
+    monkeypatch.setattr(config, 'SIM_ABORT_SOC', True)
+    monkeypatch.setattr(config, 'SIM_SOC_MIN', float(np.median(soc.min(axis=1))))
+    bound = float(np.sort(eTimes)[2])
+
+    expected = batch.simulate(population, bound=bound)
+    assert np.any(expected >= config.SIM_INFEASIBLE_TIME)
+    assert np.any((expected > bound) & (expected < config.SIM_INFEASIBLE_TIME))
+    stats = world.collectPruneStats()
+    assert stats['aborted'] > 0 and stats['pruned'] > 0
+
+    monkeypatch.setattr(config, 'SIM_COPY_FREE', True)
+    np.testing.assert_allclose(simulateEach(population, bound=bound), expected, rtol=1e-9)
+    assert world.collectPruneStats() == stats
+    monkeypatch.setattr(config, 'SIM_COPY_FREE', False)
+    np.testing.assert_allclose(simulateEach(population, bound=bound), expected, rtol=1e-9)
+    assert world.collectPruneStats() == stats
+
+    store = checkpoints.store(world.compiledRoute.length, config.SIM_CHECKPOINT_BUDGET)
+    np.testing.assert_allclose(batch.simulate(population, store, bound=bound), expected, rtol=1e-9)
+    np.testing.assert_allclose(batch.simulate(population, store, bound=bound), expected, rtol=1e-9)
+
+
+# Profiles the car cannot traverse the route with are counted as invalid by both engines, not as constraint aborts
+@pytest.mark.parametrize('copyFree', [True, False])
+def test_invalidProfilesCountedSeparately(monkeypatch, genomes, simulateEach, copyFree):
+    monkeypatch.setattr(config, 'SIM_COPY_FREE', copyFree)
+    population = genomes(4)
+    population[1:3] = -1000.
+    expected = batch.simulate(population)
+    assert np.count_nonzero(np.isinf(expected)) == 2
+    stats = world.collectPruneStats()
+    assert stats['aborted'] == stats['pruned'] == 0
+    assert stats['invalid'] == 2 and stats['savedSteps'] > 0
+
+    np.testing.assert_array_equal(simulateEach(population), expected)
+    assert world.collectPruneStats() == stats
+
+
+# Per individual evaluation on the pool: the workers prune with the bound of the parent and send their counts back
+def test_poolMapUsesParentBound(monkeypatch, genomes):
+    monkeypatch.setattr(config, 'SIM_PRUNE_BOUND', True)
+    population = [optimizer.creator.Individual(genes) for genes in genomes(6)]
+    bound = float(np.sort(batch.simulate(np.array(population)))[1])
+    expected = batch.simulate(np.array(population), bound=bound)
+    stats = world.collectPruneStats()
+    assert stats['pruned'] > 0
+
+    monkeypatch.setattr(optimizer, 'bestTime', bound)
+    with workers.pool(1) as evalPool:
+        monkeypatch.setattr(optimizer, 'evalPool', evalPool)
+        fitnesses = optimizer.mapPool(optimizer.toolbox.evaluate, population)
+    np.testing.assert_allclose([fitness[0] for fitness in fitnesses], expected, rtol=1e-9)
+    assert world.collectPruneStats() == stats
+    assert optimizer.bestTime == pytest.approx(float(np.min(expected)))
@@ -0,0 +1,77 @@
+# Tests of the compiled route and its XML and .npy directory formats (route.py)
+
+import os
+
+import numpy as np
+import pytest
+
+import config
+import route
+import world
+from conftest import DATA
+
+DEBUG = os.path.join(DATA, 'WSC.debug')
+
+
+def assertSameRoute(actual, expected):
+    assert actual.length == expected.length
+    for column in route.route.COLUMNS:
+        np.testing.assert_array_equal(getattr(actual, column), getattr(expected, column), err_msg=column)
+
+
+def assertColumnTypes(rt):
+    for column in route.route.COLUMNS:
+        values = getattr(rt, column)
+        assert values.dtype == route.route.DTYPES.get(column, np.float64), column
+        assert values.shape == (rt.length,)
+        assert not values.flags.writeable
+
+
+def test_xmlRoundTrip(tmp_path):
+    original = route.fromXml(DEBUG)
+    assert original.length == 100
+    assertColumnTypes(original)
+    fname = str(tmp_path / 'route.xml')
+    route.toXml(original, fname)
+    copy = route.fromXml(fname)
+    assertColumnTypes(copy)
+    assertSameRoute(copy, original)
+
+
+def test_xmlMatchesLoadedSteps(monkeypatch):
+    monkeypatch.setattr(config, 'EN_WIND', True)
+    world.loadDebugData(DEBUG)
+    assertSameRoute(route.fromSteps(world.steps), route.fromXml(DEBUG))
+
+
+def test_compiledRouteLoadsReadOnlyMemmap(tmp_path):
+    original = route.fromXml(DEBUG)
+    path = route.compileXml(DEBUG, str(tmp_path / 'compiled'))
+    assert sorted(os.listdir(path)) == sorted(column + '.npy' for column in route.route.COLUMNS)
+    loaded = route.load(path)
+    assertColumnTypes(loaded)
+    assertSameRoute(loaded, original)
+    for column in route.route.COLUMNS:
+        assert isinstance(getattr(loaded, column), np.memmap)
+        assert getattr(loaded, column).mode == 'r'
+    with pytest.raises(ValueError):
+        loaded.lat[0] = 0.
+    assertSameRoute(route.load(route.save(loaded, str(tmp_path / 'copy'))), original)
+
+
+# A compiled route directory simulates exactly like the XML route it was compiled from
+def test_compiledRouteSimulatesLikeXml(tmp_path, genomes, simulateEach):
+    population = genomes(3)
+    path = route.compileXml(DEBUG, str(tmp_path / 'compiled'))
+    world.loadDebugData(DEBUG)
+    world.importWorld(os.path.join(DATA, 'array.msh'), '')
+    world.setInitialConditions()
+    expected = simulateEach(population)
+    world.loadCompiledData(path)
+    world.setInitialConditions()
+    try:
+        assert isinstance(world.compiledRoute.lat, np.memmap)
+        np.testing.assert_array_equal(simulateEach(population), expected)
+    finally:
+        world.loadDebugData(DEBUG)
+        world.setInitialConditions()
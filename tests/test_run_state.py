@@ -0,0 +1,68 @@
+# Tests of the checkpoint and resume of GA runs (run_state.py)
+
+import pickle
+import random
+
+import numpy as np
+import pytest
+
+import config
+import optimizer
+import run_state
+
+pytestmark = pytest.mark.usefixtures('debugRoute')
+
+
+# Final checkpoint and hall of fame of a seeded GA run of ngen generations, resumed from its checkpoint when resume is
+# set; the logbook is streamed next to the checkpoint
+def runGA(monkeypatch, path, ngen, resume=False):
+    monkeypatch.setattr(config, 'GA_CHECKPOINT', True)
+    monkeypatch.setattr(config, 'GA_CHECKPOINT_FILE', str(path))
+    monkeypatch.setattr(config, 'GA_LOGBOOK_FILE', str(path) + '.log')
+    monkeypatch.setattr(config, 'GA_GEN_NUM', ngen)
+    monkeypatch.setattr(config, 'GA_RESUME', resume)
+    if not resume:
+        random.seed(0)
+        np.random.seed(0)
+    pop, stats, hof = optimizer.optimize()
+    return run_state.load(str(path)), hof
+
+
+def test_resumedRunMatchesUninterruptedRun(monkeypatch, tmp_path):
+    full, fullHof = runGA(monkeypatch, tmp_path / 'full', 4)
+    runGA(monkeypatch, tmp_path / 'split', 2)
+    resumed, resumedHof = runGA(monkeypatch, tmp_path / 'split', 4, resume=True)
+
+    assert resumed['gen'] == full['gen'] == 4
+    for packed, expected in zip(resumed['population'], full['population']):
+        np.testing.assert_array_equal(packed, expected)
+    # The fitness cache starts empty after a resume, so only the population statistics are compared
+    fields = ('gen', 'nevals', 'avg', 'std', 'min', 'max')
+    assert ([[record[field] for field in fields] for record in resumed['logbook'][0]]
+            == [[record[field] for field in fields] for record in full['logbook'][0]])
+    assert resumedHof[0].fitness.values == fullHof[0].fitness.values
+    assert resumed['extra']['bestTime'] == full['extra']['bestTime']
+
+    # The resumed logbook file holds every generation once
+    with open(str(tmp_path / 'split.log')) as f:
+        assert len(f.readlines()) == 5
+
+
+def test_checkpointChecksFormatAndPopulation(tmp_path):
+    path = str(tmp_path / 'ga.checkpoint')
+    population = optimizer.toolbox.population(n=2)
+    for ind in population:
+        ind.fitness.values = 1.,
+    run_state.save(path, 1, population, None, optimizer.tools.Logbook())
+    assert run_state.load(str(tmp_path / 'missing')) is None
+    with pytest.raises(ValueError):
+        run_state.restore(run_state.load(path), optimizer.toolbox.population(n=3), None)
+
+    # Checkpoints of another format version are refused
+    with open(path, 'rb') as f:
+        state = pickle.load(f)
+    state['version'] = run_state.VERSION - 1
+    with open(path, 'wb') as f:
+        pickle.dump(state, f)
+    with pytest.raises(ValueError, match='format version'):
+        run_state.load(path)
@@ -0,0 +1,118 @@
+# Tests of the closed-form speed solvers (solver.py) and their use in car.calcStepTime
+
+import copy
+import math
+from datetime import datetime
+
+import numpy as np
+import pytest
+from scipy.optimize import brentq
+
+import batch
+import config
+import solver
+import world
+
+MASS = 300.
+CDA = 0.1125
+RHO = 1.17
+G = 9.81
+
+
+def largestRealRoot(a, b, c):
+    roots = np.roots([a, 0., b, -c])
+    return max(root.real for root in roots if abs(root.imag) < 1e-9)
+
+
+def test_cubicRootOneRealRoot():
+    a, b, c = 0.5 * CDA * RHO, 50., 900.
+    assert (c / a / 2.) ** 2 + (b / a / 3.) ** 3 > 0
+    y, converged = solver.cubicRoot(a, b, c)
+    assert converged
+    assert y == pytest.approx(largestRealRoot(a, b, c), rel=1e-12)
+
+
+def test_cubicRootThreeRealRoots():
+    a, b, c = 1., -3., 1.   # y^3 - 3y - 1: roots 2cos(20), 2cos(140) and 2cos(260) deg
+    y, converged = solver.cubicRoot(a, b, c)
+    assert converged
+    assert y == pytest.approx(2. * math.cos(math.radians(20.)), rel=1e-12)
+    yArray, convergedArray = solver.cubicRoot(np.array([a]), b, c)
+    assert convergedArray[0]
+    assert yArray[0] == pytest.approx(y, rel=1e-12)
+
+
+def test_cubicRootScalarMatchesArray():
+    state = np.random.RandomState(0)
+    a = 0.5 * CDA * state.uniform(1., 1.3, 200)
+    b = MASS * G * np.sin(np.deg2rad(state.uniform(-3., 3., 200)))
+    c = state.uniform(-200., 3000., 200)
+    y, converged = solver.cubicRoot(a, b, c)
+    for i in range(len(a)):
+        yScalar, convergedScalar = solver.cubicRoot(a[i], b[i], c[i])
+        assert convergedScalar == converged[i]
+        assert yScalar == pytest.approx(y[i], rel=1e-12, abs=1e-12)
+        assert yScalar == pytest.approx(largestRealRoot(a[i], b[i], c[i]), rel=1e-9, abs=1e-9)
+
+
+def test_exitSpeedMatchesNumericRoot():
+    omega, vPrev, dist = 25., 18., 800.
+    k = -1.5 * CDA * RHO * omega ** 2 - MASS * G * math.sin(math.radians(0.5))
+    f = lambda z: dist - MASS * omega ** 2 * math.log((z - omega) / (vPrev - omega)) / k
+    expected = brentq(f, vPrev, omega - 1e-12, xtol=1e-14)
+    z, converged = solver.exitSpeed(omega, vPrev, dist, k, MASS)
+    assert converged
+    assert z == pytest.approx(expected, rel=1e-10)
+    zArray, convergedArray = solver.exitSpeed(np.array([omega, omega]), vPrev, dist, k, MASS)
+    assert np.all(convergedArray)
+    np.testing.assert_allclose(zArray, z, rtol=1e-12)
+
+
+def test_stepSpeedScalarMatchesArray():
+    state = np.random.RandomState(1)
+    pnet = state.uniform(100., 3000., 50)
+    vPrev = state.uniform(5., 30., 50)
+    dist = state.uniform(100., 2000., 50)
+    inclination = state.uniform(-2., 2., 50)
+    omega, speed, converged = solver.stepSpeed(pnet, vPrev, dist, RHO, inclination, MASS, CDA, G)
+    assert np.all(converged)
+    for i in range(len(pnet)):
+        omegaScalar, speedScalar, convergedScalar = solver.stepSpeed(pnet[i], vPrev[i], dist[i], RHO, inclination[i],
+                                                                     MASS, CDA, G)
+        assert convergedScalar
+        assert omegaScalar == pytest.approx(omega[i], rel=1e-12)
+        assert speedScalar == pytest.approx(speed[i], rel=1e-12)
+
+
+# No shaft power left after rolling resistance (c <= 0) on flat or uphill steps: no forward terminal speed
+@pytest.mark.parametrize('pnet', [0., -50.])
+@pytest.mark.parametrize('inclination', [0., 1.])
+def test_stepSpeedFailsWithoutShaftPower(pnet, inclination):
+    omega, speed, converged = solver.stepSpeed(pnet, 20., 500., RHO, inclination, MASS, CDA, G)
+    assert not converged
+    omega, speed, converged = solver.stepSpeed(np.array([pnet, 500.]), 20., 500., RHO, inclination, MASS, CDA, G)
+    assert not converged[0] and converged[1]
+
+
+@pytest.mark.parametrize('omega', [0., -5.])
+def test_exitSpeedFailsWithoutTerminalSpeed(omega):
+    assert not solver.exitSpeed(omega, 20., 500., -100., MASS)[1]
+    assert not solver.exitSpeed(np.array([omega]), 20., 500., -100., MASS)[1][0]
+
+
+# Without a speed solution (the shaft power does not cover the rolling resistance, eg. with an empty battery in the
+# dark) calcStepTime raises and the profile gets an infinite elapsed time
+@pytest.mark.usefixtures('debugRoute')
+def test_calcStepTimeWithoutShaftPower(monkeypatch):
+    monkeypatch.setattr(config, 'FAST_SPEED_SOLVER', True)
+    stp = copy.deepcopy(world.steps[10])
+    stp.gTime = datetime(world.startTime.year, world.startTime.month, world.startTime.day, 22, 0)
+    stp.speed = 20.
+    stp.battSoC = 0.
+    stp.pbatt = stp.pbattExp = config.PBATT_EXPECTED
+    with pytest.raises(solver.SolverError):
+        world.solarCar.calcStepTime(stp)
+
+    genes = np.full((1, config.GA_GENES), -1000.)
+    assert world.simulate(genes[0]) == float('inf')
+    assert batch.simulate(genes)[0] == float('inf')
@@ -0,0 +1,46 @@
+# Tests of the step events (step.py)
+
+import copy
+from datetime import datetime
+
+import pytest
+
+import config
+import world
+
+pytestmark = pytest.mark.usefixtures('debugRoute')
+
+
+def stepAt(hour, minute, battSoC=60.):
+    stp = copy.deepcopy(world.steps[10])
+    stp.gTime = datetime(world.startTime.year, world.startTime.month, world.startTime.day, hour, minute)
+    stp.speed = 20.
+    stp.battSoC = battSoC
+    stp.pbatt = stp.pbattExp = config.PBATT_EXPECTED
+    return stp
+
+
+# Charge the same windows minute by minute and integrated; returns the two resulting steps
+def chargeBoth(monkeypatch, charge, hour, minute):
+    steps = []
+    for integrated in (False, True):
+        monkeypatch.setattr(config, 'CHARGE_INTEGRATED', integrated)
+        stp = stepAt(hour, minute)
+        charge(stp)
+        steps.append(stp)
+    return steps
+
+
+@pytest.mark.parametrize('mode, incrementFirst', [(0, False), (2, True)])
+def test_integratedChargeMatchesMinuteLoop(monkeypatch, mode, incrementFirst):
+    charge = lambda stp: stp.chargeWindow(world.solarCar, 30, mode, incrementFirst)
+    minutes, integrated = chargeBoth(monkeypatch, charge, 13, 20)
+    assert integrated.gTime == minutes.gTime
+    assert integrated.battSoC > 60.
+    assert integrated.battSoC == pytest.approx(minutes.battSoC, rel=1e-9)
+
+
+def test_integratedEndOfDayMatchesMinuteLoop(monkeypatch):
+    minutes, integrated = chargeBoth(monkeypatch, lambda stp: stp.processEOD(world.solarCar), 17, 5)
+    assert integrated.gTime == minutes.gTime
+    assert integrated.battSoC == pytest.approx(minutes.battSoC, rel=1e-9)
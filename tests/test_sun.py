@@ -0,0 +1,39 @@
+# Tests of the solar position and irradiance (sun.py)
+
+from datetime import datetime
+from datetime import timedelta
+
+import numpy as np
+
+import sun
+
+
+# Times from before sunrise to after sunset over the Darwin - Adelaide route
+def samples():
+    start = datetime(2017, 10, 8, 5, 0, 17)
+    times = [start + timedelta(minutes=23 * i) for i in range(45)]
+    lats = np.linspace(-12.4, -34.9, len(times))
+    lons = np.linspace(130.8, 138.6, len(times))
+    return times, lats, lons
+
+
+def test_infoArrayMatchesScalar():
+    times, lats, lons = samples()
+    arrays = sun.infoArray(times, 9.5, [lats, lons])
+    for i, gTime in enumerate(times):
+        scalar = sun.info(gTime, 9.5, [lats[i], lons[i]])
+        for name, value, expected in zip(('elevation', 'azimuth', 'eot', 'declination', 'jd'), arrays, scalar):
+            np.testing.assert_allclose(value[i], expected, rtol=1e-11, atol=1e-9, err_msg=name)
+
+
+def test_irradianceArrayMatchesScalar():
+    times, lats, lons = samples()
+    arrays = sun.infoArray(times, 9.5, [lats, lons])
+    irradiance = sun.irradianceArray(arrays)
+    daylight = 0
+    for i, gTime in enumerate(times):
+        scalar = sun.info(gTime, 9.5, [lats[i], lons[i]])
+        if scalar[0] > 0:
+            daylight += 1
+            np.testing.assert_allclose(irradiance[i], sun.irradiance(scalar), rtol=1e-11)
+    assert 0 < daylight < len(times)
@@ -0,0 +1,50 @@
+# Tests of the solar ephemeris cache (sun_cache.py)
+
+import collections
+from datetime import datetime
+from datetime import timedelta
+
+import numpy as np
+import pytest
+
+import config
+import instrument
+import sun
+import sun_cache
+
+
+@pytest.fixture(autouse=True)
+def emptyRiseSetTable(monkeypatch):
+    monkeypatch.setattr(config, 'SUN_CACHE', True)
+    monkeypatch.setattr(sun_cache, 'riseSetTable', collections.OrderedDict())
+    monkeypatch.setattr(sun_cache, 'riseSetMaxError', 0.)
+
+
+def test_riseSetMemoWithinTolerance():
+    start = datetime(2017, 10, 8, 8, 3)
+    for i, (lat, lon) in enumerate(zip(np.linspace(-12.4, -34.9, 60), np.linspace(130.8, 138.6, 60))):
+        for hours in (0, 5, 11):
+            gTime = start + timedelta(hours=hours, minutes=7 * i)
+            for memo, exact in zip(sun_cache.getSunRiseSetTime(gTime, 9.5, [lat, lon]),
+                                   sun.getSunRiseSetTime(gTime, 9.5, [lat, lon])):
+                assert abs((memo - exact).total_seconds()) <= config.SUN_CACHE_TOL_RISESET
+    assert sun_cache.riseSetMaxError <= config.SUN_CACHE_TOL_RISESET
+    assert any(result is not None for result in sun_cache.riseSetTable.values())
+
+
+# A day whose exact times jump (the hour truncation of sun.getSunRiseSetTime) is not memoized
+def test_riseSetMemoSkipsUnstableDays(monkeypatch):
+    monkeypatch.setattr(config, 'SUN_CACHE_TOL_RISESET', -1.)
+    gTime = datetime(2017, 10, 8, 17, 30)
+    assert sun_cache.getSunRiseSetTime(gTime, 9.5, [-20., 133.]) == sun.getSunRiseSetTime(gTime, 9.5, [-20., 133.])
+    assert list(sun_cache.riseSetTable.values()) == [None]
+
+
+def test_statsReportsHitRates(monkeypatch):
+    monkeypatch.setattr(config, 'INSTRUMENT', True)
+    monkeypatch.setattr(instrument, 'counts', collections.Counter())
+    results = [sun_cache.getSunRiseSetTime(datetime(2017, 10, 8, 17, minute), 9.5, [-20., 133.]) for minute in range(4)]
+    assert all(result == results[0] for result in results)
+    stats = sun_cache.stats()
+    assert stats['riseSetHitRate'] == 0.75
+    assert stats['riseSetSize'] == 1
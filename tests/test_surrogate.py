@@ -0,0 +1,113 @@
+# Tests of the surrogate model pre-screening of GA offspring (surrogate.py)
+
+import random
+
+import numpy as np
+import pytest
+
+from deap import creator
+
+import config
+import optimizer
+import surrogate
+
+WEIGHTS = np.array([3., -2., 1., 0.5, -1.])
+
+
+# Individuals of 10 genes; the elapsed time is linear in the means of their 5 segments of 2 genes
+def individuals(genes, fitness=True):
+    population = [creator.Individual(values) for values in np.asarray(genes, dtype=np.float64)]
+    if fitness:
+        for ind in population:
+            ind.fitness.values = elapsed(ind),
+    return population
+
+
+def elapsed(genes):
+    return 3000. + float(np.matmul(np.asarray(genes).reshape(5, 2).mean(axis=1), WEIGHTS))
+
+
+def trained(count=60, seed=0):
+    model = surrogate.ridgeModel(5, 1e-9)
+    population = individuals(np.random.RandomState(seed).randint(-100, 100, (count, 10)))
+    model.update(population, np.zeros(count, dtype=bool))
+    return model
+
+
+@pytest.fixture(autouse=True)
+def minSamples(monkeypatch):
+    monkeypatch.setattr(config, 'SURROGATE_MIN_SAMPLES', 50)
+
+
+def test_screenKeepsPredictedBest():
+    model = trained()
+    assert model.ready()
+    candidates = individuals(np.random.RandomState(1).randint(-100, 100, (40, 10)), fitness=False)
+    chosen = model.screen(candidates, 10)
+
+    assert sorted(elapsed(ind) for ind in chosen) == sorted(elapsed(ind) for ind in candidates)[:10]
+    assert model.collect()['skipped'] == pytest.approx(0.75)
+
+
+# Evaluated candidates rank on their fitness and copies of a chosen genome only fill the remaining places
+def test_screenRanksEvaluatedAndCopies():
+    model = trained()
+    genes = np.random.RandomState(2).randint(-100, 100, (6, 10))
+    candidates = individuals(genes[:3], fitness=False) + individuals(genes[:1], fitness=False) + individuals(genes[3:])
+    candidates[4].fitness.values = 0.,  # Best of all
+    chosen = model.screen(candidates, 6)
+    assert chosen[0] is candidates[4]
+    assert not any(ind is candidates[3] for ind in chosen) and any(ind is candidates[0] for ind in chosen)
+    assert model.screen(candidates, 7)[-1] is candidates[3]
+
+
+def test_notReadyKeepsBredOrder():
+    model = trained(count=20)
+    assert not model.ready()
+    candidates = individuals(np.random.RandomState(3).randint(-100, 100, (8, 10)), fitness=False)
+    assert model.screen(candidates, 4) == candidates[:4]
+
+
+def test_updateLeavesOutStoppedAndInfinite():
+    model = trained()
+    extra = individuals(np.random.RandomState(4).randint(-100, 100, (4, 10)))
+    extra[0].fitness.values = 1e9,               # Penalty of an early stop
+    extra[1].fitness.values = float('inf'),      # Invalid profile
+    extra[2].fitness.values = 5000.,             # Pruned lower bound
+    stopped = np.array([True, False, True, False])
+
+    reference = trained()
+    reference.update([extra[3]], [False])
+    model.update(extra, stopped)
+    assert model.samples == reference.samples == 61
+    np.testing.assert_array_equal(model.gram, reference.gram)
+    np.testing.assert_array_equal(model.weights, reference.weights)
+    np.testing.assert_allclose(model.weights[:-1] * 0.01, WEIGHTS, rtol=1e-6)
+
+
+def test_predictionErrorOnlyForSimulatedScreened():
+    model = trained()
+    candidates = individuals(np.random.RandomState(5).randint(-100, 100, (8, 10)), fitness=False)
+    chosen = model.screen(candidates, 4)
+    for ind in chosen:
+        ind.fitness.values = elapsed(ind) + 10.,
+    chosen[0].fitness.values = float('inf'),
+    model.update(chosen, [False] * 4)
+    assert model.collect()['error'] == pytest.approx(10., rel=1e-6)
+
+
+# With the surrogate off the batch evaluated GA is the plain DEAP algorithm
+@pytest.mark.usefixtures('debugRoute')
+def test_disabledSurrogateMatchesPlainGA(monkeypatch):
+    monkeypatch.setattr(config, 'SURROGATE', False)
+    monkeypatch.setattr(config, 'GA_FITNESS_CACHE', False)
+    monkeypatch.setattr(config, 'GA_GEN_NUM', 4)
+    results = []
+    for batchEval in (True, False):
+        monkeypatch.setattr(config, 'GA_BATCH_EVAL', batchEval)
+        random.seed(0)
+        np.random.seed(0)
+        pop, stats, hof = optimizer.optimize()
+        results.append((np.array(pop), hof[0].fitness.values[0]))
+    np.testing.assert_array_equal(results[0][0], results[1][0])
+    assert results[0][1] == pytest.approx(results[1][1], rel=1e-12)
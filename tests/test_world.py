@@ -0,0 +1,18 @@
+# Tests of the route simulation (world.py)
+
+import numpy as np
+import pytest
+
+import config
+
+pytestmark = pytest.mark.usefixtures('debugRoute')
+
+
+def test_copyFreeMatchesDeepCopy(monkeypatch, genomes, simulateEach):
+    population = genomes(4)
+    monkeypatch.setattr(config, 'SIM_COPY_FREE', True)
+    copyFree = simulateEach(population)
+    monkeypatch.setattr(config, 'SIM_COPY_FREE', False)
+    deepCopy = simulateEach(population)
+    assert np.all(np.isfinite(copyFree))
+    np.testing.assert_allclose(copyFree, deepCopy, rtol=1e-9)
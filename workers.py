@@ -0,0 +1,206 @@
+# Persistent evaluation worker pool
+# The pool is created once per optimization run. The compiled route, the car (array geometry and power table) and the
+# solar ephemeris table are packed into a single block of shared memory that every worker attaches to in its
+# initializer, so workers get read-only NumPy views of the parent's data instead of a pickled or forked copy each.
+# Populations are dispatched as a few chunks per worker and evaluated with batch.simulate; the time spent computing in
+# the workers against the wall time of the dispatch gives the measured speedup over a serial evaluation.
+# With config.INSTRUMENT the workers send their instrumentation counters back with every result (see instrument.py).
+
+import functools
+import multiprocessing
+import multiprocessing.sharedctypes
+import time
+
+import numpy as np
+
+import batch
+import checkpoints
+import config
+import instrument
+import sun_cache
+import world
+
+ALIGNMENT = 64      # Byte alignment of the arrays in the shared block
+START_TIMEOUT = 120.    # Time allowed for a worker to start and attach to the shared block (s)
+
+
+# Split objects into their NumPy array attributes (placed in shared memory) and the rest of their state (pickled)
+# Returns the shared block, the layout of the arrays in it and the remaining state of each object
+def pack(objects):
+    layout = []
+    states = {}
+    size = 0
+    for name, obj in objects.items():
+        if obj is None:
+            states[name] = None
+            continue
+        state = {}
+        for attr, value in vars(obj).items():
+            if isinstance(value, np.ndarray):
+                layout.append((name, attr, size, value.shape, value.dtype.str))
+                size += (value.nbytes + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+            else:
+                state[attr] = value
+        states[name] = (type(obj), state)
+
+    block = multiprocessing.sharedctypes.RawArray('b', max(size, 1))
+    buffer = np.frombuffer(block, dtype=np.uint8)
+    for name, attr, offset, shape, dtype in layout:
+        value = np.ascontiguousarray(getattr(objects[name], attr))
+        buffer[offset:offset + value.nbytes] = value.view(np.uint8).reshape(-1)
+    return block, layout, states
+
+
+# Rebuild the objects from a shared block; the arrays are read-only views of the shared memory
+def unpack(block, layout, states):
+    buffer = np.frombuffer(block, dtype=np.uint8)
+    objects = {}
+    for name, packed in states.items():
+        if packed is None:
+            objects[name] = None
+            continue
+        cls, state = packed
+        obj = cls.__new__(cls)
+        obj.__dict__.update(state)
+        objects[name] = obj
+    for name, attr, offset, shape, dtype in layout:
+        dtype = np.dtype(dtype)
+        count = int(np.prod(shape))
+        value = buffer[offset:offset + count * dtype.itemsize].view(dtype).reshape(shape)
+        value.flags.writeable = False
+        setattr(objects[name], attr, value)
+    return objects
+
+
+# Pack the current world (route, car, ephemeris table, configuration and starting conditions) for other processes
+# Returns the arguments of attachWorld
+def shareWorld():
+    block, layout, states = pack({'route': world.compiledRoute, 'car': world.solarCar,
+                                  'ephemeris': sun_cache.table if config.SUN_CACHE else None})
+    settings = {'config': dict((name, getattr(config, name)) for name in dir(config) if name.isupper()),
+                'startTime': world.startTime, 'startSoC': world.startSoC, 'startSpeed': world.startSpeed}
+    return block, layout, states, settings
+
+
+# Attach a process to a shared world and set the race starting conditions
+def attachWorld(block, layout, states, settings):
+    for name, value in settings['config'].items():
+        setattr(config, name, value)
+    objects = unpack(block, layout, states)
+    world.attachRoute(objects['route'])
+    world.solarCar = objects['car']
+    sun_cache.table = objects['ephemeris']
+
+    world.startTime = settings['startTime']
+    world.startSoC = settings['startSoC']
+    world.startSpeed = settings['startSpeed']
+    world.steps[0].gTime = world.startTime
+    world.steps[0].battSoC = world.startSoC
+    world.steps[0].speed = world.startSpeed
+    checkpoints.create(world.compiledRoute.length)
+
+
+# Worker initializer
+# The worker signals ready once it is attached so that start up is not counted as evaluation time
+def _initWorker(block, layout, states, settings, ready):
+    attachWorld(block, layout, states, settings)
+    ready.release()
+
+
+# Instrumentation counters of a worker since its last result (None when instrumentation is off)
+def _counters():
+    return instrument.collect() if config.INSTRUMENT else None
+
+
+# Evaluate one chunk of the population in a worker (see batch.simulate for the bound, trajectory and stopped)
+# Returns the results of batch.simulate, the compute (CPU) time (s), the instrumentation counters and the early
+# stopped simulations
+def _evaluateChunk(genes, bound=None, trajectory=False, stopped=False):
+    start = time.process_time()
+    eTimes = batch.simulate(genes, checkpoints.active, trajectory, bound, stopped)
+    return eTimes, time.process_time() - start, _counters(), world.collectPruneStats()
+
+
+# Elapsed race time of one individual in a worker, the instrumentation counters and the early stopped simulations
+# (see optimizer.eaSteadyStateAsync)
+def evaluateOne(genes, bound=None):
+    return world.simulate(genes, checkpoints.active, bound), _counters(), world.collectPruneStats()
+
+
+# Apply func to one item in a worker (see pool.map); returns the result, the instrumentation counters and the early
+# stopped simulations
+def _mapOne(func, item):
+    return func(item), _counters(), world.collectPruneStats()
+
+
+class pool:
+    # Create the worker processes for the current world (loaded route, car and initial conditions)
+    def __init__(self, processes=0):
+        self.processes = processes if processes > 0 else multiprocessing.cpu_count()
+        block, layout, states, settings = shareWorld()
+        self.sharedBytes = len(block)
+        ready = multiprocessing.Semaphore(0)
+        self.workers = multiprocessing.Pool(self.processes, _initWorker, (block, layout, states, settings, ready))
+        for worker in range(self.processes):
+            if not ready.acquire(timeout=START_TIMEOUT):
+                self.workers.terminate()
+                raise RuntimeError('Evaluation worker did not start within %g s' % START_TIMEOUT)
+
+        # Measurements of the evaluations dispatched so far
+        self.individuals = 0
+        self.wallTime = 0.      # Wall time of the dispatches (s)
+        self.workerTime = 0.    # Sum of the CPU time spent evaluating in the workers (s)
+
+    # Elapsed race times of a population (individuals x genes), evaluated in chunks across the workers
+    # With trajectory or stopped, the elapsed race times and the SoC at the end of every step (individuals x steps) or
+    # the mask of the individuals stopped early (see batch.simulate)
+    def evaluate(self, genes, bound=None, trajectory=False, stopped=False):
+        genes = np.asarray(genes, dtype=np.float64)
+        if len(genes) == 0:
+            return batch.simulate(genes, trajectory=trajectory, bound=bound, stopped=stopped)
+        start = time.perf_counter()
+        chunks = np.array_split(genes, min(self.processes * config.GA_POOL_CHUNKS, len(genes)))
+        results = self.workers.starmap(_evaluateChunk, [(chunk, bound, trajectory, stopped) for chunk in chunks],
+                                       chunksize=1)
+        self.wallTime += time.perf_counter() - start
+        self.workerTime += sum(seconds for eTimes, seconds, counters, pruned in results)
+        self.individuals += len(genes)
+        for eTimes, seconds, counters, pruned in results:
+            instrument.merge(counters)
+            world.mergePruneStats(pruned)
+        if trajectory or stopped:
+            return tuple(np.concatenate(parts) for parts in zip(*[result[0] for result in results]))
+        return np.concatenate([eTimes for eTimes, seconds, counters, pruned in results])
+
+    # Map a function over the workers (per individual evaluation, see optimizer.mapPool)
+    def map(self, func, iterable):
+        items = list(iterable)
+        chunksize = max(1, -(-len(items) // (self.processes * config.GA_POOL_CHUNKS)))
+        results = self.workers.map(functools.partial(_mapOne, func), items, chunksize=chunksize)
+        for result, counters, pruned in results:
+            instrument.merge(counters)
+            world.mergePruneStats(pruned)
+        return [result for result, counters, pruned in results]
+
+    # Measured speedup of the dispatched evaluations over evaluating them serially in one process
+    def speedup(self):
+        return self.workerTime / self.wallTime if self.wallTime > 0 else 0.
+
+    def report(self):
+        return ('Evaluation pool: %d workers, %d individuals, %.1f kB shared, %.3f s wall, %.3f s compute, '
+                'speedup %.2fx' % (self.processes, self.individuals, self.sharedBytes / 1024., self.wallTime,
+                                   self.workerTime, self.speedup()))
+
+    # Stop the workers and wait for them to exit
+    def close(self):
+        if self.workers is not None:
+            self.workers.close()
+            self.workers.join()
+            self.workers = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+        return False
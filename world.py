@@ -2,18 +2,36 @@
 # the world information. Helper functions are provided in this class to load and manipulate world parameters.
 
 import copy
+import time
 import numpy as np
 import xml.etree.ElementTree as ET
 from datetime import datetime
+from datetime import timedelta
 
 import car
 import config
+import genome
+import instrument
+import route
+import solver
 import step
+import sun_cache
 from world_helpers import haversine
+from world_helpers import toSeconds
 
 g = 9.81  # Gravitational acceleration constant
 steps = []  # Steps container
 solarCar = {}  # Solar car container
+compiledRoute = None  # Immutable struct-of-arrays view of steps shared by all evaluations
+simState = None  # Preallocated per-evaluation state of the copy-free simulation
+cursor = None  # Step object reused along the route by the copy-free simulation
+remainingTime = None  # Lower bound of the elapsed time still needed after each step of compiledRoute (s)
+pruneStats = {'aborted': 0, 'pruned': 0, 'invalid': 0, 'savedSteps': 0}  # Simulations stopped early (see countStopped)
+
+# Starting conditions of the race (see setInitialConditions)
+startTime = None
+startSoC = 0.
+startSpeed = 0.
 SL_CONTROL_STOP = 16.67  # Control stop speed limit (ms-1)
 SL_HIGHWAY = 36.1  # Highway speed limit (ms-1)
 
@@ -45,82 +63,133 @@ def createClouds():
 # input - Waypoint gpx file pathname
 # controlStops - A list of the distance markers (km) for where control stops are at in increasing trip order
 # output - preprocessed file output path and filename
-def preprocessWorld(input, controlStops):
-    processedRoot = ET.Element('Route')  # Root referenced to preprocessed root
-    csIndex = 0  # Control stop index count
-
-    tree = ET.parse(input)
-    root = tree.getroot()
-    for index, child in enumerate(root):
-        # Get the waypoint parameters
-        elevation = float(child[0].text)  # Elevation
-        lon = float(child.attrib.get('lon'))  # Longitude
-        lat = float(child.attrib.get('lat'))  # Latitude
-
-        # Process the step information on the first step
-        if index > 0:
-            # Get previous waypoint parameters
-            prevChild = root[index - 1]
-            prevElevation = float(prevChild[0].text)  # Elevation
-            prevLon = float(prevChild.attrib.get('lon'))  # Longitude
-            prevLat = float(prevChild.attrib.get('lat'))  # Latitude
-
-            # See http://www.movable-type.co.uk/scripts/latlong.html for details on calculations below
-            # Calculate heading (TESTED)
-            y = np.sin(np.deg2rad(lon - prevLon)) * np.cos(np.deg2rad(lat))
-            x = np.cos(np.deg2rad(prevLat)) * np.sin(np.deg2rad(lat)) - \
-                np.sin(np.deg2rad(prevLat) * np.cos(np.deg2rad(lat))) * np.cos(np.deg2rad(lon - prevLon))
-            heading = (np.rad2deg(np.arctan2(y, x)) + 360) % 360
-
-            # Set global speed limit
-            speedLimit = SL_HIGHWAY  # Default value for the speed limit for a step
-
-            # Set step type
-            stepType = 0
-
-            # Calculate step distance and add to total trip
-            dist = haversine((prevLat, prevLon), (lat, lon))
-            if index == 1:
-                trip = dist
-            else:
-                prevTrip = float(processedRoot[index - 2].attrib.get('trip'))
-                trip = prevTrip + dist
-
-                # Set speed limit after control stop
-                if processedRoot[index - 2].attrib.get('stepType') == '1':
-                    speedLimit = SL_CONTROL_STOP
-
-                if (csIndex < len(controlStops)) and (trip > controlStops[csIndex] * 1000. > prevTrip):
-                    # A control stop has hit
-                    processedRoot[index - 2].set('speedLimit',
-                                                 str(SL_CONTROL_STOP))  # set the speed limit before the control stop
-                    speedLimit = SL_CONTROL_STOP  # Set current step speed limit
-                    stepType = 1  # Set step to be a control stop type
-                    csIndex = csIndex + 1
-
-            # Calculate inclination
-            inclination = np.rad2deg(np.arctan2(elevation - prevElevation, dist))
-
-            # Set Timezone
-            timezone = 9.5  # We used a universal time based on the start line in Darwin (event time)
-
-            # Add node to processedRoot
-            b = ET.SubElement(processedRoot, 'step')
-            b.set('lat', str(lat))
-            b.set('lon', str(lon))
-            b.set('heading', str(heading))
-            b.set('inclination', str(inclination))
-            b.set('dist', str(dist))
-            b.set('trip', str(trip))
-            b.set('timezone', str(timezone))
-            b.set('speedLimit', str(speedLimit))
-            b.set('stepType', str(stepType))
-
-    # Write processedRoot into XML file
-    newTree = ET.ElementTree(processedRoot)
-    newTree.write('./Data/WSC.route')
-
-    return processedRoot
+# The waypoints are streamed (see streamRoute) and the steps are written to the output file as they are produced, so
+# the whole track is never held as an XML tree. Returns the route columns (see route.route).
+def preprocessWorld(input, controlStops, output='./Data/WSC.route'):
+    chunks = []
+    with open(output, 'w') as f:
+        f.write('<Route>')
+        for chunk in streamRoute(input, controlStops):
+            for values in zip(*[chunk[column].tolist() for column in PREPROCESS_COLUMNS]):
+                f.write('<step ' + ' '.join('%s="%s"' % item for item in zip(PREPROCESS_COLUMNS, values)) + ' />')
+            chunks.append(chunk)
+        f.write('</Route>')
+
+    columns = dict((column, np.concatenate([chunk[column] for chunk in chunks]) if chunks else np.zeros(0))
+                   for column in PREPROCESS_COLUMNS)
+    for column in route.route.COLUMNS:
+        columns.setdefault(column, np.full(len(columns['lat']), route.route.DEFAULTS.get(column, 0.)))
+    return route.route(columns)
+
+
+# Step attributes written by preprocessWorld (in file order)
+PREPROCESS_COLUMNS = ('lat', 'lon', 'heading', 'inclination', 'dist', 'trip', 'timezone', 'speedLimit', 'stepType')
+
+
+# Generator of the preprocessed route steps in chunks (dictionaries of column arrays) from a waypoint gpx file
+# Waypoints are read with iterparse and discarded once processed; each chunk of config.PREPROCESS_CHUNK waypoints is
+# processed with array operations. The last step of a chunk is held back until the next chunk because a control stop
+# at the start of that chunk lowers its speed limit.
+def streamRoute(input, controlStops):
+    state = {'prev': None,      # Last waypoint (lat, lon, elevation) of the previous chunk
+             'trip': 0.,        # Trip (m) at the end of the previous chunk
+             'csIndex': 0,      # Next control stop to place
+             'nextStop': 1,     # First step the next control stop can be placed on
+             'steps': 0,        # Number of steps processed
+             'held': None}      # Step held back from the previous chunk
+    waypoints = []
+    depth = 0
+    root = None
+    for event, elem in ET.iterparse(input, events=('start', 'end')):
+        if event == 'start':
+            if root is None:
+                root = elem
+            depth += 1
+            continue
+        depth -= 1
+        if depth == 1:
+            # Get the waypoint parameters
+            waypoints.append((float(elem.attrib.get('lat')), float(elem.attrib.get('lon')), float(elem[0].text)))
+            if len(waypoints) == config.PREPROCESS_CHUNK:
+                root.clear()    # Discard the processed waypoint elements
+                chunk = _processWaypoints(waypoints, controlStops, state)
+                waypoints = []
+                if chunk is not None:
+                    yield chunk
+
+    chunk = _processWaypoints(waypoints, controlStops, state)
+    if chunk is not None:
+        yield chunk
+    if state['held'] is not None:
+        yield state['held']
+
+
+# Process one chunk of waypoints [(lat, lon, elevation)] into steps, continuing from the state of the previous chunk
+def _processWaypoints(waypoints, controlStops, state):
+    if len(waypoints) == 0:
+        return None
+    points = np.array(waypoints, dtype=np.float64)
+    if state['prev'] is not None:
+        points = np.vstack((state['prev'], points))
+    state['prev'] = points[-1]
+    if len(points) < 2:
+        return None     # The first waypoint only starts the route
+
+    prevLat, prevLon, prevElevation = points[:-1, 0], points[:-1, 1], points[:-1, 2]
+    lat, lon, elevation = points[1:, 0], points[1:, 1], points[1:, 2]
+
+    # See http://www.movable-type.co.uk/scripts/latlong.html for details on calculations below
+    # Calculate heading (TESTED)
+    y = np.sin(np.deg2rad(lon - prevLon)) * np.cos(np.deg2rad(lat))
+    x = np.cos(np.deg2rad(prevLat)) * np.sin(np.deg2rad(lat)) - \
+        np.sin(np.deg2rad(prevLat) * np.cos(np.deg2rad(lat))) * np.cos(np.deg2rad(lon - prevLon))
+    heading = (np.rad2deg(np.arctan2(y, x)) + 360) % 360
+
+    # Calculate step distance and add to total trip (summed in order, as a running total)
+    dist = haversine((prevLat, prevLon), (lat, lon))
+    trip = np.cumsum(np.concatenate(([state['trip']], dist)))[1:]
+    stepTrip = np.concatenate(([state['trip']], trip))     # Trip before each step (index) and after (index + 1)
+    state['trip'] = trip[-1]
+
+    # Calculate inclination
+    inclination = np.rad2deg(np.arctan2(elevation - prevElevation, dist))
+
+    # Set step type; a control stop is placed on the step passing its distance marker. Markers are taken in order from
+    # the step after the previous control stop and a marker that cannot be placed there blocks the remaining ones.
+    # The first step of the route is never a control stop.
+    stepType = np.zeros(len(dist), dtype=int)
+    while state['csIndex'] < len(controlStops):
+        marker = controlStops[state['csIndex']] * 1000.
+        index = int(np.searchsorted(trip, marker, side='right'))
+        if index >= len(dist):
+            break   # Beyond this chunk
+        if state['steps'] + index < state['nextStop'] or not trip[index] > marker > stepTrip[index]:
+            state['csIndex'] = len(controlStops)    # Unplaceable marker
+            break
+        stepType[index] = 1
+        state['nextStop'] = state['steps'] + index + 1
+        state['csIndex'] += 1
+    state['steps'] += len(dist)
+
+    # Set speed limit: control stop steps and the steps on either side of them
+    speedLimit = np.full(len(dist), SL_HIGHWAY)
+    afterStop = np.concatenate(([state['held'] is not None and state['held']['stepType'][0] == 1], stepType[:-1] == 1))
+    speedLimit[(stepType == 1) | afterStop] = SL_CONTROL_STOP
+    speedLimit[:-1][stepType[1:] == 1] = SL_CONTROL_STOP
+
+    chunk = {'lat': lat, 'lon': lon, 'heading': heading, 'inclination': inclination, 'dist': dist, 'trip': trip,
+             'timezone': np.full(len(dist), 9.5),   # We used a universal time based on the start line in Darwin
+             'speedLimit': speedLimit, 'stepType': stepType}
+
+    # Release the step held from the previous chunk (its speed limit drops before a control stop on our first step)
+    held = state['held']
+    if held is not None and stepType[0] == 1:
+        held['speedLimit'] = np.array([SL_CONTROL_STOP])
+    state['held'] = dict((column, values[-1:]) for column, values in chunk.items())
+    chunk = dict((column, values[:-1]) for column, values in chunk.items())
+    if held is not None:
+        chunk = dict((column, np.concatenate((held[column], chunk[column]))) for column in chunk)
+    return chunk
 
 
 # Polls weather API to get the updates for all the weather data in the
@@ -188,27 +257,139 @@ def loadDebugData(input):
             tempStep.wind = [0., 0.]
         steps.append(tempStep)
         stepNum = stepNum + 1
+
+    compileRoute()
+    return
+
+
+# Loads the steps from a compiled route directory (see route.save / route.compileXml)
+# The route columns stay memory mapped; only the step objects of the legacy simulation are created
+def loadCompiledData(path):
+    rt = route.load(path)
+    if config.EN_WIND == False:
+        columns = dict((column, getattr(rt, column)) for column in route.route.COLUMNS)
+        columns['windSpd'] = np.zeros(rt.length)
+        columns['windDir'] = np.zeros(rt.length)
+        rt = route.route(columns)
+
+    attachRoute(rt)
+    return
+
+
+# Use an already compiled route (eg. a memory mapped or shared memory one) as the world
+# Step objects are created for the legacy simulation along with the copy-free simulation containers
+def attachRoute(rt):
+    global steps, compiledRoute, simState, cursor, remainingTime
+    compiledRoute = rt
+    remainingTime = remainingTimeBound(rt)
+    steps = []
+    for index in range(rt.length):
+        tempStep = step.step(index + 1, 0., [0., 0.], 0., 0., 0., 0., 0., 0., [0., 0.], 0, 0.)
+        tempStep.loadRoute(rt, index)
+        steps.append(tempStep)
+
+    simState = route.state(compiledRoute.length)
+    cursor = step.step(0, 0., [0., 0.], 0., 0., 0., 0., 0., 0., [0., 0.], 0, 0.)
+    return
+
+
+# Lower bound of the elapsed time still needed after each step: the remaining steps driven at their speed limits
+# (scaled by config.SIM_PRUNE_SPEED_FACTOR); control and end of day stops do not count towards the elapsed time
+def remainingTimeBound(rt):
+    stepTime = np.asarray(rt.dist, dtype=np.float64) / (np.asarray(rt.speedLimit) * config.SIM_PRUNE_SPEED_FACTOR)
+    return np.append(np.cumsum(stepTime[::-1])[::-1][1:], 0.)
+
+
+# Record a simulation stopped after step index; a failure at the last step stops nothing
+# kind is 'aborted' (constraint violated) or 'pruned' (bound exceeded, see step.checkConstraints), or 'invalid' when
+# the car cannot traverse the step at all (see car.calcStepTime)
+def countStopped(index, kind):
+    saved = compiledRoute.length - index - 1
+    if saved > 0:
+        pruneStats[kind] += 1
+        pruneStats['savedSteps'] += saved
+
+
+# Simulations stopped early since the last collect, which are cleared
+def collectPruneStats():
+    stats = dict(pruneStats)
+    for key in pruneStats:
+        pruneStats[key] = 0
+    return stats
+
+
+# Add the stopped simulations counted in another process
+def mergePruneStats(stats):
+    for key, value in stats.items():
+        pruneStats[key] += value
+
+
+# Compile the loaded steps into the shared route and allocate the copy-free simulation containers
+def compileRoute():
+    global compiledRoute, simState, cursor, remainingTime
+    compiledRoute = route.fromSteps(steps)
+    remainingTime = remainingTimeBound(compiledRoute)
+    simState = route.state(compiledRoute.length)
+    cursor = step.step(0, 0., [0., 0.], 0., 0., 0., 0., 0., 0., [0., 0.], 0, 0.)
     return
 
 
 # Set the starting conditions of the race (date, time, speed etc.)
 def setInitialConditions():
+    global startTime, startSoC, startSpeed
     dt = datetime(2017, 10, 8, 12, 55)
     steps[0].gTime = dt
     steps[0].battSoC = 100. # Full battery pack
     steps[0].speed = 21.    # DEBUG
 
+    startTime = steps[0].gTime
+    startSoC = steps[0].battSoC
+    startSpeed = steps[0].speed
+
+    if config.SUN_CACHE:
+        sun_cache.build(compiledRoute, startTime)
+
 # Simulate the car driving the entire course of the race route with a battery power profile candidate as input
-def simulate(pbatt_candidate):
+# With a checkpoint store (see checkpoints.py) the copy-free simulation resumes after the steps shared with a previously
+# simulated profile
+# The simulation stops early with a penalized elapsed time when the profile violates the constraints or, given a bound
+# (eg. the best elapsed time so far), when it can no longer finish within the bound (see step.checkConstraints)
+def simulate(pbatt_candidate, checkpoints=None, bound=None):
+    start = time.perf_counter() if config.INSTRUMENT else 0.
+    try:
+        if config.SIM_COPY_FREE:
+            return simulateCopyFree(pbatt_candidate, checkpoints, bound)
+        return simulateDeepCopy(pbatt_candidate, bound)
+    except solver.SolverError:
+        # The car cannot traverse the route with this profile; invalidate the result
+        return float('inf')
+    finally:
+        if config.INSTRUMENT:
+            instrument.timed('world.simulate', start)
+
+
+# Simulate the race on deep copies of the car and the world
+def simulateDeepCopy(pbatt_candidate, bound=None):
     # Make deep copy of the exemplar to run multithread
+    start = time.perf_counter() if config.INSTRUMENT else 0.
     tempSolarCar = copy.deepcopy(solarCar)
     tempWorld = copy.deepcopy(steps)
+    if config.INSTRUMENT:
+        instrument.timed('world.deepcopy', start)
+    stepPower = genome.expand(pbatt_candidate)
 
     for index, stp in enumerate(tempWorld):
-        stp.pbattExp = 360.     # DEBUG: Make sure this value is higher than the rolling resistance value; or the mathematics may fail!
-        stp.pbatt = stp.pbattExp + pbatt_candidate[index - 1]
+        stp.pbattExp = config.PBATT_EXPECTED
+        stp.pbatt = stp.pbattExp + stepPower[index]
         # stp.pbatt = stp.pbattExp    # DEBUG
-        stp.advanceStep(tempSolarCar)
+        try:
+            stp.advanceStep(tempSolarCar)
+        except solver.SolverError:
+            countStopped(index, 'invalid')
+            raise
+        if (config.SIM_ABORT_SOC or bound is not None) and not stp.checkConstraints(remainingTime[index], bound):
+            countStopped(index, 'aborted' if stp.battSoC < config.SIM_SOC_MIN else 'pruned')
+            return stp.eTime
 
         # Copy state variables
         if index < len(tempWorld) - 1:
@@ -218,3 +399,62 @@ def simulate(pbatt_candidate):
             tempWorld[index + 1].battSoC = stp.battSoC
 
     return tempWorld[-1].eTime
+
+
+# Simulate the race without copying the car or the world
+# The route is read from the shared compiledRoute, a single step cursor carries the state from one step to the next and
+# the state at the end of every step is recorded into the preallocated simState arrays
+def simulateCopyFree(pbatt_candidate, checkpoints=None, bound=None):
+    stp = cursor
+    stp.eTime = 0.
+    stp.gTime = startTime
+    stp.battSoC = startSoC
+    stp.speed = startSpeed
+    stp.stepTime = 0.
+    stp.pin = 0.
+    stp.pout = 0.
+
+    stepPower = genome.expand(pbatt_candidate)
+    start = 0
+    if checkpoints is not None:
+        stepGenes = stepPower[np.newaxis]
+        record = dict((field, np.empty((1, compiledRoute.length))) for field in checkpoints.FIELDS)
+        current = dict((field, np.zeros(1)) for field in checkpoints.FIELDS)
+        start = int(checkpoints.resume(stepGenes, record, current)[0])
+        if start > 0:
+            stp.speed = float(current['speed'][0])
+            stp.battSoC = float(current['battSoC'][0])
+            stp.eTime = float(current['eTime'][0])
+            stp.gTime = startTime + timedelta(seconds=float(current['offset'][0]))
+            # Shared steps of the recorded state (the input power of these steps is not kept)
+            simState.speed[:start] = record['speed'][0, :start]
+            simState.battSoC[:start] = record['battSoC'][0, :start]
+            simState.eTime[:start] = record['eTime'][0, :start]
+            simState.gTime[:start] = record['offset'][0, :start] + toSeconds(startTime)
+            simState.stepTime[:start] = np.diff(record['eTime'][0, :start], prepend=0.)
+            simState.pin[:start] = np.nan
+
+    for index in range(start, compiledRoute.length):
+        stp.loadRoute(compiledRoute, index)
+        stp.pbattExp = config.PBATT_EXPECTED
+        stp.pbatt = stp.pbattExp + stepPower[index]
+        try:
+            stp.advanceStep(solarCar)
+        except solver.SolverError:
+            countStopped(index, 'invalid')
+            raise
+        simState.record(index, stp)
+        if (config.SIM_ABORT_SOC or bound is not None) and not stp.checkConstraints(remainingTime[index], bound):
+            countStopped(index, 'aborted' if stp.battSoC < config.SIM_SOC_MIN else 'pruned')
+            if checkpoints is not None:
+                stepGenes[0, index:] = np.nan   # Resume before the failed step so that it is checked again
+            break
+
+    if checkpoints is not None:
+        record['speed'][0] = simState.speed
+        record['battSoC'][0] = simState.battSoC
+        record['eTime'][0] = simState.eTime
+        record['offset'][0] = simState.gTime - toSeconds(startTime)
+        record['valid'][0] = 1.
+        checkpoints.save(stepGenes, record)
+    return stp.eTime
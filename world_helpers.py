@@ -1,7 +1,10 @@
 # Mathematical and world helpers
 import numpy as np
+from datetime import datetime
+from datetime import timedelta
 
 AVG_EARTH_RADIUS = 6371  # in km
+EPOCH = datetime(1970, 1, 1)  # Reference for global times stored as plain numbers (naive, race local time)
 
 # Euler-Rodrigues formula for rotation in 3D in an axis
 def rotation_matrix(axis, theta):
@@ -46,3 +49,13 @@ def haversine(point1, point2):
     h = 2 * AVG_EARTH_RADIUS * np.arcsin(np.sqrt(d)) * 1000
     return h  # in meters
 
+
+
+# Convert a global time to the number of seconds since EPOCH
+def toSeconds(gTime):
+    return (gTime - EPOCH).total_seconds()
+
+
+# Convert a number of seconds since EPOCH back to a global time
+def fromSeconds(seconds):
+    return EPOCH + timedelta(seconds=seconds)